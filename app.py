@@ -1,18 +1,35 @@
+import csv
 import io
 import logging
 import os
+import queue
+import tempfile
+import threading
+import time
 import uuid
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, date, timedelta
 from logging.handlers import RotatingFileHandler
 
-import pandas as pd
 import psycopg2
 import psycopg2.extras
-import pytz
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, redirect, url_for, session, g, jsonify, send_file, flash
+from flask import Flask, render_template, request, redirect, url_for, session, g, jsonify, send_file, flash, \
+    Response, stream_with_context
+from markupsafe import Markup
 from werkzeug.security import check_password_hash, generate_password_hash
 
+import metrics
+from booking_import import BOOKING_HEADERS, BOOKING_SHEET, GUEST_HEADERS, GUEST_SHEET, ImportFileError, \
+    ImportRejected, check_import, merge_import, prepare_import, read_import_file, stage_import
+from change_feed import ChangeFeed, format_event
+from export_jobs import JOB_ID_PATTERN, ExportJobs
+from db_pool import ConnectionPool, InstrumentedConnection, PoolError, QueryStats
+from models import Booking, Guest, CALENDAR_COLUMNS, CARD_COLUMNS, EXPORT_FIELDS, PRICING_COLUMNS, select_list
+from pricing import WEEKEND_DAYS, load_tariff
+
 load_dotenv()
 app = Flask(__name__)
 
@@ -20,58 +37,187 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL ist nicht gesetzt!")
 
-# Erstelle das Passwort-Hash
-hashed_password = generate_password_hash("Rossboden2025?")
-is_correct = check_password_hash(hashed_password, "Rossboden2025?")
-
-
-# Fehlerbehandlung für die Verbindung zur DB
-def test_connection():
-    try:
-        connection = psycopg2.connect(DATABASE_URL, sslmode='require')
-        print("Verbindung erfolgreich!")
-        cursor = connection.cursor()
-        cursor.execute("SELECT version();")  # Überprüfe, ob die Datenbankversion abgerufen werden kann
-        db_version = cursor.fetchone()
-        print(f"Datenbankversion: {db_version}")
-        connection.close()
-    except Exception as e:
-        print(f"Fehler bei der Verbindung zur Datenbank: {e}")
-
-
-test_connection()
-
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'default_key')
 
 if not app.debug:
     file_handler = RotatingFileHandler('error.log', maxBytes=10240, backupCount=10)
-    file_handler.setLevel(logging.ERROR)
+    file_handler.setLevel(logging.WARNING)  # Warnungen enthalten auch langsame Abfragen
     app.logger.addHandler(file_handler)
 
-# Verwende datetime.now() und stelle sicher, dass UTC-Zeit verwendet wird
-utc_time = datetime.now(pytz.utc)
-
-# Konvertiere die Zeit in die gewünschte Zeitzone (z.B. Europe/Zurich)
-local_time = utc_time.astimezone(pytz.timezone('Europe/Zurich'))
-
-# Formatieren des Datums im ISO 8601-Format
-formatted_date = local_time.strftime("%Y-%m-%dT%H:%M:%S")
+# Abfragen, die länger dauern, werden ins Log geschrieben
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+# Abfragestatistik unten auf jeder Seite anzeigen (im Debug-Modus immer)
+QUERY_DEBUG = os.getenv('QUERY_DEBUG', '0') == '1'
+
+# Verbindungspool, wird pro Worker-Prozess erst bei der ersten Anfrage erstellt
+_db_pool = None
+_db_pool_pid = None
+_db_pool_lock = threading.Lock()
+
+
+def get_db_pool():
+    global _db_pool, _db_pool_pid
+    # Nach einem Fork (gunicorn --preload) darf der Pool des Elternprozesses nicht weiterverwendet werden.
+    # Das Lock verhindert, dass parallele Threads (gthread) im selben Worker je einen eigenen Pool bauen
+    if _db_pool is not None and _db_pool_pid == os.getpid():
+        return _db_pool
+    with _db_pool_lock:
+        if _db_pool is not None and _db_pool_pid == os.getpid():
+            return _db_pool
+        _db_pool = ConnectionPool(
+            DATABASE_URL,
+            minconn=int(os.getenv('DB_POOL_MIN', 1)),
+            maxconn=int(os.getenv('DB_POOL_MAX', 5)),
+            max_uses=int(os.getenv('DB_POOL_MAX_USES', 1000)),
+            idle_timeout=float(os.getenv('DB_POOL_IDLE_TIMEOUT', 300)),
+            health_check_after=float(os.getenv('DB_POOL_HEALTH_CHECK_AFTER', 30)),
+            checkout_timeout=float(os.getenv('DB_POOL_CHECKOUT_TIMEOUT', 10)),
+            connection_factory=InstrumentedConnection,
+            sslmode=os.getenv('DB_SSLMODE', 'require')
+        )
+        _db_pool_pid = os.getpid()
+        return _db_pool
 
 
 # Funktion, um die Datenbankverbindung herzustellen
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = psycopg2.connect(DATABASE_URL, sslmode='require')
+        # Der Pool wird mitgemerkt, damit die Verbindung an genau den Pool zurückgeht, aus dem sie stammt
+        g._db_pool = get_db_pool()
+        db = g._database = g._db_pool.getconn()
         db.autocommit = True  # Setzt autocommit auf True
+        db.query_stats = get_query_stats()
     return db
 
 
+def get_query_stats():
+    if 'query_stats' not in g:
+        g.query_stats = QueryStats(SLOW_QUERY_MS / 1000, app.logger)
+    return g.query_stats
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def add_server_timing(response):
+    # Abfrageanzahl und DB-Zeit der Anfrage für die Entwicklertools des Browsers
+    stats = g.get('query_stats')
+    timings = []
+    if stats is not None:
+        timings.append(f'db;dur={stats.total * 1000:.1f};desc="{stats.count} queries"')
+    if 'request_started' in g:
+        timings.append(f'app;dur={(time.perf_counter() - g.request_started) * 1000:.1f}')
+    if timings:
+        response.headers['Server-Timing'] = ', '.join(timings)
+    return response
+
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    if endpoint in ('static', 'prometheus_metrics') or 'request_started' not in g:
+        return response
+    metrics.REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+    metrics.REQUEST_DURATION.labels(endpoint, request.method).observe(time.perf_counter() - g.request_started)
+    stats = g.get('query_stats')
+    metrics.REQUEST_QUERIES.labels(endpoint).observe(stats.count if stats is not None else 0)
+    if stats is not None:
+        metrics.REQUEST_DB_DURATION.labels(endpoint).observe(stats.total)
+    return response
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    data, content_type = metrics.render()
+    return Response(data, content_type=content_type)
+
+
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        # Verbindung zurück in den Pool; offene Transaktionen werden dort zurückgerollt
+        db.query_stats = None
+        pool = g.pop('_db_pool')
+        pool.putconn(db)
+        metrics.observe_pool(pool)
+
+
+@contextmanager
+def transaction():
+    # Schreibvorgänge, die zusammengehören, laufen in einer Transaktion; bei einem Fehler wird alles zurückgerollt
+    db = get_db()
+    db.autocommit = False
+    try:
+        yield db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        db.autocommit = True
+
+
+def lock_room(cursor, room):
+    # Sperrt das Zimmer bis zum Ende der Transaktion, damit parallele Buchungen die Belegungsprüfung nicht umgehen
+    cursor.execute('SELECT name FROM rooms WHERE name = %s FOR UPDATE', (room,))
+    return cursor.fetchone() is not None
+
+
+def form_guests(data, first, last):
+    # Mitreisende aus den Formularfeldern guest_name_i / guest_birth_i als Liste von (Name, Geburtsdatum)
+    guests = []
+    for i in range(first, last + 1):
+        guest_name = data.get(f'guest_name_{i}')
+        guest_birth = data.get(f'guest_birth_{i}')
+        if guest_name and guest_birth:
+            guests.append((guest_name, safe_parse_date(guest_birth)))
+    return guests
+
+
+def insert_guests(cursor, booking_id, guests):
+    if guests:
+        psycopg2.extras.execute_values(cursor, 'INSERT INTO guests (booking_id, name, birthdate) VALUES %s',
+                                       [(booking_id, name, birthdate) for name, birthdate in guests])
+
+
+def sync_guests(cursor, booking_id, guests):
+    # Gleicht die Mitreisenden mit dem Formular ab: unveränderte Zeilen bleiben stehen,
+    # nur entfernte werden gelöscht und neue eingefügt
+    cursor.execute('SELECT id, name, birthdate FROM guests WHERE booking_id = %s', (booking_id,))
+    wanted = Counter(guests)
+    removed = []
+    for guest_id, name, birthdate in cursor.fetchall():
+        if wanted[(name, birthdate)] > 0:
+            wanted[(name, birthdate)] -= 1
+        else:
+            removed.append(guest_id)
+    if removed:
+        cursor.execute('DELETE FROM guests WHERE id = ANY(%s)', (removed,))
+    insert_guests(cursor, booking_id, list(wanted.elements()))
+
+
+@app.route('/healthz')
+def healthz():
+    # Bereitschaftsprüfung: prüft die Datenbankverbindung erst auf Anfrage statt beim Import
+    try:
+        cursor = get_db().cursor()
+        cursor.execute("SELECT version();")  # Überprüfe, ob die Datenbankversion abgerufen werden kann
+        db_version = cursor.fetchone()[0]
+    except (psycopg2.Error, PoolError) as e:
+        app.logger.error(f"Fehler bei der Verbindung zur Datenbank: {e}")
+        return jsonify({'status': 'error', 'database': str(e)}), 503
+    return jsonify({'status': 'ok', 'database': db_version})
+
+
+@app.errorhandler(PoolError)
+def handle_pool_error(error):
+    app.logger.error(f"Keine Datenbankverbindung verfügbar: {error} ({get_db_pool().stats()})")
+    return "Der Server ist ausgelastet, bitte versuchen Sie es erneut.", 503
 
 
 @app.context_processor
@@ -81,55 +227,169 @@ def inject_admin_status():
 
 @app.context_processor
 def inject_user():
-    user_name = None
-    if 'user_id' in session:
-        db = get_db()
-        cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.execute("SELECT username FROM users WHERE id = %s", (session['user_id'],))
-        user = cursor.fetchone()
-        if user:
-            user_name = user['username']
-    return dict(user_name=user_name)
+    # Der Benutzername steht seit dem Login in der Session (siehe refresh_identity)
+    return dict(user_name=session.get('user') if 'user_id' in session else None)
 
 
-# Beispiel einer SQL-Anpassung für PostgreSQL
-def get_rooms():
+@app.context_processor
+def inject_query_stats():
+    return dict(query_stats=get_query_stats() if app.debug or QUERY_DEBUG else None)
+
+
+class CachedValue:
+    # Prozessweiter Cache für einen einzelnen Wert mit Ablaufzeit und expliziter Invalidierung
+    def __init__(self, name, loader, ttl):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._value = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+                self.hits += 1
+                metrics.CACHE_REQUESTS.labels(self.name, 'hit').inc()
+                return self._value
+            self.misses += 1
+            metrics.CACHE_REQUESTS.labels(self.name, 'miss').inc()
+            self._value = self.loader()
+            self._loaded_at = time.monotonic()
+            return self._value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+            self._loaded_at = None
+
+
+# Versionsstand der Benutzertabelle (per Trigger hochgezählt); wird nur kurz zwischengespeichert,
+# damit Umbenennungen, Rechteänderungen und Löschungen auch in anderen Workern schnell greifen
+_users_version_cache = CachedValue('users_version', lambda: get_change_version('users')[0],
+                                   ttl=float(os.getenv('IDENTITY_CACHE_TTL', 30)))
+
+
+def store_identity(user, version):
+    session['user_id'] = user['id']
+    session['user'] = user['username']
+    session['is_admin'] = user['is_admin']
+    session['identity_version'] = version
+
+
+@app.before_request
+def refresh_identity():
+    # Die Identität wird beim Login in die signierte Session geschrieben und nur neu geladen,
+    # wenn sich die Benutzertabelle seither geändert hat
+    if 'user_id' not in session or request.endpoint in ('static', 'healthz'):
+        return
+    version = _users_version_cache.get()
+    if session.get('identity_version') == version:
+        return
+
     db = get_db()
     cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT * FROM rooms")
-    rows = cursor.fetchall()
-    rooms = {row[1]: row[3] for row in
-             rows}  # Erstelle ein Dictionary aus Name und Kapazität (row[2] ist die Kapazität)
-    return rooms
+    cursor.execute("SELECT id, username, is_admin FROM users WHERE id = %s", (session['user_id'],))
+    user = cursor.fetchone()
+    if user is None:
+        # Benutzer wurde gelöscht
+        session.clear()
+        return
+    store_identity(user, version)
 
 
-def get_room_data():
+# Farbklassen der Zimmer im Kalender (static/css/styles.css)
+ROOM_CSS_CLASSES = {
+    "Doppelzimmer": "room-doppel",
+    "4er-Zimmer 1": "room-vz1",
+    "4er-Zimmer 2": "room-vz2",
+    "6er-Zimmer 1": "room-sz1",
+    "6er-Zimmer 2": "room-sz2"
+}
+
+Room = namedtuple('Room', 'name type capacity css_class')
+
+
+def load_room_catalogue():
     db = get_db()
     cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT * FROM rooms")
-    rooms = cursor.fetchall()
-    room_dict = {room[1]: room[2] for room in rooms}  # Nutzen der richtigen Indizes für die Daten
-    group_map = {room[1]: room[3] for room in rooms}
+    cursor.execute("SELECT name, type, capacity FROM rooms ORDER BY id")
+    return {row['name']: Room(row['name'], row['type'], row['capacity'] or 0,
+                              ROOM_CSS_CLASSES.get(row['name'], 'default-room'))
+            for row in cursor.fetchall()}
+
+
+# Die Zimmer ändern sich praktisch nie; sie werden pro Prozess zwischengespeichert
+_room_cache = CachedValue('rooms', load_room_catalogue, ttl=float(os.getenv('ROOM_CACHE_TTL', 3600)))
+
+
+def get_room_catalogue():
+    return _room_cache.get()
+
+
+def invalidate_room_catalogue():
+    _room_cache.invalidate()
+
+
+def get_rooms():
+    # Dictionary aus Name und Kapazität
+    return {room.name: room.capacity for room in get_room_catalogue().values()}
+
+
+def get_room_data():
+    # Dictionary aus Name und Kapazität sowie aus Name und Zimmertyp
+    rooms = get_room_catalogue().values()
+    room_dict = {room.name: room.capacity for room in rooms}
+    group_map = {room.name: room.type for room in rooms}
     return room_dict, group_map
 
 
-def get_age_distribution(booking_id, main_birthdate):
-    today = date.today()
-    ages = []
-    if main_birthdate:
-        ages.append(datetime.strptime(main_birthdate, "%Y-%m-%d").date())
+def load_guest_birthdates(booking_ids):
+    # Lädt die Geburtsdaten aller Mitreisenden für mehrere Buchungen mit einer einzigen Abfrage
+    birthdates = {booking_id: [] for booking_id in booking_ids}
+    if not birthdates:
+        return birthdates
 
     db = get_db()
     cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute('SELECT birthdate FROM guests WHERE booking_id = %s', (booking_id,))
-    guests = cursor.fetchall()
-    for g in guests:
-        if g[0]:
-            ages.append(datetime.strptime(g[0], "%Y-%m-%d").date())
+    cursor.execute('SELECT booking_id, birthdate FROM guests WHERE booking_id = ANY(%s::uuid[])',
+                   (list(birthdates),))
+    for row in cursor.fetchall():
+        birthdates.setdefault(row['booking_id'], []).append(row['birthdate'])
+    return birthdates
+
 
+def load_guests(booking_ids):
+    # Mitreisende mehrerer Buchungen mit einer Abfrage (Export)
+    guests = {booking_id: [] for booking_id in booking_ids}
+    if not guests:
+        return guests
+
+    cursor = get_db().cursor()
+    cursor.execute(f'SELECT {select_list(Guest.COLUMNS)} FROM guests WHERE booking_id = ANY(%s::uuid[]) ORDER BY id',
+                   (list(guests),))
+    for row in cursor.fetchall():
+        guest = Guest.from_row(row)
+        guests.setdefault(guest.booking_id, []).append(guest)
+    return guests
+
+
+def get_guest_ages(booking_id, main_birthdate, guest_birthdates=None):
+    today = date.today()
+    # Ohne vorgeladene Geburtsdaten (siehe load_guest_birthdates) wird einzeln nachgeladen
+    if guest_birthdates is None:
+        guest_birthdates = load_guest_birthdates([booking_id])[booking_id]
+
+    # Geburtsdaten sind DATE-Spalten und kommen als datetime.date aus der Datenbank
+    birthdates = [safe_parse_date(b) for b in [main_birthdate, *guest_birthdates] if b]
+    return [(today - b).days // 365 for b in birthdates if b is not None]
+
+
+def describe_ages(ages):
     erw, kind, baby = 0, 0, 0
-    for b in ages:
-        age = (today - b).days // 365
+    for age in ages:
         if age >= 16:
             erw += 1
         elif age >= 6:
@@ -143,88 +403,307 @@ def get_age_distribution(booking_id, main_birthdate):
     return ', '.join(result), (erw, kind, baby)
 
 
-def calculate_price(arrival, departure, erw, kind, baby, hp, hp_fleisch, hp_vegi):
-    total = 0
+def get_age_distribution(booking_id, main_birthdate, guest_birthdates=None):
+    return describe_ages(get_guest_ages(booking_id, main_birthdate, guest_birthdates))
+
 
-    # Stelle sicher, dass 'arrival' und 'departure' als Strings vorliegen, falls sie als datetime.date Objekte kommen
-    arrival = str(arrival) if isinstance(arrival, date) else arrival
-    departure = str(departure) if isinstance(departure, date) else departure
+# Der Tarif wird aus den Tabellen prices, city_tax und dinner_prices geladen und erst neu gelesen, wenn der
+# Änderungszähler 'tariff' steigt (per Trigger, siehe init_db.py). Den Zähler speichert jeder Worker nur kurz
+# zwischen, damit Preisänderungen aus /admin auch in den anderen Workern schnell greifen
+_tariff_version_cache = CachedValue('tariff_version', lambda: get_change_version('tariff')[0],
+                                    ttl=float(os.getenv('TARIFF_CACHE_TTL', 30)))
+_tariff = {'current': (None, None)}
 
+
+def get_tariff(cursor=None):
+    # Mit Cursor wird der Zähler in der laufenden Transaktion gelesen und gegen Änderungen gesperrt, damit
+    # gespeicherte Preise und daily_rollup nie mit einem veralteten Tarif geschrieben werden
+    if cursor is None:
+        version = _tariff_version_cache.get()
+    else:
+        cursor.execute("SELECT version FROM change_counters WHERE name = 'tariff' FOR SHARE")
+        row = cursor.fetchone()
+        version = row[0] if row else 0
+
+    loaded_version, tariff = _tariff['current']
+    if loaded_version == version:
+        metrics.CACHE_REQUESTS.labels('tariff', 'hit').inc()
+        return tariff
+    metrics.CACHE_REQUESTS.labels('tariff', 'miss').inc()
+    tariff = load_tariff(cursor or get_db().cursor())
+    _tariff['current'] = (version, tariff)
+    return tariff
+
+
+def calculate_price(arrival, departure, ages, hp):
     arrival = safe_parse_date(arrival)
     departure = safe_parse_date(departure)
 
     if arrival is None or departure is None:
         return 0  # Rückgabe eines Standardwertes, wenn ein Fehler auftritt
 
-    d1 = datetime.strptime(str(arrival), "%Y-%m-%d")
-    d2 = datetime.strptime(str(departure), "%Y-%m-%d")
-    num_nights = (d2 - d1).days
+    tariff = get_tariff()
+    with metrics.PRICING_DURATION.labels('single').time():
+        price = tariff.price(arrival, departure, tariff.band_counts(ages), hp)
+    metrics.PRICING_BOOKINGS.labels('single').inc()
+    return price
+
+
+def calculate_prices(bookings, ages_by_booking):
+    # Preist viele Buchungen auf einmal (vektorisiert), z.B. für Dashboard und Export
+    if not bookings:
+        return []
+    tariff = get_tariff()
+    with metrics.PRICING_DURATION.labels('batch').time():
+        arrivals = [safe_parse_date(b.arrival) for b in bookings]
+        departures = [safe_parse_date(b.departure) for b in bookings]
+        counts = [tariff.band_counts(ages_by_booking[b.id]) for b in bookings]
+        hp = [b.hp == 'Ja' for b in bookings]
+        prices = tariff.price_batch(arrivals, departures, counts, hp).tolist()
+    metrics.PRICING_BOOKINGS.labels('batch').inc(len(bookings))
+    return prices
+
+
+def stored_prices(bookings, ages_by_booking):
+    # Liest den gespeicherten Preis (siehe price_snapshot_rows); berechnet wird nur, wo er fehlt oder zu
+    # einem älteren Tarif gehört, z.B. bevor "flask reprice-bookings" nach einer Tarifänderung gelaufen ist
+    tariff_version = get_tariff().version
+    stale = [b for b in bookings if b.total_price is None or b.tariff_version != tariff_version]
+    computed = dict(zip([b.id for b in stale], calculate_prices(stale, ages_by_booking)))
+    if len(bookings) > len(stale):
+        metrics.CACHE_REQUESTS.labels('price_snapshot', 'hit').inc(len(bookings) - len(stale))
+    if stale:
+        metrics.CACHE_REQUESTS.labels('price_snapshot', 'miss').inc(len(stale))
+    return [computed[b.id] if b.id in computed else float(b.total_price) for b in bookings]
+
+
+def price_snapshot_rows(bookings, ages_by_booking, tariff=None):
+    # (ID, Übernachtung, Kurtaxe, Halbpension, Total, Tarifversion) pro Buchung zum aktuellen Tarif;
+    # Buchungen ohne gültigen Zeitraum erhalten keinen Preis
+    tariff = tariff or get_tariff()
+    bookings = [b for b in bookings if safe_parse_date(b.arrival) and safe_parse_date(b.departure)]
+    if not bookings:
+        return []
+    lodging, kurtaxe, half_board = tariff.price_components_batch(
+        [safe_parse_date(b.arrival) for b in bookings],
+        [safe_parse_date(b.departure) for b in bookings],
+        [tariff.band_counts(ages_by_booking[b.id]) for b in bookings],
+        [b.hp == 'Ja' for b in bookings])
+    return [(b.id, round(l, 2), round(k, 2), round(h, 2), round(l + k + h, 2), tariff.version)
+            for b, l, k, h in zip(bookings, lodging.tolist(), kurtaxe.tolist(), half_board.tolist())]
+
+
+def write_price_snapshots(cursor, rows):
+    psycopg2.extras.execute_values(cursor, """
+        UPDATE bookings SET price_lodging = v.lodging, price_kurtaxe = v.kurtaxe, price_hp = v.hp,
+               total_price = v.total, tariff_version = v.tariff_version, priced_at = now()
+        FROM (VALUES %s) AS v(id, lodging, kurtaxe, hp, total, tariff_version)
+        WHERE bookings.id = v.id::uuid
+    """, rows, page_size=1000)
+
+
+def get_free_beds(arrival, departure, exclude_booking_id=None):
+    # Freie Betten pro Zimmer für den ganzen Zeitraum aus der Belegungstabelle room_nights
+    # (per Trigger gepflegt, siehe init_db.py) – eine Abfrage für alle Zimmer
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("""
+        SELECT room, MAX(beds)
+        FROM (
+            SELECT room, night, SUM(beds) AS beds
+            FROM room_nights
+            WHERE night >= %s AND night < %s
+            AND booking_id IS DISTINCT FROM %s::uuid
+            GROUP BY room, night
+        ) AS occupied_nights
+        GROUP BY room
+    """, (arrival, departure, exclude_booking_id))
+    occupied = dict(cursor.fetchall())
+    return {name: room.capacity - occupied.get(name, 0) for name, room in get_room_catalogue().items()}
+
+
+def find_free_rooms(arrival, departure, guests, exclude_booking_id=None):
+    free_beds = get_free_beds(arrival, departure, exclude_booking_id)
+    return [room for room, beds in free_beds.items() if beds >= guests]
+
+
+def check_room_capacity(room, arrival, departure, guests, exclude_booking_id=None):
+    # Liefert eine Fehlermeldung, falls das Zimmer im Zeitraum nicht genug freie Betten hat
+    free_beds = get_free_beds(arrival, departure, exclude_booking_id)
+    if room not in free_beds:
+        return "Unbekanntes Zimmer"
+    if guests > free_beds[room]:
+        free_rooms = [name for name, beds in free_beds.items() if beds >= guests]
+        message = f"Zimmer im gewählten Zeitraum nicht verfügbar (frei: {max(free_beds[room], 0)} Betten)"
+        if free_rooms:
+            message += f". Verfügbar: {', '.join(free_rooms)}"
+        return message
+    return None
+
+
+def is_room_available(room, arrival, departure, guests=1, exclude_booking_id=None):
+    return check_room_capacity(room, arrival, departure, guests, exclude_booking_id) is None
 
-    for i in range((d2 - d1).days):
-        day = d1 + timedelta(days=i)
-        weekday = day.weekday()  # 0 = Montag, 6 = Sonntag
 
-        if weekday in [4, 5]:  # Freitag & Samstag
-            total += erw * 90 + kind * 70
-        else:  # Sonntag bis Donnerstag
-            total += erw * 70 + kind * 50
+def safe_parse_date(date_value):
+    if isinstance(date_value, date):  # Wenn es bereits ein datetime.date ist
+        return date_value
+    # Fehlende Daten (NULL in alten Buchungen) sowie "Ja" und "Nein" sind ungültige Daten
+    if date_value is None or date_value in ['Ja', 'Nein', '']:
+        return None
+    try:
+        # Falls es ein String ist, wandeln wir ihn in ein datetime.date Objekt um
+        return datetime.strptime(date_value, "%Y-%m-%d").date()
+    except ValueError:
+        return None
 
-    # Kurtaxe pro Aufenthalt
-    total += erw * 4 * num_nights + kind * 1.5 * num_nights  # Beispiel für Kurtaxe
 
-    # Abendessen (jetzt HP: Halbpension) mit Fleisch und Vegi
-    if hp == 'Ja':
-        total += erw * 35 * num_nights
-        total += kind * 20 * num_nights
+# Dashboard-Listen als SQL-Bedingungen; entsprechen der früheren Einteilung in Python:
+# nur "Checked In" gilt als "Im Haus", auch wenn die Abreise heute ist.
+DASHBOARD_BUCKETS = {
+    'in_house': {
+        'where': "COALESCE(status, '') = 'Checked In' AND arrival <= %(today)s AND departure >= %(today)s",
+        'order': 'ASC',
+        'paginated': False,
+    },
+    'today_arrivals': {
+        'where': "COALESCE(status, '') <> 'Storniert' AND arrival = %(today)s"
+                 " AND NOT (COALESCE(status, '') = 'Checked In' AND departure >= %(today)s)",
+        'order': 'ASC',
+        'paginated': False,
+    },
+    'upcoming': {
+        'where': "COALESCE(status, '') <> 'Storniert' AND arrival > %(today)s",
+        'order': 'ASC',
+        'paginated': True,
+    },
+    'past': {
+        'where': "COALESCE(status, '') <> 'Storniert' AND arrival < %(today)s"
+                 " AND NOT (COALESCE(status, '') = 'Checked In' AND departure >= %(today)s)",
+        'order': 'DESC',  # Neueste zuerst, ältere werden beim Scrollen nachgeladen
+        'paginated': True,
+    },
+    'cancelled': {
+        'where': "status = 'Storniert'",
+        'order': 'DESC',
+        'paginated': True,
+    },
+}
+
+DASHBOARD_PAGE_SIZE = int(os.getenv('DASHBOARD_PAGE_SIZE', 20))
+
+
+def enrich_bookings(bookings):
+    # Ergänzt Altersverteilung und Preis direkt an den Buchungen; Gäste werden gesammelt geladen
+    guest_birthdates = load_guest_birthdates([b.id for b in bookings])
+    ages = {b.id: get_guest_ages(b.id, b.birthdate, guest_birthdates[b.id]) for b in bookings}
+    prices = stored_prices(bookings, ages)
+    for b, price in zip(bookings, prices):
+        b.age_group, _ = describe_ages(ages[b.id])
+        b.total_price = price
+    return bookings
+
+
+class FragmentCache:
+    # Gerenderte HTML-Fragmente pro Schlüssel (z.B. Buchungs-ID); ein Eintrag gilt nur, solange sein
+    # Stempel (z.B. Version der Buchung) passt. Bei voller Grösse fliegt der am längsten unbenutzte raus.
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, stamp):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                metrics.CACHE_REQUESTS.labels(self.name, 'hit').inc()
+                return entry[1]
+        metrics.CACHE_REQUESTS.labels(self.name, 'miss').inc()
+        return None
 
-    return round(total, 2)
+    def put(self, key, stamp, value):
+        with self._lock:
+            self._entries[key] = (stamp, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
 
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
 
-def is_room_available(room, arrival, departure):
-    db = get_db()
-    rooms, room_groups = get_room_data()
 
-    room_type = room_groups.get(room, room)
-    max_count = rooms.get(room, 0)
+# Buchungskarten des Dashboards und der Suche; Schlüssel ist die Buchungs-ID, der Stempel enthält die
+# Zeilenversion (Trigger, siehe init_db.py), den Tarif und das Datum (Altersverteilung)
+_card_cache = FragmentCache('booking_cards', maxsize=int(os.getenv('CARD_CACHE_SIZE', 5000)))
 
-    query = """
-        SELECT COUNT(*) as count 
-        FROM bookings
-        WHERE room = %s
-        AND NOT (departure <= %s OR arrival >= %s)
-    """
 
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute(query, (room, arrival, departure))
-    res = cursor.fetchone()
-    return res[0] < max_count
+def render_booking_cards(bookings):
+    # Liefert das HTML der Karten in derselben Reihenfolge; nur nicht zwischengespeicherte Buchungen
+    # werden mit Gästen und Preisen ergänzt und neu gerendert
+    today = date.today()
+    tariff_version = get_tariff().version
+    cards = [None] * len(bookings)
+    missing = []
+    for i, b in enumerate(bookings):
+        cards[i] = _card_cache.get(str(b.id), (b.version, tariff_version, today))
+        if cards[i] is None:
+            missing.append(i)
 
+    if missing:
+        template = app.jinja_env.get_template('partials/booking_card.html')
+        for i, enriched in zip(missing, enrich_bookings([bookings[i] for i in missing])):
+            cards[i] = Markup(template.render(booking=enriched))
+            _card_cache.put(str(enriched.id), (enriched.version, tariff_version, today), cards[i])
+    return cards
 
-def get_booking_history(booking_id):
-    db = get_db()
-    query = """
-        SELECT bh.*, u.username as changed_by
-        FROM booking_history bh
-        JOIN users u ON bh.changed_by = u.id
-        WHERE bh.booking_id = %s
-        ORDER BY bh.changed_at DESC
-    """
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute(query, (booking_id,))
-    history = cursor.fetchall()
-    return history
 
+def encode_dashboard_cursor(booking):
+    return f"{booking.arrival.isoformat()}_{booking.id}"
 
-def safe_parse_date(date_value):
-    if isinstance(date_value, date):  # Wenn es bereits ein datetime.date ist
-        return date_value
-    if date_value in ['Ja', 'Nein', '']:  # Hier fangen wir "Ja" und "Nein" ab, die ungültige Daten sind
-        return None
+
+def decode_dashboard_cursor(cursor_value):
+    # Format: "<Anreise>_<Buchungs-ID>", ungültige Werte ergeben None
+    arrival, _, booking_id = cursor_value.partition('_')
+    arrival = safe_parse_date(arrival)
     try:
-        # Falls es ein String ist, wandeln wir ihn in ein datetime.date Objekt um
-        return datetime.strptime(date_value, "%Y-%m-%d").date()
+        booking_id = str(uuid.UUID(booking_id))
     except ValueError:
         return None
+    if arrival is None:
+        return None
+    return arrival, booking_id
+
+
+def fetch_dashboard_bucket(bucket, today, after=None, limit=DASHBOARD_PAGE_SIZE):
+    spec = DASHBOARD_BUCKETS[bucket]
+    params = {'today': today}
+    conditions = ['arrival IS NOT NULL', 'departure IS NOT NULL', spec['where']]
+
+    # Keyset-Pagination über (arrival, id), damit auch tiefe Seiten nur einen Indexbereich lesen
+    if after is not None:
+        comparison = '<' if spec['order'] == 'DESC' else '>'
+        conditions.append(f"(arrival, id) {comparison} (%(after_arrival)s, %(after_id)s::uuid)")
+        params['after_arrival'], params['after_id'] = after
+
+    query = f"SELECT {select_list(CARD_COLUMNS)} FROM bookings WHERE {' AND '.join(conditions)} " \
+            f"ORDER BY arrival {spec['order']}, id {spec['order']}"
+    if spec['paginated']:
+        query += ' LIMIT %(limit)s'
+        params['limit'] = limit + 1
+
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute(query, params)
+    bookings = Booking.from_rows(cursor.fetchall(), CARD_COLUMNS)
+
+    next_cursor = None
+    if spec['paginated'] and len(bookings) > limit:
+        bookings = bookings[:limit]
+        next_cursor = encode_dashboard_cursor(bookings[-1])
+    return bookings, next_cursor
 
 
 @app.route('/')
@@ -233,63 +712,301 @@ def index():
         return redirect(url_for('login'))
 
     is_admin_value = session.get('is_admin', False)
-    db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute('SELECT * FROM bookings ORDER BY arrival')
-    bookings = cursor.fetchall()
     today = date.today()
-    day_before_today = today - timedelta(days=1)
-    lists = {
-        'in_house': [],
-        'today_arrivals': [],
-        'upcoming': [],
-        'past': [],
-        'cancelled': []
-    }
-    for b in bookings:
-        booking_number = str(b['id'])[:8]
-        age_text, (erw, kind, baby) = get_age_distribution(b['id'], b['birthdate'])
-        price = calculate_price(b['arrival'], b['departure'], erw, kind, baby, b['hp'], b['hp_fleisch'], b['hp_vegi'])
-        enriched = b.copy()
-        enriched['age_group'] = age_text
-        enriched['total_price'] = price
-        enriched['booking_number'] = booking_number
+    lists = {}
+    cursors = {}
+    for bucket in DASHBOARD_BUCKETS:
+        bookings, cursors[bucket] = fetch_dashboard_bucket(bucket, today)
+        lists[bucket] = render_booking_cards(bookings)
+    orders = {bucket: spec['order'] for bucket, spec in DASHBOARD_BUCKETS.items()}
+    return render_template('index.html', lists=lists, cursors=cursors, orders=orders, is_admin=is_admin_value)
 
-        arrival = b['arrival']  # Stellt sicher, dass 'arrival' aus der Buchung kommt
-        departure = b['departure']  # Stellt sicher, dass 'departure' aus der Buchung kommt
 
-        arrival = str(arrival) if isinstance(arrival, datetime) else arrival
-        departure = str(departure) if isinstance(departure, datetime) else departure
+@app.route('/api/dashboard/<bucket>')
+def api_dashboard(bucket):
+    if not session.get('user_id'):
+        return jsonify({'error': 'Nicht eingeloggt'}), 401
+    if bucket not in DASHBOARD_BUCKETS or not DASHBOARD_BUCKETS[bucket]['paginated']:
+        return jsonify({'error': 'Unbekannte Liste'}), 404
 
-        arrival = safe_parse_date(arrival)
-        departure = safe_parse_date(departure)
+    after = None
+    if request.args.get('after'):
+        after = decode_dashboard_cursor(request.args['after'])
+        if after is None:
+            return jsonify({'error': 'Ungültiger Cursor'}), 400
 
-        if arrival is None or departure is None:
-            print(f"Ungültiges Datum für Ankunft oder Abreise: {b['arrival']}, {b['departure']}")
-            continue  # Überspringe diese Buchung
+    bookings, next_cursor = fetch_dashboard_bucket(bucket, date.today(), after=after)
+    html = ''.join(render_booking_cards(bookings))
+    return jsonify({'html': html, 'next': next_cursor})
 
-        # Nur "Checked In" kommen in "Im Haus", auch wenn Abreise heute ist
-        if b['status'] == 'Checked In' and (arrival <= today < departure or departure == today):
-            lists['in_house'].append(enriched)
 
-        # Wenn der Status "Ausgecheckt" ist, kommt die Buchung in "Vergangene"
-        elif b['status'] == 'Ausgecheckt' and departure <= day_before_today:
-            lists['past'].append(enriched)
+@app.route('/api/dashboard/card/<booking_id>')
+def api_dashboard_card(booking_id):
+    # Einzelne Karte für den Änderungsfeed: in welche Liste die Buchung heute gehört und ihr HTML
+    if not session.get('user_id'):
+        return jsonify({'error': 'Nicht eingeloggt'}), 401
+    try:
+        uuid.UUID(booking_id)
+    except ValueError:
+        return jsonify({'error': 'Ungültige Buchung'}), 404
 
-        # Wenn der Status "Storniert" ist, kommt die Buchung in "Storniert"
-        elif b['status'] == 'Storniert':
-            lists['cancelled'].append(enriched)
+    cases = ' '.join(f"WHEN {spec['where']} THEN '{bucket}'" for bucket, spec in DASHBOARD_BUCKETS.items())
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute(f"""
+        SELECT CASE {cases} END AS bucket, {select_list(CARD_COLUMNS)} FROM bookings
+        WHERE id = %(id)s AND arrival IS NOT NULL AND departure IS NOT NULL
+    """, {'id': booking_id, 'today': date.today()})
+    row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return jsonify({'bucket': None, 'html': ''})
+    html = ''.join(render_booking_cards([Booking.from_row(row[1:], CARD_COLUMNS)]))
+    return jsonify({'bucket': row[0], 'html': html})
+
+
+# Änderungsfeed: ein Listener-Thread pro Worker-Prozess, erst beim ersten Abonnenten gestartet
+SSE_KEEPALIVE = float(os.getenv('SSE_KEEPALIVE', 15))
+_change_feed = None
+_change_feed_pid = None
+
+
+def build_change_events(ids):
+    # Aktueller Stand der gemeldeten Buchungen; gelöschte erscheinen als deleted, stornierte ohne Kalendereintrag
+    with app.app_context():
+        cursor = get_db().cursor()
+        cursor.execute(f'SELECT {select_list(CALENDAR_COLUMNS)} FROM bookings WHERE id = ANY(%s::uuid[])', (ids,))
+        found = {str(b.id): b for b in Booking.from_rows(cursor.fetchall(), CALENDAR_COLUMNS)}
+        rooms = get_room_catalogue()
+        events = []
+        for booking_id in ids:
+            b = found.get(booking_id)
+            if b is None:
+                events.append({'id': booking_id, 'deleted': True, 'event': None})
+                continue
+            visible = b.status != 'Storniert' and b.arrival and b.departure
+            events.append({'id': booking_id, 'deleted': False, 'version': b.version,
+                           'event': booking_event(b, rooms) if visible else None})
+        return events
+
+
+def get_change_feed():
+    global _change_feed, _change_feed_pid
+    if _change_feed is None or _change_feed_pid != os.getpid():
+        _change_feed = ChangeFeed(
+            lambda: psycopg2.connect(DATABASE_URL, sslmode=os.getenv('DB_SSLMODE', 'require')),
+            'booking_changes',
+            build_change_events,
+        )
+        _change_feed_pid = os.getpid()
+    return _change_feed
+
+
+@app.route('/api/changes')
+def api_changes():
+    # Server-Sent Events; ohne stream_with_context, damit die DB-Verbindung der Anfrage sofort
+    # in den Pool zurückgeht und die offene Verbindung zum Browser keine hält
+    if not session.get('user_id'):
+        return jsonify({'error': 'Nicht eingeloggt'}), 401
 
-        # Anstehende Reservierungen
-        elif arrival > today:
-            lists['upcoming'].append(enriched)
+    feed = get_change_feed()
+    client = feed.subscribe(request.headers.get('Last-Event-ID'))
 
-        elif arrival == today:
-            lists['today_arrivals'].append(enriched)
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            while not (client.closed and client.empty()):
+                try:
+                    item = client.get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield format_event(item)
+        finally:
+            feed.unsubscribe(client)
 
-        else:
-            lists['past'].append(enriched)
-    return render_template('index.html', lists=lists, is_admin=is_admin_value)
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 20))
+SEARCH_MIN_LENGTH = 2
+
+
+def search_bookings(term, offset=0, limit=SEARCH_PAGE_SIZE):
+    # Suche über das per Trigger gepflegte Suchdokument (booking_search, Trigramm-Index):
+    # jedes Suchwort muss als Teilstring vorkommen, alternativ genügt eine unscharfe Übereinstimmung
+    term = ' '.join(term.lower().split())
+    words = term.split(' ')
+    patterns = ['%' + w.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%' for w in words]
+    substring_match = ' AND '.join(['s.document LIKE %s'] * len(patterns))
+
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute(f"""
+        SELECT {select_list(CARD_COLUMNS, 'b')}, word_similarity(%s, s.document) AS rank
+        FROM booking_search s
+        JOIN bookings b ON b.id = s.booking_id
+        WHERE ({substring_match}) OR %s <%% s.document
+        ORDER BY rank DESC, b.arrival DESC, b.id
+        LIMIT %s OFFSET %s
+    """, [term, *patterns, term, limit + 1, offset])
+    bookings = Booking.from_rows(cursor.fetchall(), CARD_COLUMNS)
+
+    next_offset = None
+    if len(bookings) > limit:
+        bookings = bookings[:limit]
+        next_offset = offset + limit
+    return bookings, next_offset
+
+
+@app.route('/api/search')
+def api_search():
+    if not session.get('user_id'):
+        return jsonify({'error': 'Nicht eingeloggt'}), 401
+
+    term = request.args.get('q', '').strip()
+    if len(term) < SEARCH_MIN_LENGTH:
+        return jsonify({'html': '', 'next': None})
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return jsonify({'error': 'Ungültiger Offset'}), 400
+
+    bookings, next_offset = search_bookings(term, offset)
+    html = ''.join(render_booking_cards(bookings))
+    return jsonify({'html': html, 'next': next_offset, 'count': len(bookings)})
+
+
+# Gleiches Spaltenformat wie der Import (siehe booking_import.py); die Reihenfolge der Werte in
+# iter_export_batches muss dazu passen
+EXPORT_COLUMNS = list(BOOKING_HEADERS)
+EXPORT_GUEST_COLUMNS = list(GUEST_HEADERS)
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 500))
+
+
+def iter_booking_batches(start_date=None, end_date=None, batch_size=EXPORT_BATCH_SIZE, columns=EXPORT_FIELDS):
+    # Liest die Buchungen über einen server-seitigen Cursor in Blöcken, sortiert nach Anreise
+    query = f'SELECT {select_list(columns)} FROM bookings'
+    params = []
+    if start_date and end_date:
+        query += ' WHERE arrival BETWEEN %s AND %s'
+        params = [start_date, end_date]
+    query += ' ORDER BY arrival, id'
+
+    db = get_db()
+    db.autocommit = False  # Benannte Cursor benötigen eine Transaktion
+    cursor = db.cursor(name='booking_batches')
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield Booking.from_rows(rows, columns)
+    finally:
+        cursor.close()
+        db.rollback()
+        db.autocommit = True
+
+
+def iter_export_batches(start_date=None, end_date=None):
+    # Liefert pro Block (Buchungszeilen, Gästezeilen); Gäste und Preise werden pro Block gesammelt ergänzt
+    for bookings in iter_booking_batches(start_date, end_date):
+        guests = load_guests([b.id for b in bookings])
+        ages = {b.id: get_guest_ages(b.id, b.birthdate, [guest.birthdate for guest in guests[b.id]])
+                for b in bookings}
+        prices = stored_prices(bookings, ages)
+        rows = []
+        for b, price in zip(bookings, prices):
+            age_text, _ = describe_ages(ages[b.id])
+            # Fleisch- und Vegi-Anzahl nur bei Halbpension
+            hp_fleisch = b.hp_fleisch if b.hp == 'Ja' else 0
+            hp_vegi = b.hp_vegi if b.hp == 'Ja' else 0
+            rows.append([
+                b.id,
+                b.name,
+                b.status,
+                b.room,
+                b.arrival,
+                b.departure,
+                hp_fleisch,
+                hp_vegi,
+                age_text,
+                price,
+                b.notes,
+                b.payment_status,
+                b.payment_method,
+                b.birthdate,
+                b.guests,
+                b.hp,
+                b.email,
+                b.phone,
+                b.address,
+                b.postal_code,
+                b.city,
+                b.country,
+            ])
+        guest_rows = [[b.id, guest.name, guest.birthdate] for b in bookings for guest in guests[b.id]]
+        yield rows, guest_rows
+
+
+def iter_export_csv(start_date, end_date):
+    # Liefert die CSV-Datei blockweise als Text
+    started = time.perf_counter()
+    size = rows_written = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    buffer.write('\ufeff')  # BOM, damit Excel die Datei als UTF-8 erkennt
+    writer.writerow(EXPORT_COLUMNS)
+    for rows, _ in iter_export_batches(start_date, end_date):
+        writer.writerows(rows)
+        rows_written += len(rows)
+        chunk = buffer.getvalue()
+        size += len(chunk.encode('utf-8'))
+        yield chunk
+        buffer.seek(0)
+        buffer.truncate()
+    chunk = buffer.getvalue()
+    size += len(chunk.encode('utf-8'))
+    yield chunk
+    # Beim Streamen ist die Anfrage längst beantwortet; gemessen wird bis zum letzten Block
+    metrics.EXPORT_DURATION.labels('csv').observe(time.perf_counter() - started)
+    metrics.EXPORT_SIZE.labels('csv').observe(size)
+    metrics.EXPORT_ROWS.labels('csv').inc(rows_written)
+
+
+def stream_export_csv(start_date, end_date):
+    return Response(stream_with_context(iter_export_csv(start_date, end_date)), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=buchungen.csv'})
+
+
+def write_export_xlsx(start_date, end_date, output=None):
+    # openpyxl im Write-Only-Modus schreibt Zeilen direkt weg, statt die ganze Tabelle im Speicher zu halten
+    from openpyxl import Workbook
+
+    started = time.perf_counter()
+    rows_written = 0
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(BOOKING_SHEET)
+    sheet.append(EXPORT_COLUMNS)
+    # Jedes Blatt schreibt im Write-Only-Modus in eine eigene temporäre Datei, deshalb beide parallel füllen
+    guest_sheet = workbook.create_sheet(GUEST_SHEET)
+    guest_sheet.append(EXPORT_GUEST_COLUMNS)
+    for rows, guest_rows in iter_export_batches(start_date, end_date):
+        for row in rows:
+            sheet.append(row)
+        for row in guest_rows:
+            guest_sheet.append(row)
+        rows_written += len(rows)
+
+    if output is None:
+        output = tempfile.TemporaryFile()
+    workbook.save(output)
+    metrics.EXPORT_DURATION.labels('xlsx').observe(time.perf_counter() - started)
+    metrics.EXPORT_SIZE.labels('xlsx').observe(output.tell())
+    metrics.EXPORT_ROWS.labels('xlsx').inc(rows_written)
+    output.seek(0)
+    return output
 
 
 @app.route('/export', methods=['GET', 'POST'])
@@ -297,63 +1014,198 @@ def export_excel():
     if not session.get('user_id'):
         return redirect(url_for('login'))
 
-    # Wenn ein Zeitraum ausgewählt wurde (POST-Anfrage)
-    if request.method == 'POST':
-        start_date = request.form.get('start_date')
-        end_date = request.form.get('end_date')
+    # Wenn ein Zeitraum ausgewählt wurde (POST-Anfrage), sonst alle Buchungen
+    start_date = request.form.get('start_date') if request.method == 'POST' else None
+    end_date = request.form.get('end_date') if request.method == 'POST' else None
+    export_format = request.values.get('format', 'xlsx')
 
-        db = get_db()
-        cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    if export_format == 'csv':
+        return stream_export_csv(start_date, end_date)
 
-        # SQL-Abfrage mit Zeitraum
-        query = """
-            SELECT * FROM bookings
-            WHERE arrival BETWEEN %s AND %s
-        """
-        cursor.execute(query, (start_date, end_date))
-        bookings = cursor.fetchall()
-    else:
-        # Standardabfrage, wenn kein Zeitraum angegeben wurde
-        db = get_db()
-        cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.execute('SELECT * FROM bookings')
-        bookings = cursor.fetchall()
-
-    rows = []
-    for b in bookings:
-        # Altersverteilung der Gäste abrufen
-        age_text, (erw, kind, baby) = get_age_distribution(b[0], b[2])  # b[0] = booking_id, b[2] = birthdate
-        # Berechnung des Preises
-        price = calculate_price(b[6], b[7], erw, kind, baby, b[8], b[9], b[10])  # b[6] = arrival, b[7] = departure
-        # Fleisch- und Vegan-Anzahl für das Abendessen
-        hp_fleisch = b[9] if b[8] == 'Ja' else 0
-        hp_vegi = b[10] if b[8] == 'Ja' else 0
-
-        rows.append({
-            'Buchungsnummer': b[0],  # b[0] = booking_id
-            'Name': b[1],  # b[1] = name
-            'Status': b[12],  # b[11] = status
-            'Zimmer': b[3],  # b[3] = room
-            'Anreise': b[5],  # b[6] = arrival
-            'Abreise': b[6],  # b[7] = departure
-            'Fleisch': b[8],
-            'Vegan': b[9],
-            'Altersverteilung': age_text,
-            'Notizen': b[17],
-            'Bezahlt': b[18],
-            'Zahlart': b[19],
-        })
-
-    df = pd.DataFrame(rows)
-
-    df = df.sort_values(by='Anreise', ascending=True)  # Nach Anreise-Datum sortieren
-
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Buchungen')
-    output.seek(0)
+    output = write_export_xlsx(start_date, end_date)
     return send_file(output, as_attachment=True, download_name='buchungen.xlsx',
-                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+                     mimetype=EXPORT_MIMETYPES['xlsx'])
+
+
+# Hintergrund-Exporte: die Anfrage legt nur einen Auftrag an, die Datei entsteht in einem Thread-Pool
+# und wird im gemeinsamen Verzeichnis abgelegt. Die Seite fragt den Status ab und lädt die Datei herunter.
+EXPORT_MIMETYPES = {'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                    'csv': 'text/csv'}
+EXPORT_JOB_DIR = os.getenv('EXPORT_JOB_DIR', os.path.join(tempfile.gettempdir(), 'alphuette-exports'))
+EXPORT_JOB_WORKERS = int(os.getenv('EXPORT_JOB_WORKERS', 2))
+EXPORT_JOB_MAX_AGE = int(os.getenv('EXPORT_JOB_MAX_AGE', 3600))
+
+_export_jobs = {'pid': None, 'jobs': None}
+
+
+def build_export_file(params, path):
+    # Läuft im Export-Thread und braucht deshalb einen eigenen App-Kontext (Datenbankverbindung)
+    with app.app_context():
+        if params['format'] == 'csv':
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                for chunk in iter_export_csv(params['start_date'], params['end_date']):
+                    f.write(chunk)
+        else:
+            with open(path, 'wb') as f:
+                write_export_xlsx(params['start_date'], params['end_date'], f)
+
+
+def get_export_jobs():
+    # Pro Worker-Prozess ein eigener Thread-Pool; Threads überleben einen Fork nicht
+    if _export_jobs['pid'] != os.getpid():
+        _export_jobs['jobs'] = ExportJobs(EXPORT_JOB_DIR, build_export_file, workers=EXPORT_JOB_WORKERS,
+                                          max_age=EXPORT_JOB_MAX_AGE)
+        _export_jobs['pid'] = os.getpid()
+    return _export_jobs['jobs']
+
+
+_maintenance = {'pid': None, 'executor': None}
+
+
+def _run_maintenance(task):
+    with app.app_context():
+        try:
+            task()
+        except Exception as e:
+            print(f"Hintergrundaufgabe {task.__name__} fehlgeschlagen: {e}")
+
+
+def run_in_background(task):
+    # Wartungsarbeiten laufen außerhalb der Anfrage in einem Thread pro Worker-Prozess, nacheinander
+    if _maintenance['pid'] != os.getpid():
+        _maintenance['executor'] = ThreadPoolExecutor(max_workers=1, thread_name_prefix='maintenance')
+        _maintenance['pid'] = os.getpid()
+    _maintenance['executor'].submit(_run_maintenance, task)
+
+
+def export_job_response(job_id):
+    state, info = get_export_jobs().status(job_id)
+    body = {'id': job_id, 'state': state, 'status_url': url_for('export_job_status', job_id=job_id)}
+    if state == 'done':
+        body['download_url'] = url_for('export_job_download', job_id=job_id)
+        body['size'] = info.get('size')
+    elif state == 'failed':
+        body['error'] = info.get('error')
+    return jsonify(body)
+
+
+@app.route('/export/jobs', methods=['POST'])
+def create_export_job():
+    if not session.get('user_id'):
+        return jsonify({'error': 'Nicht eingeloggt'}), 401
+
+    start_date = safe_parse_date(request.form.get('start_date', ''))
+    end_date = safe_parse_date(request.form.get('end_date', ''))
+    export_format = request.form.get('format', 'xlsx')
+    if export_format not in EXPORT_MIMETYPES:
+        return jsonify({'error': 'Unbekanntes Format'}), 400
+    if start_date is None or end_date is None:
+        start_date = end_date = None
+
+    # Mit dem Änderungsstand der Buchungen und des Tarifs in der Auftrags-ID wird eine vorhandene Datei
+    # wiederverwendet, bis sich etwas ändert
+    params = {'format': export_format, 'start_date': start_date, 'end_date': end_date,
+              'bookings_version': get_change_version('bookings')[0], 'tariff_version': get_tariff().version}
+    job_id = get_export_jobs().submit(params)
+    response = export_job_response(job_id)
+    if response.json['state'] != 'done':
+        response.status_code = 202  # Angenommen, aber noch nicht fertig
+    return response
+
+
+@app.route('/export/jobs/<job_id>')
+def export_job_status(job_id):
+    if not session.get('user_id'):
+        return jsonify({'error': 'Nicht eingeloggt'}), 401
+    if not JOB_ID_PATTERN.fullmatch(job_id):
+        return jsonify({'error': 'Auftrag nicht gefunden'}), 404
+    return export_job_response(job_id)
+
+
+@app.route('/export/jobs/<job_id>/download')
+def export_job_download(job_id):
+    if not session.get('user_id'):
+        return redirect(url_for('login'))
+    if not JOB_ID_PATTERN.fullmatch(job_id):
+        return "Export nicht gefunden", 404
+    state, info = get_export_jobs().status(job_id)
+    path = get_export_jobs().result_path(job_id)
+    if state != 'done' or not os.path.exists(path):
+        return "Export nicht gefunden", 404
+    return send_file(path, as_attachment=True, download_name=f"buchungen.{info['format']}",
+                     mimetype=EXPORT_MIMETYPES[info['format']])
+
+
+IMPORT_MAX_ERRORS = 500  # Mehr Fehler werden nicht einzeln angezeigt
+
+
+def price_imported_bookings(cursor, booking_ids):
+    # Preis und daily_rollup für neu übernommene Buchungen, blockweise in der Import-Transaktion;
+    # der Tarif wird wie beim Bearbeiten in der Transaktion gelesen und gilt für alle Blöcke
+    tariff = get_tariff(cursor)
+    totals = {}
+    for start in range(0, len(booking_ids), EXPORT_BATCH_SIZE):
+        chunk = booking_ids[start:start + EXPORT_BATCH_SIZE]
+        cursor.execute(f'SELECT {select_list(PRICING_COLUMNS)} FROM bookings WHERE id = ANY(%s::uuid[])', (chunk,))
+        bookings = Booking.from_rows(cursor.fetchall(), PRICING_COLUMNS)
+        guest_birthdates = load_guest_birthdates(chunk)
+        ages = {b.id: get_guest_ages(b.id, b.birthdate, guest_birthdates[b.id]) for b in bookings}
+        write_price_snapshots(cursor, price_snapshot_rows(bookings, ages, tariff))
+        for b in bookings:
+            for key, values in booking_rollup(b, ages[b.id], tariff).items():
+                current = totals.setdefault(key, [0] * len(ROLLUP_FIELDS))
+                totals[key] = [c + v for c, v in zip(current, values)]
+    apply_rollup(cursor, totals)
+
+
+def import_booking_file(bookings, guests):
+    # Alles oder nichts: bei einem einzigen Fehler wird nichts übernommen, der Bericht enthält aber alle Fehler
+    started = time.perf_counter()
+    bookings, guests, errors = prepare_import(bookings, guests, get_rooms())
+    try:
+        with transaction() as cursor:
+            stage_import(cursor, bookings, guests)
+            errors += check_import(cursor)
+            if errors:
+                raise ImportRejected(sorted(errors, key=lambda error: (error[0] != BOOKING_SHEET, error[1])))
+            booking_ids, guest_count = merge_import(cursor)
+            price_imported_bookings(cursor, booking_ids)
+    except ImportRejected as e:
+        metrics.IMPORT_ROWS.labels('rejected').inc(len({row for sheet, row, _ in e.errors if sheet == BOOKING_SHEET}))
+        raise
+    finally:
+        metrics.IMPORT_DURATION.observe(time.perf_counter() - started)
+    metrics.IMPORT_ROWS.labels('imported').inc(len(booking_ids))
+    return len(booking_ids), guest_count
+
+
+@app.route('/import', methods=['GET', 'POST'])
+def import_bookings():
+    if not session.get('user_id') or not session.get('is_admin'):
+        return redirect(url_for('login'))  # Wenn nicht eingeloggt oder kein Admin
+
+    if request.method == 'GET':
+        return render_template('import.html')
+
+    upload = request.files.get('file')
+    guests_upload = request.files.get('guests_file')
+    if upload is None or not upload.filename:
+        return render_template('import.html', error="Bitte eine Datei auswählen."), 400
+
+    try:
+        bookings, guests = read_import_file(upload.stream, upload.filename,
+                                            guests_upload.stream if guests_upload and guests_upload.filename
+                                            else None)
+        imported, guest_count = import_booking_file(bookings, guests)
+    except ImportFileError as e:
+        return render_template('import.html', error=str(e)), 400
+    except ImportRejected as e:
+        return render_template('import.html', errors=e.errors[:IMPORT_MAX_ERRORS], error_count=len(e.errors)), 422
+    except psycopg2.Error as e:
+        print(f"Fehler beim Import: {e}")
+        return render_template('import.html', error="Fehler beim Import in die Datenbank."), 500
+
+    return render_template('import.html', imported=imported, guest_count=guest_count)
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -367,9 +1219,7 @@ def login():
         print(f"Benutzer: {user}")  # Zeigt die abgerufenen Daten in der Konsole an
 
         if user and check_password_hash(user['password'], request.form['password']):  # user[2] ist das Passwort
-            session['user_id'] = user['id']
-            session['user'] = user['username']
-            session['is_admin'] = user['is_admin']
+            store_identity(user, _users_version_cache.get())
             return redirect(url_for('index'))
         print("Login fehlgeschlagen!")
         return render_template('login.html', error='Login fehlgeschlagen')
@@ -386,26 +1236,28 @@ def logout():
 def cancel_booking(id):
     if not session.get('user_id'):
         return redirect(url_for('login'))
-    db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("UPDATE bookings SET status = 'Storniert' WHERE id = %s", (id,))
-    db.commit()
+    with transaction() as cursor:
+        tariff = get_tariff(cursor)
+        before = load_booking_rollup(cursor, id, tariff)
+        cursor.execute("UPDATE bookings SET status = 'Storniert' WHERE id = %s", (id,))
+        update_booking_rollup(cursor, id, before, tariff)
+    _card_cache.invalidate(id)
     return redirect(url_for('index'))
 
 
 @app.route('/delete_booking/<id>', methods=['POST'])
 def delete_booking(id):
-    db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    with transaction() as cursor:
+        before = load_booking_rollup(cursor, id)
 
-    # Zuerst die Gäste der Buchung löschen
-    cursor.execute('DELETE FROM guests WHERE booking_id = %s', (id,))
-
-    # Dann die Buchung aus der Buchungstabelle löschen
-    cursor.execute('DELETE FROM bookings WHERE id = %s', (id,))
+        # Zuerst Gäste und Verlauf der Buchung löschen
+        cursor.execute('DELETE FROM guests WHERE booking_id = %s', (id,))
+        cursor.execute('DELETE FROM booking_history WHERE booking_id = %s', (id,))
 
-    # Änderungen in der Datenbank speichern
-    db.commit()
+        # Dann die Buchung aus der Buchungstabelle löschen
+        cursor.execute('DELETE FROM bookings WHERE id = %s', (id,))
+        apply_rollup(cursor, before, sign=-1)
+    _card_cache.invalidate(id)
 
     return redirect(url_for('index'))
 
@@ -428,8 +1280,6 @@ def new_booking():
         if not safe_parse_date(departure):
             return "Ungültiges Abreisedatum", 400
 
-        db = get_db()
-
         try:
             room = data['room']
             guests = int(data['guests'])
@@ -441,73 +1291,83 @@ def new_booking():
             hp_fleisch = int(data.get('hp_fleisch', 0)) if data.get('hp_fleisch') != '' else 0
             hp_vegi = int(data.get('hp_vegi', 0)) if data.get('hp_vegi') != '' else 0
 
-            cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cursor.execute('''
-                INSERT INTO bookings
-                (id, name, birthdate, room, guests, arrival, departure, hp, hp_fleisch, hp_vegi, email, phone, status, address, postal_code, city, country, notes)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ''', (
-                booking_id,
-                data['name'],
-                data['birthdate'],
-                room,
-                guests,
-                arrival,
-                departure,
-                hp,
-                hp_fleisch,
-                hp_vegi,
-                data.get('email', ''),
-                data.get('phone', ''),
-                data.get('status', 'Option'),
-                data['address'],
-                data['postal_code'],
-                data['city'],
-                data['country'],
-                data.get('note', '')
-            ))
-
-            for i in range(1, guests):
-                guest_name = data.get(f'guest_name_{i}')
-                guest_birth = data.get(f'guest_birth_{i}')
-                if guest_name and guest_birth:
-                    cursor.execute('INSERT INTO guests (booking_id, name, birthdate) VALUES (%s, %s, %s)',
-                                   (booking_id, guest_name, guest_birth))
+            with transaction() as cursor:
+                lock_room(cursor, room)
+                capacity_error = check_room_capacity(room, arrival, departure, guests)
+                if capacity_error:
+                    return capacity_error, 400
+
+                cursor.execute('''
+                    INSERT INTO bookings
+                    (id, name, birthdate, room, guests, arrival, departure, hp, hp_fleisch, hp_vegi, email, phone, status, address, postal_code, city, country, notes)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ''', (
+                    booking_id,
+                    data['name'],
+                    safe_parse_date(data['birthdate']),
+                    room,
+                    guests,
+                    arrival,
+                    departure,
+                    hp,
+                    hp_fleisch,
+                    hp_vegi,
+                    data.get('email', ''),
+                    data.get('phone', ''),
+                    data.get('status', 'Option'),
+                    data['address'],
+                    data['postal_code'],
+                    data['city'],
+                    data['country'],
+                    data.get('note', '')
+                ))
+                insert_guests(cursor, booking_id, form_guests(data, 1, guests - 1))
+                store_booking_changes(cursor, booking_id, get_tariff(cursor))
 
-            db.commit()
             return redirect(url_for('index'))
 
         except psycopg2.Error as e:
             print(f"Fehler bei der DB-Operation: {e}")
-            db.rollback()
             return "Fehler beim Hinzufügen der Buchung", 500
 
     return render_template('new_booking.html', rooms=rooms)
 
 
-@app.route('/edit/<id>', methods=['GET', 'POST'])
-def edit_booking(id):
-    db = get_db()
-    rooms = get_rooms()
+class BookingConflict(Exception):
+    pass
 
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute('SELECT * FROM bookings WHERE id = %s', (id,))
-    booking = cursor.fetchone()
 
-    # Hole die Gäste der Buchung
-    cursor.execute('SELECT * FROM guests WHERE booking_id = %s', (id,))
-    guests = cursor.fetchall()
+def load_booking_for_edit(booking_id):
+    # Buchung, Mitreisende und Verlauf in einer Abfrage; liefert (Buchung, Gäste, Verlauf) oder None
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute(f"""
+        SELECT {select_list(Booking.COLUMNS, 'b')},
+               COALESCE((SELECT json_agg(json_build_object('id', g.id, 'name', g.name, 'birthdate', g.birthdate)
+                                         ORDER BY g.id)
+                         FROM guests g WHERE g.booking_id = b.id), '[]') AS guest_list,
+               COALESCE((SELECT json_agg(json_build_object('status', bh.status,
+                                                           'changed_at', to_char(bh.changed_at, 'YYYY-MM-DD HH24:MI:SS'),
+                                                           'changed_by', u.username)
+                                         ORDER BY bh.changed_at DESC)
+                         FROM booking_history bh JOIN users u ON bh.changed_by = u.id
+                         WHERE bh.booking_id = b.id), '[]') AS history_list
+        FROM bookings b
+        WHERE b.id = %s
+    """, (booking_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    *columns, guest_list, history = row
+    guests = [Guest(booking_id=booking_id, **guest) for guest in guest_list]
+    return Booking.from_row(columns), guests, history
 
-    # Hole die Buchungshistorie
-    history = get_booking_history(id)
 
+@app.route('/edit/<id>', methods=['GET', 'POST'])
+def edit_booking(id):
     if request.method == 'POST':
         data = request.form
 
-        if data.get('status') == 'Storniert':
-            cursor.execute('UPDATE bookings SET status = "Storniert" WHERE id = %s', (id,))
-            db.commit()
-
         # Behandle Zahlungseingabe
         payment_status = 'payment_status' in data and data['payment_status'] == 'on'  # Checkbox-Status
         payment_method = data.get('payment_method') if payment_status else None
@@ -518,18 +1378,10 @@ def edit_booking(id):
             if data['departure'] != today:
                 return "Die Buchung kann nicht auf 'Ausgecheckt' gesetzt werden, wenn das Abreisedatum nicht heute ist.", 400
 
-            # Behandle Zahlungseingabe
-            payment_status = 'payment_status' in data and data['payment_status'] == 'on'  # Checkbox-Status
-            payment_method = data.get('payment_method') if payment_status else None
-
             # Überprüfe, ob Status geändert wurde
-            if data.get('status') == 'Ausgecheckt' and not payment_status:
+            if not payment_status:
                 return "Bitte markieren Sie 'Bezahlt', bevor Sie Ausgecheckt wählen.", 400
 
-        # Überprüfe, ob Status geändert wurde
-        if data.get('status') == 'Ausgecheckt' and not payment_status:
-            return "Bitte markieren Sie 'Bezahlt', bevor Sie Ausgecheckt wählen.", 400
-
         def safe_int(value):
             try:
                 return int(value)
@@ -539,63 +1391,83 @@ def edit_booking(id):
         hp = 'Ja' if 'hp' in data else 'Nein'
         hp_fleisch = safe_int(data.get('hp_fleisch', 0)) if hp == 'Ja' else 0
         hp_vegi = safe_int(data.get('hp_vegi', 0)) if hp == 'Ja' else 0
+        new_status = data.get('status', 'Option')
 
-        new_status = data.get('status')
-        if new_status != booking[1]:  # booking[1] ist der Name, daher Status
-            cursor.execute('''
-                INSERT INTO booking_history (booking_id, status, changed_at, changed_by)
-                VALUES (%s, %s, %s, %s)
-            ''', (id, new_status, datetime.now(), session.get('user_id')))
-
-        cursor.execute('''
-            UPDATE bookings SET
-            name=%s, birthdate=%s, email=%s, phone=%s, room=%s, guests=%s,
-            arrival=%s, departure=%s, hp=%s, hp_fleisch=%s, hp_vegi=%s, status=%s,
-            address=%s, postal_code=%s, city=%s, country=%s, notes=%s,
-            payment_status=%s, payment_method=%s
-            WHERE id=%s
-        ''', (
-            data['name'],
-            data['birthdate'],
-            data.get('email', ''),
-            data.get('phone', ''),
-            data['room'],
-            int(data['guests']),
-            data['arrival'],
-            data['departure'],
-            hp,
-            hp_fleisch,
-            hp_vegi,
-            data.get('status', 'Option'),
-            data['address'],
-            data['postal_code'],
-            data['city'],
-            data['country'],
-            data['note'],
-            payment_status,
-            payment_method,
-            id
-        ))
-
-        # Lösche die alten Gäste und füge neue hinzu
-        cursor.execute('DELETE FROM guests WHERE booking_id = %s', (id,))
-        for i in range(1, int(data['guests']) + 1):
-            guest_name = data.get(f'guest_name_{i}')
-            guest_birth = data.get(f'guest_birth_{i}')
-            if guest_name and guest_birth:
-                cursor.execute('INSERT INTO guests (booking_id, name, birthdate) VALUES (%s, %s, %s)',
-                               (id, guest_name, guest_birth))
+        try:
+            with transaction() as cursor:
+                lock_room(cursor, data['room'])
+
+                # Belegung prüfen; die Buchung selbst wird dabei nicht mitgezählt
+                if new_status != 'Storniert':
+                    capacity_error = check_room_capacity(data['room'], data['arrival'], data['departure'],
+                                                         int(data['guests']), id)
+                    if capacity_error:
+                        return capacity_error, 400
+
+                tariff = get_tariff(cursor)
+                rollup_before = load_booking_rollup(cursor, id, tariff)
+
+                # Nur speichern, wenn die Buchung seit dem Laden des Formulars nicht geändert wurde;
+                # der bisherige Status kommt aus derselben Anweisung zurück. Die Version steigt auch dann,
+                # wenn sich nur Mitreisende ändern (der Trigger erhöht sie nur bei geänderten Spalten).
+                cursor.execute('''
+                    UPDATE bookings SET
+                    name=%s, birthdate=%s, email=%s, phone=%s, room=%s, guests=%s,
+                    arrival=%s, departure=%s, hp=%s, hp_fleisch=%s, hp_vegi=%s, status=%s,
+                    address=%s, postal_code=%s, city=%s, country=%s, notes=%s,
+                    payment_status=%s, payment_method=%s, version = bookings.version + 1
+                    FROM (SELECT status FROM bookings WHERE id = %s) AS previous
+                    WHERE bookings.id = %s AND bookings.version = %s
+                    RETURNING previous.status
+                ''', (
+                    data['name'],
+                    safe_parse_date(data['birthdate']),
+                    data.get('email', ''),
+                    data.get('phone', ''),
+                    data['room'],
+                    int(data['guests']),
+                    data['arrival'],
+                    data['departure'],
+                    hp,
+                    hp_fleisch,
+                    hp_vegi,
+                    new_status,
+                    data['address'],
+                    data['postal_code'],
+                    data['city'],
+                    data['country'],
+                    data['note'],
+                    payment_status,
+                    payment_method,
+                    id,
+                    id,
+                    safe_int(data.get('version', 0))
+                ))
+                previous = cursor.fetchone()
+                if previous is None:
+                    raise BookingConflict()
+
+                if new_status != previous['status']:
+                    cursor.execute('''
+                        INSERT INTO booking_history (booking_id, status, changed_at, changed_by)
+                        VALUES (%s, %s, %s, %s)
+                    ''', (id, new_status, datetime.now(), session.get('user_id')))
+
+                # Nur geänderte Mitreisende löschen bzw. einfügen
+                sync_guests(cursor, id, form_guests(data, 1, int(data['guests'])))
+                store_booking_changes(cursor, id, tariff, rollup_before)
+        except BookingConflict:
+            return ("Die Buchung wurde inzwischen von jemand anderem geändert oder gelöscht. "
+                    "Bitte die Seite neu laden und die Änderungen erneut erfassen."), 409
+        _card_cache.invalidate(id)
 
-        db.commit()
         return redirect(url_for('index'))
 
-    # Hole die Buchung und die Gäste
-    cursor.execute('SELECT * FROM bookings WHERE id = %s', (id,))
-    booking = cursor.fetchone()
-    cursor.execute('SELECT * FROM guests WHERE booking_id = %s', (id,))
-    guests = cursor.fetchall()
-
-    return render_template('edit_booking.html', booking=booking, guests=guests, history=history, rooms=rooms)
+    loaded = load_booking_for_edit(id)
+    if loaded is None:
+        return "Buchung nicht gefunden", 404
+    booking, guests, history = loaded
+    return render_template('edit_booking.html', booking=booking, guests=guests, history=history, rooms=get_rooms())
 
 
 def is_admin(user_id):
@@ -676,6 +1548,7 @@ def admin():
                 # Benutzer löschen
                 cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
                 db.commit()
+                _users_version_cache.invalidate()
 
                 print(f"Benutzer mit ID {user_id} erfolgreich gelöscht.")  # Debugging
                 return redirect(url_for('admin'))
@@ -698,6 +1571,10 @@ def admin():
                 WHERE category = %s
             """, (weekend_price, weekday_price, category))
             db.commit()
+            _tariff_version_cache.invalidate()
+            # Die Neuberechnung aller Buchungen dauert; bis sie fertig ist, rechnen die Ansichten veraltete
+            # Preise selbst nach (siehe stored_prices)
+            run_in_background(refresh_tariff_data)
 
         return redirect(url_for('admin'))
 
@@ -718,6 +1595,7 @@ def remove_user(user_id):
 
         cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
         db.commit()
+        _users_version_cache.invalidate()
         return redirect(url_for('admin'))
 
     except Exception as e:
@@ -727,38 +1605,76 @@ def remove_user(user_id):
 
 @app.route('/update_booking_date/<booking_id>', methods=['POST'])
 def update_booking_date(booking_id):
-    db = get_db()
     new_arrival = request.form['arrival']
     new_departure = request.form['departure']
 
-    # Überprüfen, ob das Zimmer verfügbar ist
-    room = request.form['room']
-    if not is_room_available(room, new_arrival, new_departure):
-        return "Zimmer nicht verfügbar für das neue Datum", 400
+    with transaction() as cursor:
+        # Geprüft wird das Zimmer der Buchung; ein Zimmerwechsel geht nur über das Bearbeitungsformular
+        cursor.execute('SELECT room, guests FROM bookings WHERE id = %s', (booking_id,))
+        booking = cursor.fetchone()
+        if booking is None:
+            return "Buchung nicht gefunden", 404
+        room = booking['room']
+
+        # Überprüfen, ob das Zimmer verfügbar ist (die Buchung selbst zählt dabei nicht)
+        lock_room(cursor, room)
+        if not is_room_available(room, new_arrival, new_departure, booking['guests'] or 1, booking_id):
+            return "Zimmer nicht verfügbar für das neue Datum", 400
+
+        tariff = get_tariff(cursor)
+        rollup_before = load_booking_rollup(cursor, booking_id, tariff)
+        # Wurde die Buchung inzwischen in ein anderes Zimmer verschoben, gilt die Prüfung oben nicht mehr
+        cursor.execute('UPDATE bookings SET arrival = %s, departure = %s WHERE id = %s AND room = %s',
+                       (new_arrival, new_departure, booking_id, room))
+        if cursor.rowcount == 0:
+            return "Die Buchung wurde inzwischen von jemand anderem geändert. Bitte die Seite neu laden.", 409
+        # Preis für die neuen Daten berechnen und speichern
+        store_booking_changes(cursor, booking_id, tariff, rollup_before)
+    _card_cache.invalidate(booking_id)
+
+    # Rückgabe der Bestätigung
+    return "Buchung erfolgreich aktualisiert"
 
-    # Berechne den neuen Preis basierend auf den neuen Daten
-    erw, kind, baby = get_age_distribution(booking_id)
-    price = calculate_price(new_arrival, new_departure, erw, kind, baby, 'Ja', 0, 0)  # Beispiel für Halbpension
 
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute('''
-        UPDATE bookings 
-        SET arrival = %s, departure = %s, total_price = %s 
-        WHERE id = %s
-    ''', (new_arrival, new_departure, price, booking_id))
+def get_change_version(name):
+    # Änderungszähler, der per Trigger bei jeder Änderung an Buchungen/Gästen hochgezählt wird (siehe init_db.py)
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute('SELECT version, changed_at FROM change_counters WHERE name = %s', (name,))
+    row = cursor.fetchone()
+    if row is None:
+        return 0, None
+    return row
+
+
+def conditional_response(etag, last_modified):
+    # Liefert eine 304-Antwort, falls der Client den aktuellen Stand bereits hat
+    if request.if_none_match:
+        matches = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified is not None:
+        matches = last_modified.replace(microsecond=0) <= request.if_modified_since
+    else:
+        matches = False
+    if not matches:
+        return None
+    return with_validators(app.response_class(status=304), etag, last_modified)
 
-    # Änderungen in der Datenbank speichern
-    db.commit()
 
-    # Rückgabe der Bestätigung
-    return "Buchung erfolgreich aktualisiert"
+def with_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Der Browser muss bei jedem Aufruf nachfragen, darf aber die gespeicherte Antwort wiederverwenden
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 
 @app.route('/calendar')
 def calendar():
     if not session.get('user_id'):
         return redirect(url_for('login'))
-    return render_template('calendar.html')
+    return render_template('calendar.html', rooms=get_room_catalogue().values())
 
 
 def format_date_to_iso(date):
@@ -768,54 +1684,352 @@ def format_date_to_iso(date):
     return date  # Falls das Datum schon im richtigen Format ist, einfach zurückgeben
 
 
+STATUS_CLASSES = {
+    'Option': 'option',  # Gelb
+    'Bestätigt': 'confirmed',  # Blau
+    'Checked In': 'checkedin',  # Grün
+    'Ausgecheckt': 'checkedout',
+    'Storniert': 'cancelled'  # Rot
+}
+
+
+def booking_event(b, rooms):
+    # Kalendereintrag einer Buchung im Format von FullCalendar
+    room = rooms.get(b.room)
+    room_class = room.css_class if room else 'default-room'  # Zimmerfarbe zuweisen
+    status_class = STATUS_CLASSES.get(b.status, 'option')  # Statusfarbe zuweisen
+    return {
+        'id': str(b.id),
+        'title': f"{b.name} ({b.guests} P)",
+        'start': b.arrival.strftime('%Y-%m-%dT%H:%M:%S'),  # Startdatum als ISO 8601
+        'end': b.departure.strftime('%Y-%m-%dT%H:%M:%S'),  # Enddatum als ISO 8601
+        'url': f"/edit/{b.id}",
+        'extendedProps': {
+            'statusClass': status_class
+        },
+        'className': f"{room_class} {status_class}"  # Klasse für Zimmer und Status
+    }
+
+
 @app.route('/api/bookings')
 def api_bookings():
     if not session.get('user_id'):
         return jsonify([])
 
+    # FullCalendar übergibt den sichtbaren Bereich als ISO-Zeitstempel, relevant ist nur das Datum
+    range_start = safe_parse_date(request.args.get('start', '')[:10])
+    range_end = safe_parse_date(request.args.get('end', '')[:10])
+
+    # Unveränderte Zeiträume werden mit 304 beantwortet, ohne die Buchungen zu laden
+    version, changed_at = get_change_version('bookings')
+    etag = f"bookings-{version}-{range_start}-{range_end}"
+    not_modified = conditional_response(etag, changed_at)
+    if not_modified is not None:
+        return not_modified
+
+    query = f'SELECT {select_list(CALENDAR_COLUMNS)} FROM bookings WHERE status != %s'
+    params = ['Storniert']
+    if range_start and range_end and range_start < range_end:
+        # Alle Aufenthalte, die sich mit dem sichtbaren Bereich überschneiden (GiST-Index auf stay)
+        query += " AND stay && daterange(%s, %s, '[)')"
+        params += [range_start, range_end]
+
     db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute('SELECT * FROM bookings WHERE status != %s', ('Storniert',))
-    bookings = cursor.fetchall()
-
-    room_class_map = {
-        "Doppelzimmer": "room-doppel",
-        "4er-Zimmer 1": "room-vz1",
-        "4er-Zimmer 2": "room-vz2",
-        "6er-Zimmer 1": "room-sz1",
-        "6er-Zimmer 2": "room-sz2"
-    }
+    cursor = db.cursor()
+    cursor.execute(query, params)
+    bookings = Booking.from_rows(cursor.fetchall(), CALENDAR_COLUMNS)
 
-    status_classes = {
-        'Option': 'option',  # Gelb
-        'Bestätigt': 'confirmed',  # Blau
-        'Checked In': 'checkedin',  # Grün
-        'Ausgecheckt': 'checkedout',
-        'Storniert': 'cancelled'  # Rot
-    }
+    rooms = get_room_catalogue()
+    events = [booking_event(b, rooms) for b in bookings]
+    return with_validators(jsonify(events), etag, changed_at)
 
-    events = []
-    for b in bookings:
-        main_guest_name = b['name']
-        num_guests = b['guests']
-        start_date = b['arrival'].strftime('%Y-%m-%dT%H:%M:%S')  # Startdatum als ISO 8601
-        end_date = b['departure'].strftime('%Y-%m-%dT%H:%M:%S')  # Enddatum als ISO 8601
 
-        room_class = room_class_map.get(b['room'], 'default-room')  # Zimmerfarbe zuweisen
-        status_class = status_classes.get(b['status'], 'option')  # Statusfarbe zuweisen
+# Kennzahlen der Tabelle daily_rollup (pro Tag und Zimmer)
+ROLLUP_FIELDS = ('beds', 'adults', 'children', 'babies', 'hp_covers', 'revenue', 'kurtaxe')
 
-        events.append({
-            'title': f"{main_guest_name} ({num_guests} P)",
-            'start': start_date,
-            'end': end_date,
-            'url': f"/edit/{b['id']}",
-            'extendedProps': {
-                'statusClass': status_classes.get(b['status'], 'option')  # Status wird hier zugewiesen
-            },
-            'className': f"{room_class} {status_class}"  # Klasse für Zimmer und Status
-        })
 
-    return jsonify(events)
+def booking_rollup(booking, ages, tariff):
+    # Beitrag einer Buchung zu daily_rollup: {(Tag, Zimmer): [beds, adults, ..., kurtaxe]};
+    # alte Buchungen ohne Anreise oder Abreise (NULL) zählen nicht
+    if booking.status == 'Storniert' or not booking.room or booking.arrival is None or booking.departure is None:
+        return {}
+    arrival = safe_parse_date(booking.arrival)
+    departure = safe_parse_date(booking.departure)
+    if arrival is None or departure is None:
+        return {}
+
+    _, (erw, kind, baby) = describe_ages(ages)
+    weekend, weekday, kurtaxe, half_board = tariff.night_rates(tariff.band_counts(ages), booking.hp)
+    hp_covers = 0
+    if booking.hp == 'Ja':
+        hp_covers = (booking.hp_fleisch or 0) + (booking.hp_vegi or 0) or erw + kind + baby
+
+    contributions = {}
+    for night in range((departure - arrival).days):
+        day = arrival + timedelta(days=night)
+        lodging = weekend if day.weekday() in WEEKEND_DAYS else weekday
+        contributions[(day, booking.room)] = [booking.guests or 0, erw, kind, baby, hp_covers,
+                                                 lodging + half_board, kurtaxe]
+    return contributions
+
+
+def load_pricing_booking(cursor, booking_id):
+    # Buchung mit den Spalten für Preis und Auswertungen samt Alter der Gäste; None, falls gelöscht.
+    # Die Zeile bleibt bis zum Ende der Transaktion gesperrt: parallele Änderungen derselben Buchung laufen
+    # nacheinander und berechnen ihre Differenz für daily_rollup vom jeweils gespeicherten Stand aus
+    cursor.execute(f'SELECT {select_list(PRICING_COLUMNS)} FROM bookings WHERE id = %s FOR UPDATE', (booking_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    booking = Booking.from_row(row, PRICING_COLUMNS)
+    cursor.execute('SELECT birthdate FROM guests WHERE booking_id = %s', (booking_id,))
+    return booking, get_guest_ages(booking_id, booking.birthdate, [row[0] for row in cursor.fetchall()])
+
+
+def load_booking_rollup(cursor, booking_id, tariff=None):
+    # Aktueller Beitrag einer Buchung gemäss Datenbankstand (leer, falls gelöscht)
+    loaded = load_pricing_booking(cursor, booking_id)
+    if loaded is None:
+        return {}
+    booking, ages = loaded
+    return booking_rollup(booking, ages, tariff or get_tariff(cursor))
+
+
+def apply_rollup(cursor, contributions, sign=1):
+    rows = [(day, room, *[sign * value for value in values]) for (day, room), values in contributions.items()
+            if any(values)]
+    if not rows:
+        return
+    updates = ', '.join(f"{field} = daily_rollup.{field} + EXCLUDED.{field}" for field in ROLLUP_FIELDS)
+    psycopg2.extras.execute_values(cursor, f"""
+        INSERT INTO daily_rollup (day, room, {', '.join(ROLLUP_FIELDS)}) VALUES %s
+        ON CONFLICT (day, room) DO UPDATE SET {updates}
+    """, rows)
+
+
+def rollup_delta(before, after):
+    # Differenz zwischen altem und neuem Beitrag einer Buchung
+    delta = {}
+    for key in before.keys() | after.keys():
+        old_values = before.get(key, [0] * len(ROLLUP_FIELDS))
+        new_values = after.get(key, [0] * len(ROLLUP_FIELDS))
+        delta[key] = [new - old for new, old in zip(new_values, old_values)]
+    return delta
+
+
+def update_booking_rollup(cursor, booking_id, before, tariff=None):
+    # Bucht die Differenz zwischen altem und neuem Beitrag einer Buchung auf daily_rollup
+    apply_rollup(cursor, rollup_delta(before, load_booking_rollup(cursor, booking_id, tariff)))
+
+
+def store_booking_changes(cursor, booking_id, tariff, rollup_before=None):
+    # Nach dem Anlegen oder Ändern einer Buchung: Preis speichern und daily_rollup nachführen.
+    # Der neue Stand wird dafür nur einmal geladen; rollup_before fehlt bei neuen Buchungen
+    loaded = load_pricing_booking(cursor, booking_id)
+    after = {}
+    if loaded is not None:
+        booking, ages = loaded
+        write_price_snapshots(cursor, price_snapshot_rows([booking], {booking.id: ages}, tariff))
+        after = booking_rollup(booking, ages, tariff)
+    apply_rollup(cursor, rollup_delta(rollup_before or {}, after))
+
+
+def rebuild_rollups(batch_size=EXPORT_BATCH_SIZE):
+    # Baut daily_rollup aus allen Buchungen neu auf, z.B. nach Preisänderungen oder zum Nachfüllen.
+    # Die Tabelle wird vor dem Lesen gesperrt und Lesen wie Ersetzen laufen in derselben Transaktion:
+    # parallele Änderungen warten in apply_rollup und buchen ihre Differenz danach auf den neuen Stand
+    with transaction() as cursor:
+        cursor.execute('LOCK TABLE daily_rollup IN EXCLUSIVE MODE')
+        tariff = get_tariff(cursor)
+        totals = {}
+        bookings_cursor = get_db().cursor(name='rollup_rebuild')
+        try:
+            bookings_cursor.execute(f'SELECT {select_list(PRICING_COLUMNS)} FROM bookings')
+            while True:
+                bookings = Booking.from_rows(bookings_cursor.fetchmany(batch_size), PRICING_COLUMNS)
+                if not bookings:
+                    break
+                guest_birthdates = load_guest_birthdates([b.id for b in bookings])
+                for b in bookings:
+                    ages = get_guest_ages(b.id, b.birthdate, guest_birthdates[b.id])
+                    for key, values in booking_rollup(b, ages, tariff).items():
+                        current = totals.setdefault(key, [0] * len(ROLLUP_FIELDS))
+                        totals[key] = [c + v for c, v in zip(current, values)]
+        finally:
+            bookings_cursor.close()
+
+        cursor.execute('DELETE FROM daily_rollup')
+        apply_rollup(cursor, totals)
+    return len(totals)
+
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    rows = rebuild_rollups()
+    print(f"✔️ daily_rollup neu aufgebaut ({rows} Einträge).")
+
+
+def reprice_bookings(batch_size=EXPORT_BATCH_SIZE):
+    # Speichert den Preis aller Buchungen zum aktuellen Tarif neu, z.B. nach Preisänderungen oder zum Nachfüllen.
+    # Jeder Block (nach ID) läuft in einer eigenen kurzen Transaktion, damit Buchungen und change_counters
+    # nicht für die ganze Neuberechnung gesperrt bleiben; schon zum aktuellen Tarif gespeicherte Preise bleiben
+    count = 0
+    last_id = None
+    while True:
+        with transaction() as cursor:
+            tariff = get_tariff(cursor)
+            cursor.execute(f"""
+                SELECT {select_list(PRICING_COLUMNS)} FROM bookings
+                WHERE (%(last_id)s::uuid IS NULL OR id > %(last_id)s::uuid)
+                AND tariff_version IS DISTINCT FROM %(tariff_version)s
+                ORDER BY id
+                LIMIT %(limit)s
+                FOR UPDATE
+            """, {'last_id': last_id, 'tariff_version': tariff.version, 'limit': batch_size})
+            bookings = Booking.from_rows(cursor.fetchall(), PRICING_COLUMNS)
+            if not bookings:
+                return count
+            guest_birthdates = load_guest_birthdates([b.id for b in bookings])
+            ages = {b.id: get_guest_ages(b.id, b.birthdate, guest_birthdates[b.id]) for b in bookings}
+            rows = price_snapshot_rows(bookings, ages, tariff)
+            write_price_snapshots(cursor, rows)
+        count += len(rows)
+        last_id = bookings[-1].id
+
+
+def refresh_tariff_data():
+    # Gespeicherte Preise und die Umsätze in daily_rollup basieren auf dem Tarif und werden neu berechnet
+    reprice_bookings()
+    rebuild_rollups()
+
+
+@app.cli.command('reprice-bookings')
+def reprice_bookings_command():
+    count = reprice_bookings()
+    print(f"✔️ Preise von {count} Buchungen neu berechnet.")
+
+
+# Zeiträume für Belegungs- und Umsatzberichte aus daily_rollup; die Sommersaison dauert von Mai bis Oktober
+ROLLUP_PERIODS = {
+    'month': ('Monat', "to_char(days.day, 'YYYY-MM')"),
+    'year': ('Jahr', "to_char(days.day, 'YYYY')"),
+    'season': ('Saison', "CASE WHEN EXTRACT(MONTH FROM days.day) BETWEEN 5 AND 10 "
+                         "THEN 'Sommer ' || to_char(days.day, 'YYYY') "
+                         "ELSE 'Winter ' || (EXTRACT(YEAR FROM days.day)::int "
+                         "- CASE WHEN EXTRACT(MONTH FROM days.day) < 5 THEN 1 ELSE 0 END) END"),
+}
+
+
+def build_rollup_report(period, start_date, end_date):
+    label, period_expr = ROLLUP_PERIODS[period]
+    db = get_db()
+    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor.execute(f"""
+        WITH days AS (
+            SELECT day::date AS day FROM generate_series(%(start_date)s::date, %(end_date)s::date, interval '1 day') AS day
+        ),
+        daily AS (
+            SELECT day, SUM(beds) AS beds, SUM(adults) AS adults, SUM(children) AS children, SUM(babies) AS babies,
+                   SUM(hp_covers) AS hp_covers, SUM(revenue) AS revenue, SUM(kurtaxe) AS kurtaxe
+            FROM daily_rollup
+            WHERE day BETWEEN %(start_date)s AND %(end_date)s
+            GROUP BY day
+        )
+        SELECT {period_expr} AS period, COUNT(*) AS days,
+               COALESCE(SUM(daily.beds), 0)::bigint AS bed_nights, COALESCE(SUM(daily.adults), 0)::bigint AS adults,
+               COALESCE(SUM(daily.children), 0)::bigint AS children, COALESCE(SUM(daily.babies), 0)::bigint AS babies,
+               COALESCE(SUM(daily.hp_covers), 0)::bigint AS hp_covers, COALESCE(SUM(daily.revenue), 0) AS revenue,
+               COALESCE(SUM(daily.kurtaxe), 0) AS kurtaxe
+        FROM days
+        LEFT JOIN daily ON daily.day = days.day
+        GROUP BY 1
+        ORDER BY MIN(days.day)
+    """, {'start_date': start_date, 'end_date': end_date})
+    rows = [dict(row) for row in cursor.fetchall()]
+
+    # Auslastung: belegte Betten im Verhältnis zu allen Betten im Zeitraum
+    capacity = sum(room.capacity for room in get_room_catalogue().values())
+    for row in rows:
+        row['occupancy'] = 100.0 * row['bed_nights'] / (capacity * row['days']) if capacity and row['days'] else 0.0
+
+    totals = {key: sum(row[key] for row in rows)
+              for key in ('days', 'bed_nights', 'adults', 'children', 'babies', 'hp_covers', 'revenue', 'kurtaxe')}
+    totals['occupancy'] = 100.0 * totals['bed_nights'] / (capacity * totals['days']) \
+        if capacity and totals['days'] else 0.0
+    return f"Belegung und Umsatz pro {label}", rows, totals
+
+
+# Filter und Titel der Berichte; Stornierungen erscheinen in keinem Bericht
+REPORTS = {
+    'arrival': ('Anreisen', "b.arrival BETWEEN %(start_date)s AND %(end_date)s"),
+    'in_house': ('Im Haus', "b.status IN ('Bestätigt', 'Checked In') "
+                            "AND b.arrival <= %(today)s AND b.departure >= %(today)s"),
+    'departure': ('Heutige Abreise', "b.departure = %(today)s"),
+}
+
+
+def build_report(report_type, start_date, end_date, today):
+    # Ein einziger aggregierter Query pro Bericht: Alter, Altersgruppen und Mitreisende werden
+    # in SQL pro Buchung zusammengefasst, die Preise anschliessend gesammelt berechnet
+    title, condition = REPORTS[report_type]
+    query = f"""
+        WITH report_bookings AS (
+            SELECT b.* FROM bookings b
+            WHERE COALESCE(b.status, '') <> 'Storniert' AND {condition}
+        ),
+        guest_ages AS (
+            SELECT rb.id AS booking_id, (%(today)s - rb.birthdate) / 365 AS age
+            FROM report_bookings rb
+            WHERE rb.birthdate IS NOT NULL
+            UNION ALL
+            SELECT g.booking_id, (%(today)s - g.birthdate) / 365
+            FROM guests g
+            JOIN report_bookings rb ON rb.id = g.booking_id
+            WHERE g.birthdate IS NOT NULL
+        ),
+        age_groups AS (
+            SELECT booking_id,
+                   array_agg(age) AS ages,
+                   COUNT(*) FILTER (WHERE age >= 16) AS erw,
+                   COUNT(*) FILTER (WHERE age >= 6 AND age < 16) AS kind,
+                   COUNT(*) FILTER (WHERE age < 6) AS baby
+            FROM guest_ages
+            GROUP BY booking_id
+        ),
+        guest_names AS (
+            SELECT g.booking_id, string_agg(g.name, ', ' ORDER BY g.id) AS names
+            FROM guests g
+            JOIN report_bookings rb ON rb.id = g.booking_id
+            GROUP BY g.booking_id
+        )
+        SELECT rb.id, rb.name, rb.room, r.type AS room_type, rb.guests, rb.hp,
+               CASE WHEN rb.hp = 'Ja' THEN COALESCE(rb.hp_fleisch, 0) ELSE 0 END AS hp_fleisch,
+               CASE WHEN rb.hp = 'Ja' THEN COALESCE(rb.hp_vegi, 0) ELSE 0 END AS hp_vegi,
+               rb.arrival, rb.departure, rb.total_price, rb.tariff_version,
+               COALESCE(ag.ages, '{{}}') AS ages,
+               COALESCE(ag.erw, 0) AS erw, COALESCE(ag.kind, 0) AS kind, COALESCE(ag.baby, 0) AS baby,
+               gn.names AS guest_names
+        FROM report_bookings rb
+        LEFT JOIN age_groups ag ON ag.booking_id = rb.id
+        LEFT JOIN guest_names gn ON gn.booking_id = rb.id
+        LEFT JOIN rooms r ON r.name = rb.room
+        ORDER BY rb.arrival, rb.name
+    """
+    db = get_db()
+    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor.execute(query, {'start_date': start_date, 'end_date': end_date, 'today': today})
+    rows = [dict(row) for row in cursor.fetchall()]
+
+    pricing = [Booking(id=row['id'], arrival=row['arrival'], departure=row['departure'], hp=row['hp'],
+                       total_price=row['total_price'], tariff_version=row['tariff_version']) for row in rows]
+    prices = stored_prices(pricing, {row['id']: row['ages'] for row in rows})
+    for row, price in zip(rows, prices):
+        row['total_price'] = price
+
+    totals = {key: sum(row[key] or 0 for row in rows)
+              for key in ('guests', 'erw', 'kind', 'baby', 'hp_fleisch', 'hp_vegi', 'total_price')}
+    totals['total_price'] = round(totals['total_price'], 2)
+    return title, rows, totals
 
 
 @app.route('/reports', methods=['GET', 'POST'])
@@ -823,117 +2037,27 @@ def reports():
     if not session.get('user_id'):
         return redirect(url_for('login'))
 
-    db = get_db()
     error = None
     reports = []
-    today = datetime.today().date()
+    rollup_report = None
 
     if request.method == 'POST':
         report_type = request.form.get('report_type')
+        if report_type in REPORTS:
+            # Anreisen im gewählten Zeitraum, "Im Haus" und Abreisen beziehen sich auf heute
+            reports.append(build_report(report_type, request.form.get('start_date'), request.form.get('end_date'),
+                                        date.today()))
+        elif report_type in ROLLUP_PERIODS:
+            start_date = safe_parse_date(request.form.get('start_date', ''))
+            end_date = safe_parse_date(request.form.get('end_date', ''))
+            if start_date is None or end_date is None or start_date > end_date:
+                error = "Bitte einen gültigen Zeitraum wählen"
+            else:
+                rollup_report = build_rollup_report(report_type, start_date, end_date)
+        else:
+            error = "Unbekannter Berichtstyp"
 
-        if report_type == 'arrival':
-            # Anreisen im gewählten Zeitraum
-            start_date = request.form.get('start_date')
-            end_date = request.form.get('end_date')
-            query = """
-                SELECT b.name, b.guests, b.hp, b.hp_fleisch, b.hp_vegi, b.arrival, b.departure, g.name as guest_name, g.birthdate
-                FROM bookings b
-                LEFT JOIN guests g ON b.id = g.booking_id
-                WHERE b.arrival BETWEEN %s AND %s
-            """
-            cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cursor.execute(query, (start_date, end_date))
-            rows = cursor.fetchall()
-
-            # Berechnung des Alters der Gäste
-            report_data = []
-            today = date.today()
-            for row in rows:
-                guest_age = None
-                if row['birthdate']:
-                    guest_age = (today - datetime.strptime(row['birthdate'], "%Y-%m-%d").date()).days // 365
-                report_data.append({
-                    'name': row['name'],
-                    'guests': row['guests'],
-                    'hp': row['hp'],
-                    'hp_fleisch': row['hp_fleisch'],
-                    'hp_vegi': row['hp_vegi'],
-                    'guest_name': row['guest_name'],
-                    'guest_age': guest_age,
-                    'arrival': row['arrival'],
-                    'departure': row['departure']
-                })
-            reports.append(('Anreisen', report_data))
-
-        elif report_type == 'in_house':
-            # Im Haus Liste
-            query = """
-                SELECT b.name, b.guests, b.hp, b.hp_fleisch, b.hp_vegi, b.arrival, b.departure, r.type as room_type, g.name as guest_name, g.birthdate
-                FROM bookings b
-                LEFT JOIN guests g ON b.id = g.booking_id
-                LEFT JOIN rooms r ON b.room = r.name
-                WHERE b.status = 'Bestätigt' AND b.arrival <= %s AND b.departure >= %s
-            """
-            cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cursor.execute(query, (today, today))
-            rows = cursor.fetchall()
-
-            # Berechnung des Alters der Gäste
-            report_data = []
-            for row in rows:
-                guest_age = None  # Setze einen Standardwert
-                if row['birthdate']:
-                    guest_age = (today - datetime.strptime(row['birthdate'], "%Y-%m-%d").date()).days // 365
-                report_data.append({
-                    'name': row['name'],
-                    'guests': row['guests'],
-                    'hp': row['hp'],
-                    'hp_fleisch': row['hp_fleisch'],
-                    'hp_vegi': row['hp_vegi'],
-                    'room_type': row['room_type'],
-                    'guest_name': row['guest_name'],
-                    'guest_age': guest_age,
-                    'arrival': row['arrival'],
-                    'departure': row['departure']
-                })
-            reports.append(('Im Haus', report_data))
-
-        elif report_type == 'departure':
-            # Heutige Abreise Liste
-            query = """
-                SELECT b.name, b.guests, b.hp, b.hp_fleisch, b.hp_vegi, b.arrival, b.departure, g.name as guest_name, g.birthdate
-                FROM bookings b
-                LEFT JOIN guests g ON b.id = g.booking_id
-                WHERE b.departure = %s
-            """
-            cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cursor.execute(query, (today,))
-            rows = cursor.fetchall()
-
-            # Berechnung des Alters der Gäste und Gesamtpreis
-            report_data = []
-            for row in rows:
-                guest_age = None  # Setze einen Standardwert
-                if row['birthdate']:
-                    guest_age = (today - datetime.strptime(row['birthdate'], "%Y-%m-%d").date()).days // 365
-                    price = calculate_price(row['arrival'], row['departure'], row['guests'], row['hp'],
-                                            row['hp_fleisch'] if 'hp_fleisch' in row else 0,
-                                            # Standardwert 0, wenn nicht vorhanden
-                                            row[
-                                                'hp_vegi'] if 'hp_vegi' in row else 0)  # Standardwert 0, wenn nicht vorhanden
-                report_data.append({
-                    'name': row['name'],
-                    'guests': row['guests'],
-                    'hp': row['hp'],
-                    'hp_fleisch': row['hp_fleisch'],
-                    'hp_vegi': row['hp_vegi'],
-                    'guest_name': row['guest_name'],
-                    'guest_age': guest_age,
-                    'total_price': price
-                })
-            reports.append(('Heutige Abreise', report_data))
-
-    return render_template('reports.html', reports=reports, error=error)
+    return render_template('reports.html', reports=reports, rollup_report=rollup_report, error=error)
 
 
 @app.route('/change_password', methods=['GET', 'POST'])
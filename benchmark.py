@@ -0,0 +1,334 @@
+import argparse
+import io
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import date, timedelta
+
+import psycopg2
+
+from models import Booking, PRICING_COLUMNS, select_list
+
+# Lastmessung mit synthetischen Buchungen.
+#
+#   python benchmark.py --bookings 100000 --save-baseline bench_baseline.json
+#   python benchmark.py --bookings 100000 --compare bench_baseline.json
+#
+# Ohne BENCH_DATABASE_URL wird mit initdb/pg_ctl (PATH oder PG_BIN) eine temporäre PostgreSQL-Instanz
+# gestartet und danach wieder entfernt; initdb verweigert den Start als root. Mit BENCH_DATABASE_URL wird
+# die angegebene (leere!) Datenbank verwendet – vorhandene Buchungen werden dabei gelöscht.
+
+FIRST_NAMES = ['Anna', 'Beat', 'Corinne', 'Daniel', 'Eva', 'Fritz', 'Gabi', 'Hans', 'Irene', 'Jonas', 'Karin',
+               'Lukas', 'Monika', 'Nico', 'Olivia', 'Peter', 'Regula', 'Simon', 'Tanja', 'Urs', 'Vreni', 'Walter']
+LAST_NAMES = ['Ammann', 'Brunner', 'Caduff', 'Dubach', 'Egger', 'Frei', 'Gerber', 'Huber', 'Imhof', 'Jost',
+              'Keller', 'Lehmann', 'Meier', 'Niederberger', 'Oberli', 'Portmann', 'Rossi', 'Schmid', 'Tanner',
+              'Vogel', 'Wyss', 'Zürcher']
+CITIES = [('3000', 'Bern'), ('8000', 'Zürich'), ('4000', 'Basel'), ('6000', 'Luzern'), ('3800', 'Interlaken'),
+          ('1700', 'Fribourg'), ('79098', 'Freiburg im Breisgau'), ('80331', 'München')]
+STATUSES = [('Option', 15), ('Bestätigt', 45), ('Checked In', 5), ('Ausgecheckt', 25), ('Storniert', 10)]
+
+
+class EphemeralPostgres:
+    # Temporäre PostgreSQL-Instanz nur für die Messung (Unix-Socket im Datenverzeichnis, kein TCP)
+    def __init__(self):
+        bin_dir = os.getenv('PG_BIN')
+        self.initdb = os.path.join(bin_dir, 'initdb') if bin_dir else shutil.which('initdb')
+        self.pg_ctl = os.path.join(bin_dir, 'pg_ctl') if bin_dir else shutil.which('pg_ctl')
+        if not self.initdb or not self.pg_ctl:
+            raise SystemExit("initdb/pg_ctl nicht gefunden: PG_BIN setzen oder BENCH_DATABASE_URL angeben")
+        self.directory = tempfile.mkdtemp(prefix='alphuette-bench-')
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.port = probe.getsockname()[1]
+
+    def start(self):
+        data = os.path.join(self.directory, 'data')
+        subprocess.run([self.initdb, '-D', data, '-U', 'bench', '--auth=trust', '-E', 'UTF8'],
+                       check=True, stdout=subprocess.DEVNULL)
+        options = f"-k {self.directory} -p {self.port} -c listen_addresses='' -c fsync=off"
+        subprocess.run([self.pg_ctl, '-D', data, '-o', options, '-l', os.path.join(self.directory, 'pg.log'),
+                        '-w', 'start'], check=True, stdout=subprocess.DEVNULL)
+        return f"host={self.directory} port={self.port} dbname=postgres user=bench"
+
+    def stop(self):
+        subprocess.run([self.pg_ctl, '-D', os.path.join(self.directory, 'data'), '-m', 'fast', 'stop'],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def copy_rows(cursor, table, columns, rows):
+    # COPY statt einzelner INSERTs; Werte sind tab-getrennt, NULL als \N
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join('\\N' if value is None else str(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def random_birthdate(rng, today, adult):
+    age = rng.randint(18, 80) if adult else rng.randint(0, 17)
+    return today - timedelta(days=age * 365 + rng.randint(0, 364))
+
+
+def seed(dsn, bookings, max_guests, seasons, rng, batch_size=20000):
+    import init_db
+
+    conn = psycopg2.connect(dsn)
+    try:
+        init_db.migrate(conn)
+        cursor = conn.cursor()
+        cursor.execute("TRUNCATE bookings, guests, booking_history, room_nights, daily_rollup CASCADE")
+        cursor.execute("SELECT name, capacity FROM rooms ORDER BY name")
+        rooms = cursor.fetchall()
+        conn.commit()
+
+        today = date.today()
+        # Die Buchungen verteilen sich über die letzten und die kommende Saison(en)
+        first_day = date(today.year - seasons + 1, 1, 1)
+        span = (date(today.year + 1, 12, 31) - first_day).days
+        statuses, weights = zip(*STATUSES)
+
+        started = time.perf_counter()
+        created = 0
+        while created < bookings:
+            booking_rows = []
+            guest_rows = []
+            for _ in range(min(batch_size, bookings - created)):
+                room, capacity = rng.choice(rooms)
+                guests = rng.randint(1, max(1, min(capacity, max_guests)))
+                arrival = first_day + timedelta(days=rng.randrange(span))
+                departure = arrival + timedelta(days=rng.randint(1, 7))
+                hp = rng.random() < 0.4
+                hp_fleisch = rng.randint(0, guests) if hp else 0
+                postal_code, city = rng.choice(CITIES)
+                booking_id = uuid.uuid4()
+                last_name = rng.choice(LAST_NAMES)
+                booking_rows.append((
+                    booking_id, f"{rng.choice(FIRST_NAMES)} {last_name}", random_birthdate(rng, today, True),
+                    room, guests, arrival, departure, 'Ja' if hp else 'Nein', hp_fleisch,
+                    guests - hp_fleisch if hp else 0, f"{last_name.lower()}@example.ch", '079 000 00 00',
+                    rng.choices(statuses, weights)[0], 'Dorfstrasse 1', postal_code, city, 'CH', '',
+                ))
+                for _ in range(guests - 1):
+                    guest_rows.append((booking_id, f"{rng.choice(FIRST_NAMES)} {last_name}",
+                                       random_birthdate(rng, today, rng.random() < 0.6)))
+            copy_rows(cursor, 'bookings',
+                      ['id', 'name', 'birthdate', 'room', 'guests', 'arrival', 'departure', 'hp', 'hp_fleisch',
+                       'hp_vegi', 'email', 'phone', 'status', 'address', 'postal_code', 'city', 'country', 'notes'],
+                      booking_rows)
+            copy_rows(cursor, 'guests', ['booking_id', 'name', 'birthdate'], guest_rows)
+            conn.commit()
+            created += len(booking_rows)
+            print(f"  {created}/{bookings} Buchungen angelegt", end='\r', flush=True)
+        cursor.execute("ANALYZE")
+        conn.commit()
+        print(f"✔️ {created} Buchungen in {time.perf_counter() - started:.1f} s angelegt")
+        return first_day, span
+    finally:
+        conn.close()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def measure(name, run, iterations):
+    # run() liefert (Anzahl Abfragen, Bytes); gemessen wird zuerst ohne, dann einmal mit tracemalloc
+    run()  # Aufwärmen (Caches, Importe)
+    durations, queries, sizes = [], [], []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        query_count, size = run()
+        durations.append(time.perf_counter() - started)
+        queries.append(query_count)
+        sizes.append(size)
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'p50_ms': percentile(durations, 50) * 1000,
+        'p95_ms': percentile(durations, 95) * 1000,
+        'p99_ms': percentile(durations, 99) * 1000,
+        'max_ms': max(durations) * 1000,
+        'queries': statistics.median(queries),
+        'bytes': statistics.median(sizes),
+        'peak_kib': peak / 1024,
+    }
+
+
+def build_scenarios(app_module, client, rng, first_day, span):
+    def route(method, url_factory, data_factory=None):
+        def run():
+            kwargs = {'data': data_factory()} if data_factory else {}
+            response = client.open(url_factory(), method=method, **kwargs)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{url_factory()} lieferte {response.status_code}")
+            body = response.get_data()
+            match = SERVER_TIMING_QUERIES.search(response.headers.get('Server-Timing', ''))
+            # Gestreamte Antworten (CSV) werden erst beim Lesen erzeugt; ihre Abfragen fehlen im Header
+            return (int(match.group(1)) if match else 0), len(body)
+        return run
+
+    def direct(func):
+        def run():
+            with app_module.app.test_request_context():
+                stats = app_module.get_query_stats()
+                func()
+                return stats.count, 0
+        return run
+
+    def random_day():
+        return first_day + timedelta(days=rng.randrange(span))
+
+    def calendar_window():
+        start = random_day().replace(day=1)
+        return f"/api/bookings?start={start}T00:00:00&end={start + timedelta(days=42)}T00:00:00"
+
+    def month_range():
+        start = random_day().replace(day=1)
+        return {'start_date': str(start), 'end_date': str(start + timedelta(days=30))}
+
+    def pricing_single():
+        arrival = random_day()
+        for _ in range(100):
+            app_module.calculate_price(str(arrival), str(arrival + timedelta(days=3)), [45, 40, 12, 4], 'Ja')
+
+    def pricing_batch():
+        cursor = app_module.get_db().cursor()
+        cursor.execute(f"SELECT {select_list(PRICING_COLUMNS)} FROM bookings ORDER BY arrival LIMIT 1000 OFFSET %s",
+                       (rng.randrange(1000),))
+        bookings = Booking.from_rows(cursor.fetchall(), PRICING_COLUMNS)
+        birthdates = app_module.load_guest_birthdates([b.id for b in bookings])
+        ages = {b.id: app_module.get_guest_ages(b.id, b.birthdate, birthdates[b.id]) for b in bookings}
+        app_module.calculate_prices(bookings, ages)
+
+    def availability():
+        arrival = random_day()
+        app_module.find_free_rooms(str(arrival), str(arrival + timedelta(days=4)), 2)
+
+    return {
+        'index': route('GET', lambda: '/'),
+        'dashboard_page': route('GET', lambda: '/api/dashboard/past'),
+        'api_bookings': route('GET', calendar_window),
+        'search': route('GET', lambda: f"/api/search?q={rng.choice(LAST_NAMES)[:5]}"),
+        'export_csv_month': route('POST', lambda: '/export?format=csv', month_range),
+        'export_xlsx_month': route('POST', lambda: '/export?format=xlsx', month_range),
+        'report_arrivals': route('POST', lambda: '/reports',
+                                 lambda: dict(month_range(), report_type='arrival')),
+        'report_season': route('POST', lambda: '/reports',
+                               lambda: {'report_type': 'season', 'start_date': str(first_day),
+                                        'end_date': str(first_day + timedelta(days=span))}),
+        'calculate_price_x100': direct(pricing_single),
+        'calculate_prices_1000': direct(pricing_batch),
+        'find_free_rooms': direct(availability),
+    }
+
+
+def compare(results, baseline, tolerance):
+    # Regression: p95 deutlich langsamer oder mehr Abfragen als in der Baseline
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        if result['p95_ms'] > reference['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']:.1f} ms statt {reference['p95_ms']:.1f} ms")
+        if result['queries'] > reference['queries']:
+            regressions.append(f"{name}: {result['queries']:g} Abfragen statt {reference['queries']:g}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lastmessung mit synthetischen Buchungen")
+    parser.add_argument('--bookings', type=int, default=10000)
+    parser.add_argument('--max-guests', type=int, default=8)
+    parser.add_argument('--seasons', type=int, default=3, help="Anzahl Jahre mit Buchungen (bis heute)")
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=2025)
+    parser.add_argument('--only', nargs='*', help="Nur diese Szenarien messen")
+    parser.add_argument('--save-baseline', metavar='DATEI')
+    parser.add_argument('--compare', metavar='DATEI')
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Erlaubte Verlangsamung von p95 (0.25 = 25 %%)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    server = None
+    dsn = os.getenv('BENCH_DATABASE_URL')
+    if not dsn:
+        server = EphemeralPostgres()
+        dsn = server.start()
+
+    try:
+        first_day, span = seed(dsn, args.bookings, args.max_guests, args.seasons, rng)
+
+        os.environ['DATABASE_URL'] = dsn
+        os.environ.setdefault('DB_SSLMODE', 'disable' if server else 'prefer')
+        import app as app_module
+
+        client = app_module.app.test_client()
+        with app_module.app.app_context():
+            cursor = app_module.get_db().cursor()
+            cursor.execute("SELECT id, username FROM users WHERE is_admin ORDER BY id LIMIT 1")
+            user_id, username = cursor.fetchone()
+            app_module.rebuild_rollups()
+            app_module.reprice_bookings()
+        with client.session_transaction() as session:
+            session.update(user_id=user_id, user=username, is_admin=True)
+
+        scenarios = build_scenarios(app_module, client, rng, first_day, span)
+        results = {}
+        print(f"{'Szenario':<24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+              f"{'Abfragen':>10}{'KiB':>10}{'Peak KiB':>10}")
+        for name, run in scenarios.items():
+            if args.only and name not in args.only:
+                continue
+            iterations = max(3, args.iterations // 5) if name.startswith('export') else args.iterations
+            result = results[name] = measure(name, run, iterations)
+            print(f"{name:<24}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+                  f"{result['max_ms']:>10.1f}{result['queries']:>10g}{result['bytes'] / 1024:>10.1f}"
+                  f"{result['peak_kib']:>10.0f}")
+
+        if args.save_baseline:
+            with open(args.save_baseline, 'w') as f:
+                json.dump({'bookings': args.bookings, 'results': results}, f, indent=2)
+            print(f"✔️ Baseline gespeichert: {args.save_baseline}")
+
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+            if baseline.get('bookings') != args.bookings:
+                print(f"⚠️ Baseline wurde mit {baseline.get('bookings')} Buchungen erstellt")
+            regressions = compare(results, baseline['results'], args.tolerance)
+            for regression in regressions:
+                print(f"❌ {regression}")
+            if regressions:
+                return 1
+            print("✔️ Keine Regression gegenüber der Baseline")
+        return 0
+    finally:
+        if server:
+            server.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,284 @@
+import io
+import uuid
+
+# Import von Buchungen aus einer Datei im Format des Exports (siehe export_excel): Die Zeilen werden mit pandas
+# spaltenweise geprüft, per COPY in temporäre Tabellen geladen, dort gesammelt gegen Bestand und Zimmerkapazität
+# geprüft und in einer Transaktion übernommen. pandas wird erst beim Import geladen.
+
+# Spalten des Exports und ihre Felder; None = berechnet, wird beim Import ignoriert
+BOOKING_HEADERS = {
+    'Buchungsnummer': 'id', 'Name': 'name', 'Status': 'status', 'Zimmer': 'room', 'Anreise': 'arrival',
+    'Abreise': 'departure', 'Fleisch': 'hp_fleisch', 'Vegan': 'hp_vegi', 'Altersverteilung': None, 'Preis': None,
+    'Notizen': 'notes', 'Bezahlt': 'payment_status', 'Zahlart': 'payment_method', 'Geburtsdatum': 'birthdate',
+    'Personen': 'guests', 'Halbpension': 'hp', 'E-Mail': 'email', 'Telefon': 'phone', 'Adresse': 'address',
+    'PLZ': 'postal_code', 'Ort': 'city', 'Land': 'country',
+}
+GUEST_HEADERS = {'Buchungsnummer': 'booking_id', 'Name': 'name', 'Geburtsdatum': 'birthdate'}
+BOOKING_SHEET = 'Buchungen'
+GUEST_SHEET = 'Gäste'
+REQUIRED_HEADERS = ('Name', 'Zimmer', 'Anreise', 'Abreise')
+
+STATUSES = ('Option', 'Bestätigt', 'Checked In', 'Ausgecheckt', 'Storniert')
+TRUE_VALUES = ('true', 'ja', '1', 'x', 'wahr', 'bezahlt')
+TEXT_FIELDS = ('email', 'phone', 'address', 'postal_code', 'city', 'country', 'notes', 'payment_method')
+
+STAGED_BOOKING_COLUMNS = ('row_number', 'id', 'name', 'birthdate', 'room', 'guests', 'arrival', 'departure', 'hp',
+                          'hp_fleisch', 'hp_vegi', 'email', 'phone', 'status', 'address', 'postal_code', 'city',
+                          'country', 'notes', 'payment_status', 'payment_method')
+STAGED_GUEST_COLUMNS = ('row_number', 'booking_id', 'name', 'birthdate')
+
+
+class ImportFileError(Exception):
+    # Datei nicht lesbar oder Pflichtspalten fehlen
+    pass
+
+
+class ImportRejected(Exception):
+    # Mindestens eine Zeile ist fehlerhaft; die Transaktion wird zurückgerollt
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} fehlerhafte Zeilen")
+        self.errors = errors
+
+
+def read_import_file(stream, filename, guests_stream=None):
+    # Liefert (Buchungen, Gäste) als DataFrames; Excel mit den Blättern "Buchungen" und "Gäste",
+    # CSV wie der CSV-Export (Semikolon, UTF-8) mit optionaler zweiter Datei für die Gäste
+    import pandas as pd
+
+    name = (filename or '').lower()
+    try:
+        if name.endswith(('.xlsx', '.xlsm')):
+            sheets = pd.read_excel(stream, sheet_name=None, dtype=object)
+            bookings = sheets.get(BOOKING_SHEET, next(iter(sheets.values())))
+            guests = sheets.get(GUEST_SHEET)
+        elif name.endswith('.csv'):
+            bookings = read_csv(stream)
+            guests = read_csv(guests_stream) if guests_stream else None
+        else:
+            raise ImportFileError("Nur Excel- (.xlsx) oder CSV-Dateien können importiert werden")
+    except (ValueError, KeyError, UnicodeDecodeError, pd.errors.ParserError) as e:
+        raise ImportFileError(f"Datei konnte nicht gelesen werden: {e}")
+
+    bookings = bookings.rename(columns=lambda column: str(column).strip()).dropna(how='all')
+    missing = [header for header in REQUIRED_HEADERS if header not in bookings.columns]
+    if missing:
+        raise ImportFileError(f"Fehlende Spalten: {', '.join(missing)}")
+    if guests is not None:
+        guests = guests.rename(columns=lambda column: str(column).strip()).dropna(how='all')
+        missing = [header for header in GUEST_HEADERS if header not in guests.columns]
+        if missing:
+            raise ImportFileError(f"Fehlende Spalten im Blatt {GUEST_SHEET}: {', '.join(missing)}")
+    return bookings, guests
+
+
+def read_csv(stream):
+    import pandas as pd
+
+    return pd.read_csv(stream, sep=';', dtype=str, encoding='utf-8-sig', keep_default_na=False,
+                       na_values=[''])
+
+
+def text_column(frame, header):
+    import pandas as pd
+
+    if header not in frame.columns:
+        return pd.Series(pd.NA, index=frame.index, dtype='string')
+    values = frame[header].astype('string').str.strip()
+    return values.mask(values == '')
+
+
+def date_column(values):
+    # ISO-Daten (auch Excel-Datumszellen) oder TT.MM.JJJJ; Ungültiges wird NaT
+    import pandas as pd
+
+    parsed = pd.to_datetime(values, errors='coerce', format='ISO8601')
+    swiss = pd.to_datetime(values.where(parsed.isna()), errors='coerce', format='%d.%m.%Y')
+    return parsed.fillna(swiss).dt.normalize()
+
+
+def number_column(values):
+    import pandas as pd
+
+    # "2.0" aus Excel-Zellen ebenso wie "2" aus CSV
+    return pd.to_numeric(values, errors='coerce')
+
+
+def prepare_import(bookings, guests, rooms):
+    # Prüft alle Zeilen spaltenweise; liefert (Buchungen, Gäste, Fehler) mit den gültigen Zeilen in der
+    # Form der Staging-Tabellen und Fehlern als (Blatt, Zeile, Meldung)
+    import pandas as pd
+
+    errors = []
+
+    def reject(sheet, frame, mask, message):
+        for row in frame.loc[mask, 'row_number']:
+            errors.append((sheet, int(row), message))
+
+    data = pd.DataFrame({'row_number': bookings.index + 2}, index=bookings.index)  # Zeile 1 = Kopfzeile
+    for header, field in BOOKING_HEADERS.items():
+        if field:
+            data[field] = text_column(bookings, header)
+
+    # Buchungsnummer: vorhandene übernehmen (Wiederherstellung aus dem Export), sonst neu vergeben
+    ids = data['id'].str.lower()
+    valid_id = ids.str.fullmatch(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}').fillna(False)
+    reject(BOOKING_SHEET, data, ids.notna() & ~valid_id, "Ungültige Buchungsnummer")
+    missing_id = ids.isna()
+    new_ids = pd.Series([str(uuid.uuid4()) for _ in range(int(missing_id.sum()))], index=ids.index[missing_id],
+                        dtype='string')
+    data['id'] = ids = ids.fillna(new_ids)
+    reject(BOOKING_SHEET, data, valid_id & ids.duplicated(keep=False), "Buchungsnummer mehrfach in der Datei")
+
+    reject(BOOKING_SHEET, data, data['name'].isna(), "Name fehlt")
+    reject(BOOKING_SHEET, data, ~data['room'].isin(list(rooms)), "Unbekanntes Zimmer")
+    data['status'] = data['status'].fillna('Option')
+    reject(BOOKING_SHEET, data, ~data['status'].isin(STATUSES), "Unbekannter Status")
+
+    for field, label in (('arrival', 'Anreise'), ('departure', 'Abreise'), ('birthdate', 'Geburtsdatum')):
+        parsed = date_column(data[field])
+        if field == 'birthdate':
+            reject(BOOKING_SHEET, data, data[field].notna() & parsed.isna(), "Geburtsdatum ungültig")
+        else:
+            reject(BOOKING_SHEET, data, parsed.isna(), f"{label} fehlt oder ist ungültig")
+        data[field] = parsed
+    reject(BOOKING_SHEET, data, data['departure'] <= data['arrival'], "Abreise muss nach der Anreise liegen")
+
+    for field, label in (('hp_fleisch', 'Fleisch'), ('hp_vegi', 'Vegan')):
+        numbers = number_column(data[field])
+        reject(BOOKING_SHEET, data, (data[field].notna() & numbers.isna()) | (numbers < 0),
+               f"{label}: keine gültige Anzahl")
+        data[field] = numbers.fillna(0).clip(lower=0).astype(int)
+    # Ohne Spalte "Halbpension" gilt HP, sobald Menüs bestellt sind
+    has_menus = (data['hp_fleisch'] + data['hp_vegi']) > 0
+    data['hp'] = data['hp'].fillna(has_menus.map({True: 'Ja', False: 'Nein'}))
+    reject(BOOKING_SHEET, data, ~data['hp'].isin(['Ja', 'Nein']), "Halbpension muss Ja oder Nein sein")
+
+    data['payment_status'] = data['payment_status'].str.lower().isin(TRUE_VALUES)
+    for field in TEXT_FIELDS:
+        data[field] = data[field].fillna('')
+
+    guest_data = prepare_guests(guests, data, reject)
+
+    # Personen: ohne Angabe Hauptgast plus Mitreisende
+    companions = guest_data.groupby('booking_id').size()
+    companion_counts = data['id'].map(companions).fillna(0).astype(int)
+    persons = number_column(data['guests'])
+    reject(BOOKING_SHEET, data, (data['guests'].notna() & persons.isna()) | (persons < 1),
+           "Personen: keine gültige Anzahl")
+    data['guests'] = persons.fillna(companion_counts + 1).clip(lower=1).astype(int)
+    reject(BOOKING_SHEET, data, companion_counts > data['guests'] - 1, "Mehr Mitreisende als Personen")
+
+    invalid_rows = {row for sheet, row, _ in errors if sheet == BOOKING_SHEET}
+    valid = data[~data['row_number'].isin(invalid_rows)]
+    guest_data = guest_data[guest_data['booking_id'].isin(valid['id'])]
+    return valid, guest_data, errors
+
+
+def prepare_guests(guests, bookings, reject):
+    import pandas as pd
+
+    if guests is None or guests.empty:
+        return pd.DataFrame({column: pd.Series(dtype=object) for column in STAGED_GUEST_COLUMNS})
+
+    data = pd.DataFrame({'row_number': guests.index + 2}, index=guests.index)
+    for header, field in GUEST_HEADERS.items():
+        data[field] = text_column(guests, header)
+    data['booking_id'] = data['booking_id'].str.lower()
+    reject(GUEST_SHEET, data, ~data['booking_id'].isin(bookings['id']), "Buchungsnummer nicht im Blatt Buchungen")
+    reject(GUEST_SHEET, data, data['name'].isna(), "Name fehlt")
+    birthdates = date_column(data['birthdate'])
+    reject(GUEST_SHEET, data, data['birthdate'].notna() & birthdates.isna(), "Geburtsdatum ungültig")
+    data['birthdate'] = birthdates
+    return data[data['booking_id'].isin(bookings['id']) & data['name'].notna()]
+
+
+def copy_frame(cursor, table, frame, columns):
+    # Schreibt die Spalten als CSV in einen Puffer und lädt sie mit COPY; leere Felder werden NULL
+    buffer = io.StringIO()
+    frame.to_csv(buffer, columns=list(columns), index=False, header=False, date_format='%Y-%m-%d')
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def stage_import(cursor, bookings, guests):
+    # Lädt die geprüften Zeilen in temporäre Tabellen (verschwinden mit dem Ende der Transaktion)
+    cursor.execute("""
+        CREATE TEMP TABLE import_bookings (
+            row_number INTEGER, id UUID PRIMARY KEY, name TEXT, birthdate DATE, room TEXT, guests INTEGER,
+            arrival DATE, departure DATE, hp TEXT, hp_fleisch INTEGER, hp_vegi INTEGER, email TEXT, phone TEXT,
+            status TEXT, address TEXT, postal_code TEXT, city TEXT, country TEXT, notes TEXT,
+            payment_status BOOLEAN, payment_method TEXT
+        ) ON COMMIT DROP
+    """)
+    cursor.execute("""
+        CREATE TEMP TABLE import_guests (
+            row_number INTEGER, booking_id UUID, name TEXT, birthdate DATE
+        ) ON COMMIT DROP
+    """)
+    copy_frame(cursor, 'import_bookings', bookings, STAGED_BOOKING_COLUMNS)
+    copy_frame(cursor, 'import_guests', guests, STAGED_GUEST_COLUMNS)
+    cursor.execute("ANALYZE import_bookings")
+
+
+def check_import(cursor):
+    # Prüfungen gegen den Datenbestand, gesammelt für alle Zeilen; liefert Fehler als (Blatt, Zeile, Meldung)
+    errors = []
+
+    cursor.execute("""
+        SELECT i.row_number FROM import_bookings i JOIN bookings b ON b.id = i.id ORDER BY i.row_number
+    """)
+    errors.extend((BOOKING_SHEET, row, "Buchungsnummer existiert bereits") for row, in cursor.fetchall())
+
+    # Zimmer sperren wie beim einzelnen Anlegen, damit parallele Buchungen die Belegungsprüfung nicht umgehen
+    cursor.execute("""
+        SELECT name FROM rooms WHERE name IN (SELECT DISTINCT room FROM import_bookings) ORDER BY name FOR UPDATE
+    """)
+
+    # Belegung pro Zimmer und Nacht: bestehende Buchungen (room_nights) plus alle Buchungen der Datei
+    cursor.execute("""
+        WITH nights AS (
+            SELECT i.row_number, i.room, night::date AS night, i.guests AS beds
+            FROM import_bookings i, generate_series(i.arrival, i.departure - 1, interval '1 day') AS night
+            WHERE i.status <> 'Storniert'
+        ),
+        imported AS (
+            SELECT room, night, SUM(beds) AS beds FROM nights GROUP BY room, night
+        ),
+        existing AS (
+            SELECT rn.room, rn.night, SUM(rn.beds) AS beds
+            FROM room_nights rn JOIN imported USING (room, night)
+            GROUP BY rn.room, rn.night
+        ),
+        overbooked AS (
+            SELECT imported.room, imported.night, imported.beds + COALESCE(existing.beds, 0) AS beds,
+                   COALESCE(r.capacity, 0) AS capacity
+            FROM imported
+            JOIN rooms r ON r.name = imported.room
+            LEFT JOIN existing USING (room, night)
+            WHERE imported.beds + COALESCE(existing.beds, 0) > COALESCE(r.capacity, 0)
+        )
+        SELECT n.row_number, n.room, MIN(o.night), MAX(o.beds), MIN(o.capacity)
+        FROM nights n JOIN overbooked o USING (room, night)
+        GROUP BY n.row_number, n.room
+        ORDER BY n.row_number
+    """)
+    errors.extend(
+        (BOOKING_SHEET, row, f"{room} ab {night:%d.%m.%Y} überbucht ({beds} Personen, {capacity} Betten)")
+        for row, room, night, beds, capacity in cursor.fetchall())
+    return errors
+
+
+def merge_import(cursor):
+    # Übernimmt die Staging-Tabellen in bookings und guests; liefert die IDs der neuen Buchungen
+    columns = ', '.join(STAGED_BOOKING_COLUMNS[1:])
+    cursor.execute(f"""
+        INSERT INTO bookings ({columns})
+        SELECT {columns} FROM import_bookings ORDER BY row_number
+        RETURNING id
+    """)
+    booking_ids = [row[0] for row in cursor.fetchall()]
+    cursor.execute("""
+        INSERT INTO guests (booking_id, name, birthdate)
+        SELECT booking_id, name, birthdate FROM import_guests ORDER BY row_number
+    """)
+    return booking_ids, cursor.rowcount
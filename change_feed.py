@@ -0,0 +1,143 @@
+import json
+import os
+import queue
+import select
+import threading
+import time
+from collections import deque
+
+import psycopg2
+import psycopg2.extensions
+
+
+class ClientQueue(queue.Queue):
+    # Warteschlange eines SSE-Clients; closed wird gesetzt, wenn der Feed den Client wegen Überlaufs verwirft
+    closed = False
+
+
+class ChangeFeed:
+    # Hört pro Worker-Prozess mit einer eigenen Verbindung auf einen NOTIFY-Kanal und verteilt die daraus
+    # erzeugten Ereignisse an alle verbundenen SSE-Clients. build_events(ids) wandelt die gemeldeten IDs
+    # in Ereignisse um; sind es mehr als max_batch auf einmal (z.B. Import), wird nur "reset" gesendet.
+
+    def __init__(self, connect, channel, build_events, max_batch=50, history=200, client_queue_size=100):
+        self.connect = connect
+        self.channel = channel
+        self.build_events = build_events
+        self.max_batch = max_batch
+        self.client_queue_size = client_queue_size
+        self._subscribers = set()
+        self._history = deque(maxlen=history)  # (Sequenznummer, Ereignis) für Wiederverbindungen
+        self._sequence = 0
+        self._unobserved_reset = False  # letzter Eintrag ist ein "reset", den noch kein Client gesehen hat
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def event_id(self, sequence):
+        # Die Nummer gilt nur in diesem Prozess; die PID erkennt Wiederverbindungen zu einem anderen Worker
+        return f"{os.getpid()}-{sequence}"
+
+    def subscribe(self, last_event_id=None):
+        # Liefert die Warteschlange des Clients; verpasste Ereignisse werden nachgeliefert, falls möglich
+        client = ClientQueue(self.client_queue_size)
+        with self._lock:
+            self._subscribers.add(client)
+            self._unobserved_reset = False
+            if last_event_id:
+                for item in self._replay(last_event_id):
+                    client.put_nowait(item)
+        self.start()
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._subscribers.discard(client)
+
+    def _replay(self, last_event_id):
+        pid, _, sequence = last_event_id.partition('-')
+        try:
+            pid, sequence = int(pid), int(sequence)
+        except ValueError:
+            return [(None, 'reset', {})]
+        if pid != os.getpid() or (self._history and sequence < self._history[0][0] - 1) \
+                or sequence > self._sequence:
+            return [(None, 'reset', {})]
+        return [(self.event_id(seq), name, data) for seq, name, data in self._history if seq > sequence]
+
+    def publish(self, name, data):
+        with self._lock:
+            self._sequence += 1
+            item = (self.event_id(self._sequence), name, data)
+            self._history.append((self._sequence, name, data))
+            self._unobserved_reset = name == 'reset' and not self._subscribers
+            for client in list(self._subscribers):
+                try:
+                    client.put_nowait(item)
+                except queue.Full:
+                    # Zu langsamer Client: verwerfen. Die Antwort endet, sobald er die Warteschlange geleert hat;
+                    # der Browser verbindet sich mit Last-Event-ID neu und erhält den Rest oder "reset"
+                    self._subscribers.discard(client)
+                    client.closed = True
+
+    def _run(self):
+        backoff = 1
+        while not self._stopped.is_set():
+            conn = None
+            try:
+                conn = self.connect()
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel};")
+                if backoff > 1:
+                    # Während der Unterbrechung können Änderungen verloren gegangen sein
+                    self.publish('reset', {})
+                backoff = 1
+                while not self._stopped.is_set():
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    # dict statt Liste: bei Massenänderungen (z.B. Preise neu berechnen) kommen Tausende Meldungen
+                    ids = dict.fromkeys(notify.payload for notify in conn.notifies)
+                    conn.notifies.clear()
+                    if ids:
+                        self._dispatch(list(ids))
+            except Exception as e:
+                print(f"Änderungsfeed unterbrochen: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+
+    def _dispatch(self, ids):
+        if not self._subscribers:
+            # Ohne Clients werden keine Ereignisse aufgebaut, die Lücke wird aber vermerkt:
+            # wer sich mit Last-Event-ID neu verbindet, erhält "reset"
+            if not self._unobserved_reset:
+                self.publish('reset', {})
+            return
+        if len(ids) > self.max_batch:
+            self.publish('reset', {})
+            return
+        for data in self.build_events(ids):
+            self.publish('booking', data)
+
+
+def format_event(item):
+    event_id, name, data = item
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {name}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
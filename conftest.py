@@ -0,0 +1,4 @@
+import os
+
+# app.py verlangt beim Import eine DATABASE_URL; die Unit-Tests bauen keine Verbindung auf
+os.environ.setdefault('DATABASE_URL', 'postgresql://localhost/alphuette_test')
@@ -0,0 +1,280 @@
+import heapq
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+
+class QueryStats:
+    # Sammelt Anzahl, Gesamtdauer und die langsamsten Abfragen einer Anfrage; Abfragen über
+    # slow_threshold Sekunden werden zusätzlich an logger gemeldet
+    def __init__(self, slow_threshold=None, logger=None, keep=5):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = []  # Min-Heap von (Dauer, Nummer, Abfrage)
+        self.slow_threshold = slow_threshold
+        self.logger = logger
+        self.keep = keep
+
+    def record(self, query, duration):
+        self.count += 1
+        self.total += duration
+        if isinstance(query, bytes):
+            query = query.decode('utf-8', 'replace')
+        query = ' '.join(query.split())[:1000]
+        entry = (duration, self.count, query)
+        if len(self.slowest) < self.keep:
+            heapq.heappush(self.slowest, entry)
+        else:
+            heapq.heappushpop(self.slowest, entry)
+        if self.logger is not None and self.slow_threshold is not None and duration >= self.slow_threshold:
+            self.logger.warning("Langsame Abfrage (%.1f ms): %s", duration * 1000, query)
+
+    def top(self):
+        return [(duration, query) for duration, _, query in sorted(self.slowest, reverse=True)]
+
+
+_timed_cursor_classes = {}
+
+
+def timed_cursor_class(base):
+    # Unterklasse der gewünschten Cursor-Klasse (z.B. DictCursor), die jede Abfrage an die Verbindung meldet
+    cls = _timed_cursor_classes.get(base)
+    if cls is None:
+        class TimedCursor(base):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    self.connection.record_query(query, time.perf_counter() - started)
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    self.connection.record_query(query, time.perf_counter() - started)
+
+        TimedCursor.__name__ = 'Timed' + base.__name__
+        cls = _timed_cursor_classes[base] = TimedCursor
+    return cls
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    # Verbindung, deren Cursor Abfragen messen; gezählt wird nur, solange query_stats gesetzt ist
+    query_stats = None
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = timed_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+    def record_query(self, query, duration):
+        if self.query_stats is not None:
+            self.query_stats.record(query, duration)
+
+
+class ConnectionPool:
+    # Verbindungspool pro Worker-Prozess: Verbindungen werden beim Ausleihen geprüft,
+    # nach max_uses Ausleihen oder idle_timeout Sekunden Leerlauf ersetzt und bei
+    # Rückgabe in einer offenen/fehlerhaften Transaktion zurückgerollt.
+
+    def __init__(self, dsn, minconn=1, maxconn=5, max_uses=1000, idle_timeout=300.0,
+                 health_check_after=30.0, checkout_timeout=10.0, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Ungültige Poolgrösse: minconn=%s, maxconn=%s" % (minconn, maxconn))
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_uses = max_uses
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.checkout_timeout = checkout_timeout
+        self.connect_kwargs = connect_kwargs
+
+        self._idle = []  # Liste von (Verbindung, Zeitpunkt der Rückgabe)
+        self._uses = {}  # id(Verbindung) -> Anzahl Ausleihen
+        self._in_use = set()
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self.closed = False
+
+        self.metrics = {
+            'checkouts': 0,
+            'waits': 0,
+            'exhausted': 0,
+            'created': 0,
+            'closed': 0,
+            'recycled': 0,
+            'health_check_failures': 0,
+            'rollbacks': 0,
+            'peak_in_use': 0,
+            'wait_time_total': 0.0,
+        }
+
+        self._connecting = 0  # Plätze für Verbindungen, die gerade ausserhalb des Locks aufgebaut werden
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self.metrics['created'] += 1
+
+    def _connect(self):
+        # Netzwerkzugriff: wird nie unter self._lock aufgerufen
+        return psycopg2.connect(self.dsn, **self.connect_kwargs)
+
+    def _discard(self, conn):
+        self._uses.pop(id(conn), None)
+        self.metrics['closed'] += 1
+        try:
+            if not conn.closed:
+                conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_healthy(self, conn, idle_since):
+        # Netzwerkzugriff (SELECT 1): wird nie unter self._lock aufgerufen
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        # Nur Verbindungen, die länger ungenutzt waren, werden aktiv angepingt
+        if time.monotonic() - idle_since < self.health_check_after:
+            return True
+        try:
+            old_autocommit = conn.autocommit
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.autocommit = old_autocommit
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _total(self):
+        return len(self._idle) + len(self._in_use) + self._connecting
+
+    def getconn(self):
+        while True:
+            conn, idle_since = self._reserve()
+            if conn is None:
+                # Reservierter Platz für eine neue Verbindung; der Aufbau läuft ohne Lock
+                try:
+                    conn = self._connect()
+                except BaseException:
+                    with self._available:
+                        self._connecting -= 1
+                        self._available.notify()
+                    raise
+                with self._available:
+                    self._connecting -= 1
+                    self.metrics['created'] += 1
+                    return self._checkout(conn)
+
+            # Die Verbindung zählt bereits als ausgeliehen; geprüft wird ohne Lock
+            if time.monotonic() - idle_since > self.idle_timeout:
+                self._release(conn, 'recycled')
+                continue
+            if not self._is_healthy(conn, idle_since):
+                self._release(conn, 'health_check_failures')
+                continue
+            with self._available:
+                return self._checkout(conn)
+
+    def _reserve(self):
+        # Liefert (Verbindung, Rückgabezeitpunkt) einer freien Verbindung oder (None, None) für einen
+        # freien Platz; wartet höchstens checkout_timeout Sekunden
+        deadline = time.monotonic() + self.checkout_timeout
+        waited = False
+        with self._available:
+            while True:
+                if self.closed:
+                    raise PoolError("Verbindungspool ist geschlossen")
+
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    self._in_use.add(conn)
+                    return conn, idle_since
+
+                if self._total() < self.maxconn:
+                    self._connecting += 1
+                    return None, None
+
+                if not waited:
+                    self.metrics['waits'] += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.metrics['exhausted'] += 1
+                    raise PoolError("Verbindungspool erschöpft (%s Verbindungen in Benutzung)" % len(self._in_use))
+                started = time.monotonic()
+                self._available.wait(remaining)
+                self.metrics['wait_time_total'] += time.monotonic() - started
+
+    def _release(self, conn, reason):
+        # Verwirft eine reservierte Verbindung, die die Prüfung nicht bestanden hat, und gibt ihren Platz frei
+        with self._available:
+            self._in_use.discard(conn)
+            self.metrics[reason] += 1
+            self._discard(conn)
+            self._available.notify()
+
+    def _checkout(self, conn):
+        self._in_use.add(conn)
+        self._uses[id(conn)] = self._uses.get(id(conn), 0) + 1
+        self.metrics['checkouts'] += 1
+        self.metrics['peak_in_use'] = max(self.metrics['peak_in_use'], len(self._in_use))
+        return conn
+
+    def putconn(self, conn, discard=False):
+        with self._lock:
+            if conn not in self._in_use:
+                raise PoolError("Verbindung gehört nicht zu diesem Pool")
+
+        rolled_back = False
+        if not discard and not conn.closed:
+            # Abgebrochene oder offene Transaktionen zurücksetzen, bevor die Verbindung wiederverwendet wird;
+            # die Verbindung bleibt dabei ausgeliehen, der Rollback läuft ohne Lock
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                    rolled_back = True
+                except psycopg2.Error:
+                    discard = True
+
+        with self._available:
+            self._in_use.discard(conn)
+            if rolled_back:
+                self.metrics['rollbacks'] += 1
+
+            if discard or conn.closed or self.closed:
+                self._discard(conn)
+            elif self.max_uses and self._uses.get(id(conn), 0) >= self.max_uses:
+                self.metrics['recycled'] += 1
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+
+            self._available.notify()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats.update({
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'size': self._total(),
+                'minconn': self.minconn,
+                'maxconn': self.maxconn,
+            })
+        return stats
+
+    def closeall(self):
+        with self._available:
+            self.closed = True
+            for conn, _ in self._idle:
+                self._discard(conn)
+            self._idle = []
+            self._available.notify_all()
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+
+class ExportJobs:
+    # Erstellt Exportdateien im Hintergrund und legt sie in einem Verzeichnis ab, das alle Worker-Prozesse
+    # teilen. Der Zustand eines Auftrags steht nur im Dateisystem, damit jeder Worker Status und Download
+    # beantworten kann:
+    #   <id>.running  Auftrag läuft (enthält die Parameter)
+    #   <id>.result   fertige Datei, <id>.json die zugehörigen Angaben
+    #   <id>.error    Fehlermeldung
+    # Die Dateien enthalten Gästedaten: Verzeichnis und Dateien sind nur für den eigenen Benutzer lesbar.
+    # Die ID ist ein Hash der Parameter. Enthalten diese den Änderungsstand der Buchungen, laufen gleiche
+    # Anfragen nur einmal und das Ergebnis gilt, bis sich die Buchungen ändern.
+
+    def __init__(self, directory, build, workers=2, max_age=3600, stale_after=120):
+        self.directory = directory
+        self.build = build  # build(params, path) schreibt die Datei
+        self.max_age = max_age
+        # Ein laufender Auftrag erneuert den Zeitstempel von <id>.running regelmässig; bleibt dieser länger
+        # stehen, ist der Worker beendet worden und der Auftrag gilt als abgebrochen
+        self.stale_after = stale_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export')
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        os.chmod(directory, 0o700)  # falls das Verzeichnis schon bestand
+
+    @staticmethod
+    def job_id(params):
+        key = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+    def _path(self, job_id, suffix):
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            raise ValueError(f"Ungültige Auftrags-ID: {job_id}")
+        return os.path.join(self.directory, f"{job_id}.{suffix}")
+
+    @staticmethod
+    def _open_private(path, flags=os.O_TRUNC):
+        return os.fdopen(os.open(path, os.O_CREAT | os.O_WRONLY | flags, 0o600), 'w')
+
+    def submit(self, params):
+        job_id = self.job_id(params)
+        self.prune()
+        if os.path.exists(self._path(job_id, 'json')):
+            return job_id
+
+        running = self._path(job_id, 'running')
+        if os.path.exists(running) and time.time() - os.path.getmtime(running) > self.stale_after:
+            self._remove(running)
+        try:
+            # O_EXCL: läuft derselbe Auftrag schon (auch in einem anderen Worker), wird er nicht erneut gestartet
+            f = self._open_private(running, os.O_EXCL)
+        except FileExistsError:
+            return job_id
+        with f:
+            json.dump(params, f, default=str)
+        self._remove(self._path(job_id, 'error'))
+        self._executor.submit(self._run, job_id, params)
+        return job_id
+
+    def _heartbeat(self, running, done):
+        while not done.wait(self.stale_after / 4):
+            try:
+                os.utime(running)
+            except FileNotFoundError:
+                return
+
+    def _run(self, job_id, params):
+        started = time.time()
+        part = self._path(job_id, 'part')
+        done = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(self._path(job_id, 'running'), done),
+                         name=f'export-heartbeat-{job_id[:8]}', daemon=True).start()
+        try:
+            # Leere Datei mit privaten Rechten anlegen; build überschreibt sie und behält die Rechte
+            self._open_private(part).close()
+            self.build(params, part)
+            os.replace(part, self._path(job_id, 'result'))
+            info = dict(params, size=os.path.getsize(self._path(job_id, 'result')),
+                        duration=round(time.time() - started, 3), finished_at=time.time())
+            with self._open_private(self._path(job_id, 'json') + '.tmp') as f:
+                json.dump(info, f, default=str)
+            os.replace(self._path(job_id, 'json') + '.tmp', self._path(job_id, 'json'))
+        except Exception as e:
+            print(f"Export {job_id} fehlgeschlagen: {e}")
+            self._remove(part)
+            with self._open_private(self._path(job_id, 'error')) as f:
+                f.write(str(e))
+        finally:
+            done.set()
+            self._remove(self._path(job_id, 'running'))
+
+    def status(self, job_id):
+        # Liefert (Zustand, Angaben); Zustand ist done, running, failed oder unknown
+        info_path = self._path(job_id, 'json')
+        if os.path.exists(info_path):
+            with open(info_path) as f:
+                return 'done', json.load(f)
+        running = self._path(job_id, 'running')
+        if os.path.exists(running):
+            if time.time() - os.path.getmtime(running) > self.stale_after:
+                return 'failed', {'error': 'Zeitüberschreitung'}
+            return 'running', {}
+        error_path = self._path(job_id, 'error')
+        if os.path.exists(error_path):
+            with open(error_path) as f:
+                return 'failed', {'error': f.read()}
+        return 'unknown', {}
+
+    def result_path(self, job_id):
+        return self._path(job_id, 'result')
+
+    def prune(self):
+        # Alte Ergebnisse (und Reste abgebrochener Aufträge) löschen
+        cutoff = time.time() - self.max_age
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime < cutoff and not entry.name.endswith('.running'):
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
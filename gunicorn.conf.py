@@ -0,0 +1,28 @@
+import os
+import shutil
+
+# Gunicorn-Konfiguration: Prometheus-Metriken im Multiprozess-Modus
+# Start: PROMETHEUS_MULTIPROC_DIR=/tmp/alphuette-metrics gunicorn app:app
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+# Threads statt synchroner Worker: offene Verbindungen des Änderungsfeeds (/api/changes) belegen sonst
+# jeweils einen ganzen Worker
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 16))
+
+
+def on_starting(server):
+    # Werte eines früheren Laufs verwerfen, sonst zählen Zähler alter Prozesse weiter mit
+    path = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # Live-Gauges (z.B. Verbindungen im Pool) eines beendeten Workers nicht mehr mitzählen
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -2,177 +2,568 @@ import os
 
 import psycopg2
 from flask.cli import load_dotenv
+from werkzeug.security import generate_password_hash
 
 load_dotenv()
 
-# Verbindung zur PostgreSQL-Datenbank herstellen
-conn = psycopg2.connect(
-    dbname=os.getenv("DB_NAME"),  # Datenbankname aus der Umgebungsvariable
-    user=os.getenv("DB_USER"),  # Datenbankbenutzername aus der Umgebungsvariable
-    password=os.getenv("DB_PASSWORD"),  # Datenbankpasswort aus der Umgebungsvariable
-    host=os.getenv("DB_HOST"),  # Datenbankhost aus der Umgebungsvariable
-    port=os.getenv("DB_PORT")  # Datenbankport aus der Umgebungsvariable
-)
-
-cursor = conn.cursor()
-
-# Benutzer-Tabelle
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    id SERIAL PRIMARY KEY,
-    username TEXT UNIQUE NOT NULL,
-    password TEXT NOT NULL,
-    is_admin BOOLEAN DEFAULT FALSE
-);
-""")
-
-# Admin-Benutzer erstellen
-password = "demo"  # Das Passwort im Klartext
-cursor.execute("""
-INSERT INTO users (username, password, is_admin) 
-VALUES (%s, %s)
-ON CONFLICT (username) DO NOTHING;
-""", ("timo.reinschmidt", password, True))
-
-# Zimmer-Tabelle
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS rooms (
-    id SERIAL PRIMARY KEY,
-    name TEXT UNIQUE NOT NULL,
-    type TEXT,
-    capacity INTEGER
-);
-""")
-
-# Einfügen der Zimmerdaten
-cursor.executemany("""
-INSERT INTO rooms (name, type, capacity)
-VALUES (%s, %s, %s)
-ON CONFLICT (name) DO NOTHING;
-""", [
-    ("Doppelzimmer", "Doppelzimmer", 2),
-    ("4er-Zimmer 1", "Viererzimmer", 4),
-    ("4er-Zimmer 2", "Viererzimmer", 4),
-    ("6er-Zimmer 1", "Sechserzimmer", 6),
-    ("6er-Zimmer 2", "Sechserzimmer", 6)
-])
-
-# Buchungen-Tabelle mit UUID als Primärschlüssel
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS bookings (
-    id UUID PRIMARY KEY,
-    name TEXT,
-    birthdate TEXT,
-    room TEXT,
-    guests INTEGER,
-    arrival DATE,
-    departure DATE,
-    hp TEXT DEFAULT 'Nein',
-    hp_fleisch INTEGER DEFAULT 0,
-    hp_vegi INTEGER DEFAULT 0,
-    email TEXT,
-    phone TEXT,
-    status TEXT DEFAULT 'Option',
-    address TEXT,
-    postal_code TEXT,
-    city TEXT,
-    country TEXT,
-    notes TEXT,
-    payment_status BOOLEAN DEFAULT FALSE,
-    payment_method TEXT
-);
-""")
-
-# Gäste-Tabelle
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS guests (
-    id SERIAL PRIMARY KEY,
-    booking_id UUID,
-    name TEXT,
-    birthdate TEXT,
-    FOREIGN KEY(booking_id) REFERENCES bookings(id)
-);
-""")
-
-# Buchungsverlauf-Tabelle
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS booking_history (
-    id SERIAL PRIMARY KEY,
-    booking_id UUID,
-    status TEXT,
-    changed_at TIMESTAMP,
-    changed_by INTEGER,
-    FOREIGN KEY(booking_id) REFERENCES bookings(id),
-    FOREIGN KEY(changed_by) REFERENCES users(id)
-);
-""")
-
-# Preisstruktur-Tabelle
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS prices (
-    id SERIAL PRIMARY KEY,
-    category TEXT UNIQUE NOT NULL,
-    age_min REAL,
-    age_max REAL,
-    weekend_price REAL,
-    weekday_price REAL
-);
-""")
-
-# Stadtsteuer-Tabelle
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS city_tax (
-    id SERIAL PRIMARY KEY,
-    age_min REAL,
-    age_max REAL,
-    tax REAL,
-    CONSTRAINT unique_age_range UNIQUE (age_min, age_max)
-);
-""")
-
-# Abendessen-Preis-Tabelle
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS dinner_prices (
-    id SERIAL PRIMARY KEY,
-    age_max REAL UNIQUE,
-    price REAL
-);
-""")
-
-cursor.executemany("""
-INSERT INTO dinner_prices (age_max, price)
-VALUES (%s, %s)
-ON CONFLICT (age_max) DO NOTHING;
-""", [
-    (11.99, 20.0),
-    (200.0, 35.0)
-])
-
-# Einfügen der Preisdaten
-cursor.executemany("""
-INSERT INTO prices (category, age_min, age_max, weekend_price, weekday_price)
-VALUES (%s, %s, %s, %s, %s)
-ON CONFLICT (category) DO NOTHING;
-""", [
-    ("adult", 16.0, 200.0, 90.0, 70.0),
-    ("child_12_15", 12.0, 15.99, 70.0, 50.0),
-    ("child_6_11", 6.0, 11.99, 45.0, 35.0),
-    ("child_0_5", 0.0, 5.99, 0.0, 0.0)
-])
-
-cursor.executemany("""
-INSERT INTO city_tax (age_min, age_max, tax)
-VALUES (%s, %s, %s)
-ON CONFLICT (age_min, age_max) DO NOTHING;
-""", [
-    (16.0, 200.0, 4.0),
-    (6.0, 15.99, 1.5)
-])
-
-# Änderungen in der Datenbank speichern
-conn.commit()
-
-# Verbindung schließen
-conn.close()
-
-print("✔️ Neue PostgreSQL-Datenbank erstellt – mit UUIDs, Preisen und Zimmern.")
+# Migrationen als (Version, Beschreibung, Funktion); jede läuft genau einmal, in Versionsreihenfolge
+# und in einer eigenen Transaktion. Bereits angewendete Versionen stehen in schema_migrations.
+MIGRATIONS = []
+
+# Schlüssel für pg_advisory_lock, damit nie zwei Migrationsläufe gleichzeitig arbeiten
+MIGRATION_LOCK_ID = 7201
+
+
+def migration(version, description):
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+
+    return register
+
+
+def connect():
+    # Verbindung zur PostgreSQL-Datenbank herstellen
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME"),  # Datenbankname aus der Umgebungsvariable
+        user=os.getenv("DB_USER"),  # Datenbankbenutzername aus der Umgebungsvariable
+        password=os.getenv("DB_PASSWORD"),  # Datenbankpasswort aus der Umgebungsvariable
+        host=os.getenv("DB_HOST"),  # Datenbankhost aus der Umgebungsvariable
+        port=os.getenv("DB_PORT")  # Datenbankport aus der Umgebungsvariable
+    )
+
+
+def column_type(cursor, table, column):
+    cursor.execute("""
+    SELECT data_type FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s;
+    """, (table, column))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+@migration(1, "Grundschema: Benutzer, Zimmer, Buchungen, Gäste, Verlauf und Preise")
+def create_base_schema(cursor):
+    # Benutzer-Tabelle
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        is_admin BOOLEAN DEFAULT FALSE
+    );
+    """)
+
+    # Admin-Benutzer erstellen
+    password = generate_password_hash("demo")  # Der Login prüft mit check_password_hash
+    cursor.execute("""
+    INSERT INTO users (username, password, is_admin) 
+    VALUES (%s, %s, %s)
+    ON CONFLICT (username) DO NOTHING;
+    """, ("timo.reinschmidt", password, True))
+
+    # Zimmer-Tabelle
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS rooms (
+        id SERIAL PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL,
+        type TEXT,
+        capacity INTEGER
+    );
+    """)
+
+    # Einfügen der Zimmerdaten
+    cursor.executemany("""
+    INSERT INTO rooms (name, type, capacity)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (name) DO NOTHING;
+    """, [
+        ("Doppelzimmer", "Doppelzimmer", 2),
+        ("4er-Zimmer 1", "Viererzimmer", 4),
+        ("4er-Zimmer 2", "Viererzimmer", 4),
+        ("6er-Zimmer 1", "Sechserzimmer", 6),
+        ("6er-Zimmer 2", "Sechserzimmer", 6)
+    ])
+
+    # Buchungen-Tabelle mit UUID als Primärschlüssel
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS bookings (
+        id UUID PRIMARY KEY,
+        name TEXT,
+        birthdate TEXT,
+        room TEXT,
+        guests INTEGER,
+        arrival DATE,
+        departure DATE,
+        hp TEXT DEFAULT 'Nein',
+        hp_fleisch INTEGER DEFAULT 0,
+        hp_vegi INTEGER DEFAULT 0,
+        email TEXT,
+        phone TEXT,
+        status TEXT DEFAULT 'Option',
+        address TEXT,
+        postal_code TEXT,
+        city TEXT,
+        country TEXT,
+        notes TEXT,
+        payment_status BOOLEAN DEFAULT FALSE,
+        payment_method TEXT
+    );
+    """)
+
+    # Gäste-Tabelle
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS guests (
+        id SERIAL PRIMARY KEY,
+        booking_id UUID,
+        name TEXT,
+        birthdate TEXT,
+        FOREIGN KEY(booking_id) REFERENCES bookings(id)
+    );
+    """)
+
+    # Buchungsverlauf-Tabelle
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS booking_history (
+        id SERIAL PRIMARY KEY,
+        booking_id UUID,
+        status TEXT,
+        changed_at TIMESTAMP,
+        changed_by INTEGER,
+        FOREIGN KEY(booking_id) REFERENCES bookings(id),
+        FOREIGN KEY(changed_by) REFERENCES users(id)
+    );
+    """)
+
+    # Preisstruktur-Tabelle
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS prices (
+        id SERIAL PRIMARY KEY,
+        category TEXT UNIQUE NOT NULL,
+        age_min REAL,
+        age_max REAL,
+        weekend_price REAL,
+        weekday_price REAL
+    );
+    """)
+
+    # Stadtsteuer-Tabelle
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS city_tax (
+        id SERIAL PRIMARY KEY,
+        age_min REAL,
+        age_max REAL,
+        tax REAL,
+        CONSTRAINT unique_age_range UNIQUE (age_min, age_max)
+    );
+    """)
+
+    # Abendessen-Preis-Tabelle
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS dinner_prices (
+        id SERIAL PRIMARY KEY,
+        age_max REAL UNIQUE,
+        price REAL
+    );
+    """)
+
+    cursor.executemany("""
+    INSERT INTO dinner_prices (age_max, price)
+    VALUES (%s, %s)
+    ON CONFLICT (age_max) DO NOTHING;
+    """, [
+        (11.99, 20.0),
+        (200.0, 35.0)
+    ])
+
+    # Einfügen der Preisdaten
+    cursor.executemany("""
+    INSERT INTO prices (category, age_min, age_max, weekend_price, weekday_price)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (category) DO NOTHING;
+    """, [
+        ("adult", 16.0, 200.0, 90.0, 70.0),
+        ("child_12_15", 12.0, 15.99, 70.0, 50.0),
+        ("child_6_11", 6.0, 11.99, 45.0, 35.0),
+        ("child_0_5", 0.0, 5.99, 0.0, 0.0)
+    ])
+
+    cursor.executemany("""
+    INSERT INTO city_tax (age_min, age_max, tax)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (age_min, age_max) DO NOTHING;
+    """, [
+        (16.0, 200.0, 4.0),
+        (6.0, 15.99, 1.5)
+    ])
+
+
+@migration(2, "Änderungszähler für Buchungen")
+def create_change_counters(cursor):
+    # Änderungszähler für Buchungen: erlaubt ETag/304 in /api/bookings, ohne die Buchungen zu lesen
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS change_counters (
+        name TEXT PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0,
+        changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """)
+
+    cursor.execute("""
+    INSERT INTO change_counters (name) VALUES ('bookings')
+    ON CONFLICT (name) DO NOTHING;
+    """)
+
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION bump_change_counter() RETURNS trigger AS $$
+    BEGIN
+        UPDATE change_counters SET version = version + 1, changed_at = now() WHERE name = TG_ARGV[0];
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+
+    for table in ('bookings', 'guests'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {table}_change_counter ON {table};")
+        cursor.execute(f"""
+        CREATE TRIGGER {table}_change_counter
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_change_counter('bookings');
+        """)
+
+
+@migration(3, "Belegung pro Nacht und Zimmer (room_nights)")
+def create_room_nights(cursor):
+    # Belegung pro Nacht und Zimmer; wird per Trigger bei jeder Buchungsänderung nachgeführt
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS room_nights (
+        booking_id UUID NOT NULL REFERENCES bookings(id) ON DELETE CASCADE,
+        room TEXT NOT NULL,
+        night DATE NOT NULL,
+        beds INTEGER NOT NULL,
+        PRIMARY KEY (booking_id, night)
+    );
+    """)
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS room_nights_room_night_idx ON room_nights (room, night);")
+
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION sync_room_nights() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' THEN
+            DELETE FROM room_nights WHERE booking_id = OLD.id;
+        END IF;
+        IF COALESCE(NEW.status, '') <> 'Storniert' AND NEW.room IS NOT NULL
+           AND NEW.arrival IS NOT NULL AND NEW.departure > NEW.arrival THEN
+            INSERT INTO room_nights (booking_id, room, night, beds)
+            SELECT NEW.id, NEW.room, night::date, COALESCE(NEW.guests, 0)
+            FROM generate_series(NEW.arrival, NEW.departure - 1, interval '1 day') AS night;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+
+    # Gelöschte Buchungen verschwinden über ON DELETE CASCADE aus room_nights
+    cursor.execute("DROP TRIGGER IF EXISTS bookings_room_nights ON bookings;")
+    cursor.execute("""
+    CREATE TRIGGER bookings_room_nights
+    AFTER INSERT OR UPDATE OF room, arrival, departure, guests, status ON bookings
+    FOR EACH ROW EXECUTE FUNCTION sync_room_nights();
+    """)
+
+    # Bestehende Buchungen einmalig übernehmen
+    cursor.execute("""
+    INSERT INTO room_nights (booking_id, room, night, beds)
+    SELECT b.id, b.room, night::date, COALESCE(b.guests, 0)
+    FROM bookings b, generate_series(b.arrival, b.departure - 1, interval '1 day') AS night
+    WHERE COALESCE(b.status, '') <> 'Storniert' AND b.room IS NOT NULL AND b.departure > b.arrival
+    ON CONFLICT (booking_id, night) DO NOTHING;
+    """)
+
+
+@migration(4, "Geburtsdaten als DATE statt TEXT")
+def convert_birthdates(cursor):
+    # Ungültige Texte werden zu NULL statt die Migration abzubrechen
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION try_parse_date(value TEXT) RETURNS DATE AS $$
+    BEGIN
+        RETURN NULLIF(btrim(value), '')::date;
+    EXCEPTION WHEN others THEN
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql IMMUTABLE;
+    """)
+
+    for table in ('bookings', 'guests'):
+        if column_type(cursor, table, 'birthdate') == 'text':
+            cursor.execute(f"""
+            ALTER TABLE {table} ALTER COLUMN birthdate TYPE DATE USING try_parse_date(birthdate);
+            """)
+
+    cursor.execute("DROP FUNCTION try_parse_date(TEXT);")
+
+
+@migration(5, "Indizes für die Abfragen der Routen")
+def create_indexes(cursor):
+    # Gäste und Verlauf werden immer pro Buchung gelesen
+    cursor.execute("CREATE INDEX IF NOT EXISTS guests_booking_id_idx ON guests (booking_id);")
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS booking_history_booking_id_idx ON booking_history (booking_id, changed_at DESC);
+    """)
+
+    # Dashboard (Keyset-Pagination über arrival, id), Export und Berichte
+    cursor.execute("CREATE INDEX IF NOT EXISTS bookings_arrival_id_idx ON bookings (arrival, id);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS bookings_departure_idx ON bookings (departure);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS bookings_status_arrival_id_idx ON bookings (status, arrival, id);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS bookings_room_idx ON bookings (room);")
+
+
+@migration(6, "Aufenthalt als daterange-Spalte mit GiST-Index")
+def create_stay_range(cursor):
+    # btree_gist erlaubt (room, stay) in einem GiST-Index bzw. einer späteren Exclusion-Constraint
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS btree_gist;")
+    cursor.execute("""
+    ALTER TABLE bookings ADD COLUMN IF NOT EXISTS stay DATERANGE
+    GENERATED ALWAYS AS (
+        CASE WHEN departure >= arrival THEN daterange(arrival, departure, '[)') END
+    ) STORED;
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS bookings_room_stay_idx ON bookings USING gist (room, stay);")
+
+
+@migration(7, "Volltextsuche über Buchungen und Gäste (pg_trgm)")
+def create_booking_search(cursor):
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+
+    # Ein Suchdokument pro Buchung: Buchungsnummer, Name, E-Mail, Telefon, Ort und Namen der Mitreisenden
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS booking_search (
+        booking_id UUID PRIMARY KEY REFERENCES bookings(id) ON DELETE CASCADE,
+        document TEXT NOT NULL
+    );
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS booking_search_document_trgm_idx ON booking_search USING gin (document gin_trgm_ops);
+    """)
+
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION refresh_booking_search(target UUID) RETURNS void AS $$
+        INSERT INTO booking_search (booking_id, document)
+        SELECT b.id, lower(concat_ws(' ', b.id::text, b.name, b.email, b.phone, b.city,
+                                     (SELECT string_agg(g.name, ' ') FROM guests g WHERE g.booking_id = b.id)))
+        FROM bookings b
+        WHERE b.id = target
+        ON CONFLICT (booking_id) DO UPDATE SET document = EXCLUDED.document;
+    $$ LANGUAGE sql;
+    """)
+
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION sync_booking_search() RETURNS trigger AS $$
+    BEGIN
+        IF TG_TABLE_NAME = 'bookings' THEN
+            PERFORM refresh_booking_search(NEW.id);
+        ELSE
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM refresh_booking_search(OLD.booking_id);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM refresh_booking_search(NEW.booking_id);
+            END IF;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+
+    cursor.execute("DROP TRIGGER IF EXISTS bookings_search ON bookings;")
+    cursor.execute("""
+    CREATE TRIGGER bookings_search
+    AFTER INSERT OR UPDATE OF name, email, phone, city ON bookings
+    FOR EACH ROW EXECUTE FUNCTION sync_booking_search();
+    """)
+    cursor.execute("DROP TRIGGER IF EXISTS guests_search ON guests;")
+    cursor.execute("""
+    CREATE TRIGGER guests_search
+    AFTER INSERT OR UPDATE OR DELETE ON guests
+    FOR EACH ROW EXECUTE FUNCTION sync_booking_search();
+    """)
+
+    # Bestehende Buchungen einmalig indexieren
+    cursor.execute("SELECT refresh_booking_search(id) FROM bookings;")
+
+
+@migration(8, "Änderungszähler für Benutzer")
+def create_users_change_counter(cursor):
+    # Sitzungen speichern die Identität; Umbenennungen, Rechteänderungen und Löschungen zählen diesen Stand hoch
+    cursor.execute("""
+    INSERT INTO change_counters (name) VALUES ('users')
+    ON CONFLICT (name) DO NOTHING;
+    """)
+    cursor.execute("DROP TRIGGER IF EXISTS users_change_counter ON users;")
+    cursor.execute("""
+    CREATE TRIGGER users_change_counter
+    AFTER UPDATE OR DELETE ON users
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_change_counter('users');
+    """)
+
+
+@migration(9, "Tägliche Belegungs- und Umsatzzahlen pro Zimmer (daily_rollup)")
+def create_daily_rollup(cursor):
+    # Wird von der App bei jeder Buchungsänderung nachgeführt; "flask rebuild-rollups" baut sie neu auf
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS daily_rollup (
+        day DATE NOT NULL,
+        room TEXT NOT NULL,
+        beds INTEGER NOT NULL DEFAULT 0,
+        adults INTEGER NOT NULL DEFAULT 0,
+        children INTEGER NOT NULL DEFAULT 0,
+        babies INTEGER NOT NULL DEFAULT 0,
+        hp_covers INTEGER NOT NULL DEFAULT 0,
+        revenue NUMERIC(12, 2) NOT NULL DEFAULT 0,
+        kurtaxe NUMERIC(12, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, room)
+    );
+    """)
+
+
+@migration(10, "Versionsspalte für Buchungen (optimistisches Sperren)")
+def add_booking_version(cursor):
+    # Jede Änderung an einer Buchung zählt die Version hoch; das Bearbeitungsformular schickt die gelesene
+    # Version mit, damit gleichzeitige Änderungen nicht stillschweigend überschrieben werden
+    cursor.execute("ALTER TABLE bookings ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;")
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION bump_booking_version() RETURNS trigger AS $$
+    BEGIN
+        NEW.version := OLD.version + 1;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    cursor.execute("DROP TRIGGER IF EXISTS bookings_version ON bookings;")
+    cursor.execute("""
+    CREATE TRIGGER bookings_version
+    BEFORE UPDATE ON bookings
+    FOR EACH ROW EXECUTE FUNCTION bump_booking_version();
+    """)
+
+
+@migration(11, "NOTIFY bei Änderungen an Buchungen und Gästen (Änderungsfeed)")
+def create_booking_notify(cursor):
+    # Meldet die ID jeder geänderten Buchung auf dem Kanal booking_changes; PostgreSQL stellt die
+    # Meldungen erst beim Commit zu und fasst gleiche Meldungen einer Transaktion zusammen
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION notify_booking_change() RETURNS trigger AS $$
+    DECLARE
+        changed RECORD;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            changed := OLD;
+        ELSE
+            changed := NEW;
+        END IF;
+        IF TG_TABLE_NAME = 'guests' THEN
+            PERFORM pg_notify('booking_changes', changed.booking_id::text);
+        ELSE
+            PERFORM pg_notify('booking_changes', changed.id::text);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    for table in ('bookings', 'guests'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {table}_notify ON {table};")
+        cursor.execute(f"""
+        CREATE TRIGGER {table}_notify
+        AFTER INSERT OR UPDATE OR DELETE ON {table}
+        FOR EACH ROW EXECUTE FUNCTION notify_booking_change();
+        """)
+
+
+@migration(12, "Gespeicherter Preis pro Buchung (Übernachtung, Kurtaxe, Halbpension, Total)")
+def add_price_snapshot(cursor):
+    # Die App schreibt den Preis beim Anlegen und Bearbeiten; nach Tarifänderungen rechnet
+    # "flask reprice-bookings" alle Buchungen neu. Bestehende Buchungen bleiben bis dahin leer.
+    for column, definition in (('price_lodging', 'NUMERIC(10, 2)'), ('price_kurtaxe', 'NUMERIC(10, 2)'),
+                               ('price_hp', 'NUMERIC(10, 2)'), ('total_price', 'NUMERIC(10, 2)'),
+                               ('tariff_version', 'TEXT'), ('priced_at', 'TIMESTAMPTZ')):
+        cursor.execute(f"ALTER TABLE bookings ADD COLUMN IF NOT EXISTS {column} {definition};")
+    # Ein neu berechneter Preis ist keine Änderung an der Buchung selbst: die Version bleibt, damit offene
+    # Bearbeitungsformulare nach einer Tarifänderung nicht als veraltet gelten
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION bump_booking_version() RETURNS trigger AS $$
+    DECLARE
+        -- stay ist generiert und in NEW vor dem Schreiben noch leer; es folgt aus arrival/departure
+        ignored CONSTANT TEXT[] := ARRAY['price_lodging', 'price_kurtaxe', 'price_hp', 'total_price',
+                                         'tariff_version', 'priced_at', 'stay'];
+    BEGIN
+        IF to_jsonb(NEW) - ignored = to_jsonb(OLD) - ignored THEN
+            RETURN NEW;
+        END IF;
+        NEW.version := OLD.version + 1;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+
+
+@migration(13, "Änderungszähler für den Tarif")
+def create_tariff_change_counter(cursor):
+    # Jeder Worker hält den Tarif im Speicher und lädt ihn neu, sobald dieser Stand steigt
+    cursor.execute("""
+    INSERT INTO change_counters (name) VALUES ('tariff')
+    ON CONFLICT (name) DO NOTHING;
+    """)
+    for table in ('prices', 'city_tax', 'dinner_prices'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {table}_change_counter ON {table};")
+        cursor.execute(f"""
+        CREATE TRIGGER {table}_change_counter
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_change_counter('tariff');
+        """)
+
+
+def migrate(conn):
+    cursor = conn.cursor()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    """)
+    cursor.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_ID,))
+    conn.commit()
+
+    try:
+        cursor.execute("SELECT version FROM schema_migrations;")
+        applied = {row[0] for row in cursor.fetchall()}
+
+        for version, description, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if version in applied:
+                continue
+            try:
+                func(cursor)
+                cursor.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s);",
+                               (version, description))
+                # Änderungen in der Datenbank speichern
+                conn.commit()
+            except psycopg2.Error:
+                conn.rollback()
+                print(f"❌ Migration {version} fehlgeschlagen: {description}")
+                raise
+            print(f"✔️ Migration {version} angewendet: {description}")
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_ID,))
+        conn.commit()
+
+
+if __name__ == '__main__':
+    conn = connect()
+    try:
+        migrate(conn)
+    finally:
+        # Verbindung schließen
+        conn.close()
+
+    print("✔️ PostgreSQL-Datenbank ist auf dem neuesten Stand.")
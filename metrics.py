@@ -0,0 +1,75 @@
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, \
+    generate_latest, multiprocess
+
+# Unter gunicorn schreibt jeder Worker seine Werte in PROMETHEUS_MULTIPROC_DIR; /metrics fasst die
+# Dateien aller Worker zusammen (siehe gunicorn.conf.py)
+
+REQUESTS = Counter('alphuette_http_requests_total', 'Anfragen pro Route',
+                   ['endpoint', 'method', 'status'])
+REQUEST_DURATION = Histogram('alphuette_http_request_duration_seconds', 'Antwortzeit pro Route',
+                             ['endpoint', 'method'],
+                             buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+REQUEST_QUERIES = Histogram('alphuette_http_request_queries', 'Datenbankabfragen pro Anfrage',
+                            ['endpoint'], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100))
+REQUEST_DB_DURATION = Histogram('alphuette_http_request_db_seconds', 'Datenbankzeit pro Anfrage',
+                                ['endpoint'], buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+
+DB_POOL_CONNECTIONS = Gauge('alphuette_db_pool_connections', 'Verbindungen im Pool nach Zustand',
+                            ['state'], multiprocess_mode='livesum')
+DB_POOL_EVENTS = Counter('alphuette_db_pool_events_total',
+                         'Ereignisse im Verbindungspool (Ausleihen, Wartezeiten, Neuaufbau, ...)', ['event'])
+DB_POOL_WAIT = Counter('alphuette_db_pool_wait_seconds_total', 'Wartezeit auf eine freie Verbindung')
+
+EXPORT_DURATION = Histogram('alphuette_export_duration_seconds', 'Dauer eines Exports', ['format'],
+                            buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+EXPORT_SIZE = Histogram('alphuette_export_size_bytes', 'Grösse einer Exportdatei', ['format'],
+                        buckets=(10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000, 20_000_000))
+EXPORT_ROWS = Counter('alphuette_export_rows_total', 'Exportierte Buchungen', ['format'])
+
+IMPORT_DURATION = Histogram('alphuette_import_duration_seconds', 'Dauer eines Imports',
+                            buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+IMPORT_ROWS = Counter('alphuette_import_rows_total', 'Importierte und abgelehnte Buchungszeilen', ['result'])
+
+CACHE_REQUESTS = Counter('alphuette_cache_requests_total', 'Cache-Zugriffe nach Ergebnis', ['cache', 'result'])
+
+PRICING_DURATION = Histogram('alphuette_pricing_duration_seconds', 'Dauer der Preisberechnung', ['mode'],
+                             buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5))
+PRICING_BOOKINGS = Counter('alphuette_pricing_bookings_total', 'Berechnete Buchungspreise', ['mode'])
+
+# Zähler aus ConnectionPool.metrics, die als Differenz seit der letzten Meldung weitergegeben werden
+POOL_EVENT_KEYS = ('checkouts', 'waits', 'exhausted', 'created', 'closed', 'recycled',
+                   'health_check_failures', 'rollbacks')
+
+_pool_seen = {'pool': None, 'values': {}}
+
+
+def observe_pool(pool):
+    # Die Pool-Zähler sind pro Prozess kumuliert; weitergemeldet wird nur der Zuwachs, damit sich die
+    # Werte aller Worker korrekt aufsummieren
+    stats = pool.stats()
+    if _pool_seen['pool'] is not pool:
+        _pool_seen['pool'] = pool
+        _pool_seen['values'] = {}
+    seen = _pool_seen['values']
+    for key in POOL_EVENT_KEYS:
+        delta = stats[key] - seen.get(key, 0)
+        if delta > 0:
+            DB_POOL_EVENTS.labels(key).inc(delta)
+        seen[key] = stats[key]
+    wait_delta = stats['wait_time_total'] - seen.get('wait_time_total', 0.0)
+    if wait_delta > 0:
+        DB_POOL_WAIT.inc(wait_delta)
+    seen['wait_time_total'] = stats['wait_time_total']
+    DB_POOL_CONNECTIONS.labels('in_use').set(stats['in_use'])
+    DB_POOL_CONNECTIONS.labels('idle').set(stats['idle'])
+
+
+def render():
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,64 @@
+class Booking:
+    # Eine Buchung mit fester Spaltenliste; __slots__ statt dict spart pro Zeile Speicher und Allokationen.
+    # Spalten, die eine Abfrage nicht liest, bleiben None.
+    COLUMNS = ('id', 'name', 'birthdate', 'room', 'guests', 'arrival', 'departure', 'hp', 'hp_fleisch', 'hp_vegi',
+               'email', 'phone', 'status', 'address', 'postal_code', 'city', 'country', 'notes', 'payment_status',
+               'payment_method', 'version', 'price_lodging', 'price_kurtaxe', 'price_hp', 'total_price',
+               'tariff_version', 'priced_at')
+    # Von der App ergänzt (Altersverteilung, siehe enrich_bookings)
+    DERIVED = ('age_group',)
+
+    __slots__ = COLUMNS + DERIVED
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+
+    @classmethod
+    def from_row(cls, row, columns=COLUMNS):
+        return cls(**dict(zip(columns, row)))
+
+    @classmethod
+    def from_rows(cls, rows, columns=COLUMNS):
+        return [cls.from_row(row, columns) for row in rows]
+
+    @property
+    def booking_number(self):
+        return str(self.id)[:8]
+
+    def __repr__(self):
+        return f"<Booking {self.id} {self.name!r} {self.arrival}–{self.departure}>"
+
+
+class Guest:
+    COLUMNS = ('id', 'booking_id', 'name', 'birthdate')
+
+    __slots__ = COLUMNS
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+
+    @classmethod
+    def from_row(cls, row, columns=COLUMNS):
+        return cls(**dict(zip(columns, row)))
+
+    def __repr__(self):
+        return f"<Guest {self.id} {self.name!r}>"
+
+
+# Spaltenauswahl je Verwendungszweck; Abfragen lesen nur, was sie brauchen
+CARD_COLUMNS = ('id', 'name', 'birthdate', 'room', 'guests', 'arrival', 'departure', 'hp', 'hp_fleisch', 'hp_vegi',
+                'email', 'phone', 'status', 'payment_status', 'version', 'total_price', 'tariff_version')
+CALENDAR_COLUMNS = ('id', 'name', 'room', 'guests', 'arrival', 'departure', 'status', 'version')
+PRICING_COLUMNS = ('id', 'birthdate', 'room', 'guests', 'arrival', 'departure', 'hp', 'hp_fleisch', 'hp_vegi',
+                   'status')
+EXPORT_FIELDS = ('id', 'name', 'birthdate', 'room', 'guests', 'arrival', 'departure', 'hp', 'hp_fleisch',
+                 'hp_vegi', 'status', 'notes', 'payment_status', 'payment_method', 'total_price', 'tariff_version',
+                 'email', 'phone', 'address', 'postal_code', 'city', 'country')
+
+
+def select_list(columns, alias=None):
+    # "b.id, b.name, ..." für SELECT; die Reihenfolge entspricht columns und damit from_row
+    prefix = f"{alias}." if alias else ''
+    return ', '.join(prefix + column for column in columns)
@@ -0,0 +1,127 @@
+import bisect
+import hashlib
+from collections import namedtuple
+
+# Freitag- und Samstagnächte werden zum Wochenendtarif berechnet (0 = Montag)
+WEEKEND_DAYS = (4, 5)
+
+# Eine Altersstufe aus der Tabelle "prices" mit zugehöriger Kurtaxe und HP-Preis
+PriceBand = namedtuple('PriceBand', 'category age_min age_max weekend_price weekday_price city_tax dinner_price')
+
+
+def count_weekday(start_weekday, nights, weekday):
+    # Anzahl Nächte in [0, nights), die ab start_weekday auf 'weekday' fallen – ohne über die Tage zu iterieren
+    offset = (weekday - start_weekday) % 7
+    return max(0, (nights - offset + 6) // 7)
+
+
+def count_nights(arrival, departure):
+    # Liefert (Wochenendnächte, Wochennächte) in O(1)
+    nights = (departure - arrival).days
+    if nights <= 0:
+        return 0, 0
+    start = arrival.weekday()
+    weekend = sum(count_weekday(start, nights, day) for day in WEEKEND_DAYS)
+    return weekend, nights - weekend
+
+
+class Tariff:
+    def __init__(self, bands):
+        self.bands = sorted(bands, key=lambda band: band.age_min)
+        self._age_mins = [band.age_min for band in self.bands]
+        self.version = hashlib.sha1(repr(self.bands).encode()).hexdigest()[:12]
+        self._vectors = None
+
+    def vectors(self):
+        # Preisvektoren pro Altersstufe für die Batch-Berechnung; NumPy wird erst hier geladen,
+        # damit der Import der App schnell bleibt
+        if self._vectors is None:
+            import numpy as np
+
+            self._vectors = tuple(
+                np.array([getattr(band, field) for band in self.bands], dtype=float)
+                for field in ('weekend_price', 'weekday_price', 'city_tax', 'dinner_price')
+            )
+        return self._vectors
+
+    def band_index(self, age):
+        # Letzte Stufe, deren Mindestalter erreicht ist; jüngere Gäste fallen in die erste Stufe
+        return max(0, bisect.bisect_right(self._age_mins, age) - 1)
+
+    def band_counts(self, ages):
+        counts = [0] * len(self.bands)
+        if not self.bands:
+            return counts
+        for age in ages:
+            counts[self.band_index(age)] += 1
+        return counts
+
+    def price_components(self, arrival, departure, counts, hp):
+        # Liefert (Übernachtung, Kurtaxe, Halbpension) für eine Buchung
+        weekend, weekday = count_nights(arrival, departure)
+        nights = weekend + weekday
+        lodging = kurtaxe = half_board = 0.0
+        for band, count in zip(self.bands, counts):
+            lodging += count * (weekend * band.weekend_price + weekday * band.weekday_price)
+            kurtaxe += count * nights * band.city_tax
+            if hp == 'Ja':
+                half_board += count * nights * band.dinner_price
+        return lodging, kurtaxe, half_board
+
+    def night_rates(self, counts, hp):
+        # Beträge pro Nacht: (Übernachtung am Wochenende, Übernachtung unter der Woche, Kurtaxe, Halbpension)
+        weekend = sum(c * band.weekend_price for band, c in zip(self.bands, counts))
+        weekday = sum(c * band.weekday_price for band, c in zip(self.bands, counts))
+        kurtaxe = sum(c * band.city_tax for band, c in zip(self.bands, counts))
+        half_board = sum(c * band.dinner_price for band, c in zip(self.bands, counts)) if hp == 'Ja' else 0.0
+        return weekend, weekday, kurtaxe, half_board
+
+    def price(self, arrival, departure, counts, hp):
+        return round(sum(self.price_components(arrival, departure, counts, hp)), 2)
+
+    def price_components_batch(self, arrivals, departures, counts, hp):
+        # Vektorisierte Variante von price_components für viele Buchungen:
+        # arrivals/departures als datetime64[D], counts als Matrix (Buchungen x Altersstufen), hp als bool
+        import numpy as np
+
+        weekend_prices, weekday_prices, city_taxes, dinner_prices = self.vectors()
+        arrivals = np.asarray(arrivals, dtype='datetime64[D]')
+        departures = np.asarray(departures, dtype='datetime64[D]')
+        counts = np.asarray(counts, dtype=float).reshape(len(arrivals), len(self.bands))
+        hp = np.asarray(hp, dtype=bool)
+
+        nights = np.maximum((departures - arrivals).astype(np.int64), 0)
+        start = (arrivals.astype(np.int64) + 3) % 7  # 1970-01-01 war ein Donnerstag
+        weekend = np.zeros_like(nights)
+        for day in WEEKEND_DAYS:
+            offset = (day - start) % 7
+            weekend += np.maximum(0, (nights - offset + 6) // 7)
+        weekday = nights - weekend
+
+        lodging = weekend * (counts @ weekend_prices) + weekday * (counts @ weekday_prices)
+        kurtaxe = nights * (counts @ city_taxes)
+        half_board = np.where(hp, nights * (counts @ dinner_prices), 0.0)
+        return lodging, kurtaxe, half_board
+
+    def price_batch(self, arrivals, departures, counts, hp):
+        lodging, kurtaxe, half_board = self.price_components_batch(arrivals, departures, counts, hp)
+        return (lodging + kurtaxe + half_board).round(2)
+
+
+def load_tariff(cursor):
+    # Baut den Tarif aus den Tabellen prices, city_tax und dinner_prices auf
+    cursor.execute("SELECT category, age_min, age_max, weekend_price, weekday_price FROM prices ORDER BY age_min")
+    prices = cursor.fetchall()
+    cursor.execute("SELECT age_min, age_max, tax FROM city_tax ORDER BY age_min")
+    city_tax = cursor.fetchall()
+    cursor.execute("SELECT age_max, price FROM dinner_prices ORDER BY age_max")
+    dinner_prices = cursor.fetchall()
+
+    bands = []
+    for category, age_min, age_max, weekend_price, weekday_price in prices:
+        tax = next((t for t_min, t_max, t in city_tax if t_min <= age_min <= t_max), 0.0)
+        dinner = next((p for d_max, p in dinner_prices if age_min <= d_max), 0.0)
+        bands.append(PriceBand(category, age_min, age_max, weekend_price or 0.0, weekday_price or 0.0,
+                               tax or 0.0, dinner or 0.0))
+    return Tariff(bands)
+
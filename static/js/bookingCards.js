@@ -0,0 +1,15 @@
+// Details der Buchungskarten ein-/ausblenden; ein Listener für alle Karten, auch für nachgeladene
+document.addEventListener("click", function (event) {
+    const button = event.target.closest(".toggle-details-btn");
+    if (!button) {
+        return;
+    }
+    const details = button.closest(".booking-card").querySelector(".details");
+    if (details.style.display === "none") {
+        details.style.display = "block";
+        button.textContent = "Details verbergen";
+    } else {
+        details.style.display = "none";
+        button.textContent = "Details anzeigen";
+    }
+});
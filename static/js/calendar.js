@@ -30,4 +30,20 @@ document.addEventListener("DOMContentLoaded", function () {
 
     // Rendern des Kalenders
     calendar.render();
+
+    // Änderungen anderer Benutzer live übernehmen (siehe /api/changes), statt den Kalender neu zu laden
+    if ("EventSource" in window) {
+        const source = new EventSource('/api/changes');
+        source.addEventListener('booking', function (e) {
+            const change = JSON.parse(e.data);
+            calendar.getEvents().filter(event => event.id === change.id).forEach(event => event.remove());
+            if (change.event) {
+                // Der Quelle zuordnen, damit der Eintrag beim nächsten Nachladen nicht doppelt erscheint
+                calendar.addEvent(change.event, calendar.getEventSources()[0]);
+            }
+        });
+        source.addEventListener('reset', function () {
+            calendar.refetchEvents();
+        });
+    }
 });
\ No newline at end of file
@@ -0,0 +1,69 @@
+document.addEventListener("DOMContentLoaded", function () {
+    // Änderungen aus dem Änderungsfeed (/api/changes) direkt in die Listen übernehmen, statt neu zu laden
+    const container = document.getElementById("dashboard-lists");
+    if (!container || !("EventSource" in window)) {
+        return;
+    }
+    const stale = document.getElementById("dashboard-stale");
+
+    function removeCard(id) {
+        container.querySelectorAll(`.booking-card[data-booking-id="${CSS.escape(id)}"]`)
+            .forEach(card => card.remove());
+    }
+
+    function sortKey(card) {
+        return `${card.dataset.arrival}_${card.dataset.bookingId}`;
+    }
+
+    function insertCard(list, card) {
+        // Gleiche Sortierung wie auf dem Server: (Anreise, ID), je nach Liste auf- oder absteigend
+        const descending = list.dataset.order === "DESC";
+        const key = sortKey(card);
+        const cards = Array.from(list.querySelectorAll(":scope > .booking-card"));
+        const before = cards.find(other => descending ? sortKey(other) < key : sortKey(other) > key);
+        if (before) {
+            list.insertBefore(card, before);
+        } else if (!list.dataset.next) {
+            // Hinter der letzten Karte nur, wenn die Liste vollständig geladen ist; sonst kommt sie beim Nachladen
+            list.insertBefore(card, list.querySelector(".load-more"));
+        }
+    }
+
+    function refreshCard(id) {
+        fetch(`/api/dashboard/card/${encodeURIComponent(id)}`, {credentials: "same-origin"})
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => {
+                removeCard(id);
+                const list = data.bucket && container.querySelector(`.booking-list[data-bucket="${data.bucket}"]`);
+                if (!list) {
+                    return;
+                }
+                const template = document.createElement("template");
+                template.innerHTML = data.html.trim();
+                const card = template.content.querySelector(".booking-card");
+                if (card) {
+                    insertCard(list, card);
+                }
+            })
+            .catch(error => console.error("Fehler beim Aktualisieren der Reservation:", error));
+    }
+
+    const source = new EventSource("/api/changes");
+    source.addEventListener("booking", event => {
+        const change = JSON.parse(event.data);
+        if (change.deleted) {
+            removeCard(change.id);
+        } else {
+            refreshCard(change.id);
+        }
+    });
+    // Zu viele oder verpasste Änderungen: nicht alles einzeln nachladen, sondern zum Neuladen auffordern
+    source.addEventListener("reset", () => {
+        stale.style.display = "block";
+    });
+});
@@ -0,0 +1,57 @@
+document.addEventListener("DOMContentLoaded", function () {
+    // Vergangene, stornierte und anstehende Reservationen werden seitenweise nachgeladen
+    const lists = document.querySelectorAll(".booking-list[data-bucket]");
+
+    function loadMore(list) {
+        const loadMoreEl = list.querySelector(".load-more");
+        const next = list.dataset.next;
+        if (!next || list.dataset.loading === "true") {
+            return;
+        }
+        list.dataset.loading = "true";
+
+        const url = `/api/dashboard/${encodeURIComponent(list.dataset.bucket)}?after=${encodeURIComponent(next)}`;
+        fetch(url, {credentials: "same-origin"})
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => {
+                loadMoreEl.insertAdjacentHTML("beforebegin", data.html);
+                list.dataset.next = data.next || "";
+                if (!data.next) {
+                    loadMoreEl.remove();
+                } else if (observer) {
+                    // Neu beobachten, damit weitergeladen wird, falls das Listenende noch sichtbar ist
+                    observer.unobserve(loadMoreEl);
+                    observer.observe(loadMoreEl);
+                }
+            })
+            .catch(error => console.error("Fehler beim Nachladen der Reservationen:", error))
+            .finally(() => {
+                list.dataset.loading = "false";
+            });
+    }
+
+    // Nachladen, sobald das Ende einer Liste sichtbar wird; der Button dient als Fallback
+    const observer = "IntersectionObserver" in window ? new IntersectionObserver(entries => {
+        entries.forEach(entry => {
+            if (entry.isIntersecting) {
+                loadMore(entry.target.closest(".booking-list"));
+            }
+        });
+    }, {rootMargin: "200px"}) : null;
+
+    lists.forEach(list => {
+        const loadMoreEl = list.querySelector(".load-more");
+        if (!loadMoreEl) {
+            return;
+        }
+        loadMoreEl.querySelector("button").addEventListener("click", () => loadMore(list));
+        if (observer) {
+            observer.observe(loadMoreEl);
+        }
+    });
+});
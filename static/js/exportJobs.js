@@ -0,0 +1,80 @@
+document.addEventListener("DOMContentLoaded", function () {
+    // Exporte als Hintergrundauftrag starten, den Status abfragen und die fertige Datei herunterladen.
+    // Ohne JavaScript bleiben Formular und Link beim direkten Export über /export.
+    const form = document.getElementById("exportForm");
+    const allLink = document.getElementById("exportAll");
+    const statusEl = document.getElementById("exportStatus");
+    if (!form || !statusEl || !("fetch" in window)) {
+        return;
+    }
+    const POLL_INTERVAL = 1000;
+    let running = false;
+
+    function showStatus(text, cssClass) {
+        statusEl.className = `w3-panel ${cssClass}`;
+        statusEl.textContent = text;
+        statusEl.style.display = "block";
+    }
+
+    function handle(job) {
+        if (job.state === "done") {
+            running = false;
+            showStatus("Export bereit, der Download startet.", "w3-pale-green");
+            window.location.href = job.download_url;
+        } else if (job.state === "failed" || job.state === "unknown") {
+            running = false;
+            showStatus(`Export fehlgeschlagen${job.error ? ": " + job.error : ""}`, "w3-pale-red");
+        } else {
+            showStatus("Export wird erstellt …", "w3-pale-yellow");
+            setTimeout(() => poll(job.status_url), POLL_INTERVAL);
+        }
+    }
+
+    function request(url, options) {
+        return fetch(url, Object.assign({credentials: "same-origin"}, options))
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                return response.json();
+            });
+    }
+
+    function poll(url) {
+        request(url)
+            .then(handle)
+            .catch(error => {
+                running = false;
+                showStatus(`Export fehlgeschlagen: ${error.message}`, "w3-pale-red");
+            });
+    }
+
+    function start(data) {
+        if (running) {
+            return;
+        }
+        running = true;
+        showStatus("Export wird erstellt …", "w3-pale-yellow");
+        request("/export/jobs", {method: "POST", body: data})
+            .then(handle)
+            .catch(error => {
+                running = false;
+                showStatus(`Export fehlgeschlagen: ${error.message}`, "w3-pale-red");
+            });
+    }
+
+    form.addEventListener("submit", function (event) {
+        event.preventDefault();
+        closeExportModal();
+        start(new FormData(form));
+    });
+
+    if (allLink) {
+        allLink.addEventListener("click", function (event) {
+            event.preventDefault();
+            const data = new FormData();
+            data.append("format", "xlsx");
+            start(data);
+        });
+    }
+});
@@ -1,19 +1,74 @@
 document.addEventListener("DOMContentLoaded", function () {
     // Sucheingabefeld
     const searchInput = document.getElementById("searchInput");
+    const resultList = document.getElementById("result-list");
+    const resultCards = document.getElementById("result-cards");
+    const resultMore = document.getElementById("result-more");
+    const dashboardLists = document.getElementById("dashboard-lists");
 
-    // Suche durchführen, wenn der Benutzer etwas eintippt
-    searchInput.addEventListener("input", function () {
-        const searchTerm = searchInput.value.toLowerCase();  // Kleinbuchstaben für Fallunempfindlichkeit
-        const bookingCards = document.querySelectorAll(".booking-card");  // Alle Buchungskarten
+    const MIN_LENGTH = 2;
+    const DEBOUNCE_MS = 250;
+
+    let debounceTimer = null;
+    let controller = null;
+    let nextOffset = null;
+
+    function showDashboard() {
+        resultList.style.display = "none";
+        dashboardLists.style.display = "";
+        resultCards.innerHTML = "";
+    }
+
+    // Suche auf dem Server; ältere, noch laufende Anfragen werden abgebrochen
+    function search(term, offset) {
+        if (controller) {
+            controller.abort();
+        }
+        controller = new AbortController();
 
-        bookingCards.forEach(card => {
-            const cardText = card.textContent.toLowerCase();  // Textinhalt der Buchungskarten
-            if (cardText.includes(searchTerm)) {
-                card.style.display = "";  // Anzeigen der Buchungskarte, wenn der Text übereinstimmt
-            } else {
-                card.style.display = "none";  // Ausblenden der Buchungskarte, wenn der Text nicht übereinstimmt
+        const url = `/api/search?q=${encodeURIComponent(term)}&offset=${offset}`;
+        fetch(url, {credentials: "same-origin", signal: controller.signal})
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => {
+                if (offset === 0) {
+                    resultCards.innerHTML = data.html || "<p>Keine Buchungen gefunden.</p>";
+                } else {
+                    resultCards.insertAdjacentHTML("beforeend", data.html);
+                }
+                nextOffset = data.next;
+                resultMore.style.display = nextOffset ? "" : "none";
+                resultList.style.display = "";
+                dashboardLists.style.display = "none";
+            })
+            .catch(error => {
+                if (error.name !== "AbortError") {
+                    console.error("Fehler bei der Suche:", error);
+                }
+            });
+    }
+
+    // Suche durchführen, wenn der Benutzer eine kurze Pause beim Tippen macht
+    searchInput.addEventListener("input", function () {
+        clearTimeout(debounceTimer);
+        const searchTerm = searchInput.value.trim();
+        if (searchTerm.length < MIN_LENGTH) {
+            if (controller) {
+                controller.abort();
             }
-        });
+            showDashboard();
+            return;
+        }
+        debounceTimer = setTimeout(() => search(searchTerm, 0), DEBOUNCE_MS);
+    });
+
+    resultMore.querySelector("button").addEventListener("click", function () {
+        if (nextOffset) {
+            search(searchInput.value.trim(), nextOffset);
+        }
     });
-});
\ No newline at end of file
+});
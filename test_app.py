@@ -0,0 +1,71 @@
+from datetime import date
+
+import pytest
+
+import app
+from models import Booking
+from pricing import PriceBand, Tariff
+
+BOOKING_ID = '0b7c3f6e-2d7a-4b8e-9a51-6f3c2e1d0a99'
+TARIFF = Tariff([
+    PriceBand('child_0_5', 0, 5, 0.0, 0.0, 0.0, 0.0),
+    PriceBand('adult', 16, 200, 110.0, 100.0, 4.0, 35.0),
+])
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2026-10-18', date(2026, 10, 18)),
+    (date(2026, 10, 18), date(2026, 10, 18)),
+    (None, None),
+    ('', None),
+    ('Ja', None),
+    ('18.10.2026', None),
+])
+def test_safe_parse_date(value, expected):
+    assert app.safe_parse_date(value) == expected
+
+
+def test_dashboard_cursor_round_trip():
+    booking = Booking(id=BOOKING_ID, arrival=date(2026, 10, 18))
+    assert app.decode_dashboard_cursor(app.encode_dashboard_cursor(booking)) == (date(2026, 10, 18), BOOKING_ID)
+
+
+@pytest.mark.parametrize('value', ['', 'garbage', '2026-10-18', f'2026-13-01_{BOOKING_ID}', '2026-10-18_1234'])
+def test_invalid_dashboard_cursor(value):
+    assert app.decode_dashboard_cursor(value) is None
+
+
+def stay(**values):
+    values = dict({'id': BOOKING_ID, 'room': 'Doppelzimmer', 'guests': 2, 'status': 'Option', 'hp': 'Nein',
+                   'arrival': date(2026, 10, 16), 'departure': date(2026, 10, 18)}, **values)
+    return Booking(**values)
+
+
+def test_booking_rollup_per_night():
+    rollup = app.booking_rollup(stay(), [40, 3], TARIFF)
+    assert rollup == {
+        (date(2026, 10, 16), 'Doppelzimmer'): [2, 1, 0, 1, 0, 110.0, 4.0],
+        (date(2026, 10, 17), 'Doppelzimmer'): [2, 1, 0, 1, 0, 110.0, 4.0],
+    }
+
+
+@pytest.mark.parametrize('values', [{'arrival': None}, {'departure': None}, {'status': 'Storniert'}, {'room': None}])
+def test_booking_rollup_without_contribution(values):
+    assert app.booking_rollup(stay(**values), [40], TARIFF) == {}
+
+
+def test_price_snapshot_skips_bookings_without_dates():
+    legacy = stay(id='ffffffff-ffff-4fff-8fff-ffffffffffff', arrival=None)
+    rows = app.price_snapshot_rows([legacy, stay()], {legacy.id: [40], BOOKING_ID: [40]}, TARIFF)
+    assert rows == [(BOOKING_ID, 220.0, 8.0, 0.0, 228.0, TARIFF.version)]
+
+
+def test_rollup_delta():
+    day = (date(2026, 10, 16), 'Doppelzimmer')
+    other = (date(2026, 10, 17), 'Doppelzimmer')
+    before = {day: [2, 2, 0, 0, 0, 200.0, 8.0]}
+    after = {other: [2, 2, 0, 0, 0, 220.0, 8.0]}
+    assert app.rollup_delta(before, after) == {
+        day: [-2, -2, 0, 0, 0, -200.0, -8.0],
+        other: [2, 2, 0, 0, 0, 220.0, 8.0],
+    }
@@ -0,0 +1,100 @@
+import io
+
+import pandas as pd
+import pytest
+
+from booking_import import BOOKING_SHEET, GUEST_SHEET, ImportFileError, prepare_import, read_import_file
+
+ROOMS = {'Doppelzimmer': 2, '4er-Zimmer 1': 4}
+BOOKING_ID = '0b7c3f6e-2d7a-4b8e-9a51-6f3c2e1d0a99'
+
+
+def bookings(*rows):
+    return pd.DataFrame(list(rows), dtype=object)
+
+
+def booking(**values):
+    row = {'Name': 'Muster', 'Zimmer': 'Doppelzimmer', 'Anreise': '2026-10-16', 'Abreise': '2026-10-18'}
+    row.update(values)
+    return row
+
+
+def test_valid_booking_gets_defaults():
+    valid, guests, errors = prepare_import(bookings(booking()), None, ROOMS)
+    assert errors == []
+    row = valid.iloc[0]
+    assert row['status'] == 'Option'
+    assert row['hp'] == 'Nein'
+    assert row['guests'] == 1
+    assert row['arrival'] == pd.Timestamp('2026-10-16')
+    assert len(row['id']) == 36
+    assert guests.empty
+
+
+def test_swiss_dates_and_menus_imply_half_board():
+    valid, _, errors = prepare_import(bookings(booking(Anreise='16.10.2026', Abreise='18.10.2026', Fleisch='2.0')),
+                                      None, ROOMS)
+    assert errors == []
+    assert valid.iloc[0]['departure'] == pd.Timestamp('2026-10-18')
+    assert valid.iloc[0]['hp'] == 'Ja'
+    assert valid.iloc[0]['hp_fleisch'] == 2
+
+
+def test_invalid_rows_are_reported_with_line_numbers():
+    valid, _, errors = prepare_import(bookings(
+        booking(),
+        booking(Zimmer='Suite'),
+        booking(Abreise='2026-10-16'),
+        booking(Name=' ', Status='Unbekannt'),
+        booking(Personen='0'),
+    ), None, ROOMS)
+    assert len(valid) == 1
+    # Zeile 1 ist die Kopfzeile
+    assert sorted(errors) == sorted([
+        (BOOKING_SHEET, 3, 'Unbekanntes Zimmer'),
+        (BOOKING_SHEET, 4, 'Abreise muss nach der Anreise liegen'),
+        (BOOKING_SHEET, 5, 'Name fehlt'),
+        (BOOKING_SHEET, 5, 'Unbekannter Status'),
+        (BOOKING_SHEET, 6, 'Personen: keine gültige Anzahl'),
+    ])
+
+
+def test_duplicate_and_malformed_booking_numbers():
+    _, _, errors = prepare_import(bookings(
+        booking(Buchungsnummer=BOOKING_ID),
+        booking(Buchungsnummer=BOOKING_ID.upper()),
+        booking(Buchungsnummer='1234'),
+    ), None, ROOMS)
+    assert sorted(errors) == [
+        (BOOKING_SHEET, 2, 'Buchungsnummer mehrfach in der Datei'),
+        (BOOKING_SHEET, 3, 'Buchungsnummer mehrfach in der Datei'),
+        (BOOKING_SHEET, 4, 'Ungültige Buchungsnummer'),
+    ]
+
+
+def test_guests_count_towards_persons():
+    guests = pd.DataFrame([
+        {'Buchungsnummer': BOOKING_ID, 'Name': 'Kind', 'Geburtsdatum': '2015-05-05'},
+        {'Buchungsnummer': 'ffffffff-ffff-4fff-8fff-ffffffffffff', 'Name': 'Fremd', 'Geburtsdatum': None},
+    ], dtype=object)
+    valid, guest_rows, errors = prepare_import(bookings(booking(Buchungsnummer=BOOKING_ID)), guests, ROOMS)
+    assert errors == [(GUEST_SHEET, 3, 'Buchungsnummer nicht im Blatt Buchungen')]
+    assert valid.iloc[0]['guests'] == 2
+    assert list(guest_rows['name']) == ['Kind']
+
+
+def test_more_guests_than_persons():
+    guests = pd.DataFrame([{'Buchungsnummer': BOOKING_ID, 'Name': 'Kind', 'Geburtsdatum': None}] * 2, dtype=object)
+    valid, _, errors = prepare_import(bookings(booking(Buchungsnummer=BOOKING_ID, Personen='2')), guests, ROOMS)
+    assert errors == [(BOOKING_SHEET, 2, 'Mehr Mitreisende als Personen')]
+    assert valid.empty
+
+
+def test_csv_without_required_columns():
+    with pytest.raises(ImportFileError, match='Fehlende Spalten: Zimmer, Anreise, Abreise'):
+        read_import_file(io.BytesIO('Name;Status\nMuster;Option\n'.encode('utf-8')), 'buchungen.csv')
+
+
+def test_unsupported_file_type():
+    with pytest.raises(ImportFileError):
+        read_import_file(io.BytesIO(b'%PDF'), 'buchungen.pdf')
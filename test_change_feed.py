@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from change_feed import ChangeFeed, format_event
+
+
+@pytest.fixture
+def feed():
+    feed = ChangeFeed(connect=None, channel='booking_changes',
+                      build_events=lambda ids: [{'id': booking_id} for booking_id in ids],
+                      max_batch=3, history=5, client_queue_size=3)
+    feed.start = lambda: None  # ohne LISTEN-Thread
+    return feed
+
+
+def drain(client):
+    items = []
+    while not client.empty():
+        items.append(client.get_nowait())
+    return items
+
+
+def test_replay_returns_missed_events(feed):
+    client = feed.subscribe()
+    feed._dispatch(['a'])
+    last_id = drain(client)[-1][0]
+    feed.unsubscribe(client)
+
+    other = feed.subscribe()
+    feed._dispatch(['b', 'c'])
+    assert [name for _, name, _ in drain(feed.subscribe(last_id))] == ['booking', 'booking']
+    feed.unsubscribe(other)
+
+
+@pytest.mark.parametrize('last_event_id', ['garbage', '1-1', f'{os.getpid()}-99'])
+def test_replay_unknown_position_resets(feed, last_event_id):
+    feed.publish('booking', {'id': 'a'})
+    assert feed._replay(last_event_id) == [(None, 'reset', {})]
+
+
+def test_replay_beyond_history_resets(feed):
+    feed.publish('booking', {'id': 'first'})
+    for i in range(10):
+        feed.publish('booking', {'id': i})
+    assert feed._replay(f'{os.getpid()}-1') == [(None, 'reset', {})]
+
+
+def test_changes_without_subscribers_leave_a_reset(feed):
+    client = feed.subscribe()
+    feed._dispatch(['a'])
+    last_id = drain(client)[-1][0]
+    feed.unsubscribe(client)
+
+    # Änderungen, während niemand verbunden ist: nur ein Eintrag in der Historie
+    feed._dispatch(['b'])
+    feed._dispatch(['c'])
+    assert len(feed._history) == 2
+
+    resumed = feed.subscribe(last_id)
+    assert [name for _, name, _ in drain(resumed)] == ['reset']
+
+
+def test_idle_reset_is_recorded_again_after_a_subscription(feed):
+    feed._dispatch(['a'])
+    client = feed.subscribe(f'{os.getpid()}-0')
+    last_id = drain(client)[-1][0]
+    feed.unsubscribe(client)
+
+    feed._dispatch(['b'])
+    assert [name for _, name, _ in drain(feed.subscribe(last_id))] == ['reset']
+
+
+def test_large_batches_become_a_reset(feed):
+    client = feed.subscribe()
+    feed._dispatch(['a', 'b', 'c', 'd'])
+    assert [name for _, name, _ in drain(client)] == ['reset']
+
+
+def test_slow_client_is_closed(feed):
+    client = feed.subscribe()
+    for i in range(4):
+        feed.publish('booking', {'id': i})
+    assert client.closed
+    assert client not in feed._subscribers
+    assert len(drain(client)) == 3
+
+
+def test_format_event():
+    assert format_event(('1-2', 'booking', {'id': 'a'})) == 'id: 1-2\nevent: booking\ndata: {"id":"a"}\n\n'
+    assert format_event((None, 'reset', {})) == 'event: reset\ndata: {}\n\n'
@@ -0,0 +1,146 @@
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+from db_pool import ConnectionPool, PoolError, QueryStats
+
+
+class FakeInfo:
+    transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection")
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = False
+        self.broken = False
+        self.rollbacks = 0
+        self.info = FakeInfo()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def make_pool(monkeypatch):
+    created = []
+
+    def connect(self):
+        conn = FakeConnection()
+        created.append(conn)
+        return conn
+
+    monkeypatch.setattr(ConnectionPool, '_connect', connect)
+
+    def make_pool(**kwargs):
+        kwargs.setdefault('checkout_timeout', 0)
+        pool = ConnectionPool('dbname=test', **kwargs)
+        pool.created = created
+        return pool
+
+    return make_pool
+
+
+def test_connection_is_reused(make_pool):
+    pool = make_pool(minconn=1, maxconn=2)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert pool.stats()['created'] == 1
+
+
+def test_exhausted_pool_raises(make_pool):
+    pool = make_pool(minconn=0, maxconn=2)
+    pool.getconn()
+    pool.getconn()
+    with pytest.raises(PoolError):
+        pool.getconn()
+    assert pool.stats()['exhausted'] == 1
+
+
+def test_foreign_connection_is_rejected(make_pool):
+    pool = make_pool()
+    with pytest.raises(PoolError):
+        pool.putconn(FakeConnection())
+
+
+def test_open_transaction_is_rolled_back_on_return(make_pool):
+    pool = make_pool()
+    conn = pool.getconn()
+    conn.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    pool.putconn(conn)
+    assert conn.rollbacks == 1
+    assert pool.stats()['rollbacks'] == 1
+    assert pool.getconn() is conn
+
+
+def test_connection_is_recycled_after_max_uses(make_pool):
+    pool = make_pool(minconn=0, max_uses=2)
+    first = pool.getconn()
+    pool.putconn(first)
+    assert pool.getconn() is first
+    pool.putconn(first)
+    assert first.closed
+    assert pool.getconn() is not first
+
+
+def test_failed_health_check_replaces_connection(make_pool):
+    pool = make_pool(minconn=1, maxconn=1, health_check_after=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.broken = True
+    replacement = pool.getconn()
+    assert replacement is not conn
+    assert conn.closed
+    assert pool.stats()['health_check_failures'] == 1
+    assert pool.stats()['size'] == 1
+
+
+def test_failed_connect_frees_the_slot(make_pool, monkeypatch):
+    pool = make_pool(minconn=0, maxconn=1)
+
+    def refuse(self):
+        raise psycopg2.OperationalError("connection refused")
+
+    monkeypatch.setattr(ConnectionPool, '_connect', refuse)
+    with pytest.raises(psycopg2.OperationalError):
+        pool.getconn()
+    assert pool.stats()['size'] == 0
+
+
+def test_closed_pool_refuses_checkout(make_pool):
+    pool = make_pool()
+    pool.closeall()
+    with pytest.raises(PoolError):
+        pool.getconn()
+
+
+def test_query_stats_keep_slowest():
+    stats = QueryStats(keep=2)
+    for duration, query in ((0.1, 'SELECT 1'), (0.3, 'SELECT  3'), (0.2, b'SELECT 2')):
+        stats.record(query, duration)
+    assert stats.count == 3
+    assert stats.total == pytest.approx(0.6)
+    assert stats.top() == [(0.3, 'SELECT 3'), (0.2, 'SELECT 2')]
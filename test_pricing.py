@@ -0,0 +1,71 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from pricing import WEEKEND_DAYS, PriceBand, Tariff, count_nights
+
+BANDS = [
+    PriceBand('child_0_5', 0, 5, 0.0, 0.0, 0.0, 0.0),
+    PriceBand('child_6_11', 6, 11, 30.0, 25.0, 1.5, 15.0),
+    PriceBand('child_12_15', 12, 15, 45.0, 40.0, 1.5, 20.0),
+    PriceBand('adult', 16, 200, 110.0, 100.0, 4.0, 35.0),
+]
+
+
+def nights_by_iteration(arrival, departure):
+    weekend = weekday = 0
+    day = arrival
+    while day < departure:
+        if day.weekday() in WEEKEND_DAYS:
+            weekend += 1
+        else:
+            weekday += 1
+        day += timedelta(days=1)
+    return weekend, weekday
+
+
+@pytest.mark.parametrize('start', [date(2026, 10, 12) + timedelta(days=i) for i in range(7)])
+@pytest.mark.parametrize('nights', [0, 1, 2, 6, 7, 8, 15, 30])
+def test_count_nights_matches_iteration(start, nights):
+    departure = start + timedelta(days=nights)
+    assert count_nights(start, departure) == nights_by_iteration(start, departure)
+
+
+def test_count_nights_negative_stay():
+    assert count_nights(date(2026, 10, 20), date(2026, 10, 18)) == (0, 0)
+
+
+def test_band_counts_by_age():
+    tariff = Tariff(BANDS)
+    assert tariff.band_counts([0, 5, 6, 11, 12, 15, 16, 80]) == [2, 2, 2, 2]
+
+
+def test_price_friday_to_sunday_is_weekend():
+    tariff = Tariff(BANDS)
+    # Freitag und Samstag: zwei Wochenendnächte für einen Erwachsenen
+    lodging, kurtaxe, half_board = tariff.price_components(date(2026, 10, 16), date(2026, 10, 18), [0, 0, 0, 1], 'Ja')
+    assert (lodging, kurtaxe, half_board) == (220.0, 8.0, 70.0)
+
+
+def test_price_batch_matches_single_prices():
+    tariff = Tariff(BANDS)
+    rng = random.Random(7)
+    arrivals, departures, counts, hp = [], [], [], []
+    for _ in range(200):
+        arrival = date(2026, 1, 1) + timedelta(days=rng.randrange(365))
+        arrivals.append(arrival)
+        departures.append(arrival + timedelta(days=rng.randrange(-2, 20)))
+        counts.append([rng.randrange(3) for _ in BANDS])
+        hp.append(rng.random() < 0.5)
+
+    batch = tariff.price_batch(arrivals, departures, counts, hp).tolist()
+    single = [tariff.price(a, d, c, 'Ja' if h else 'Nein') for a, d, c, h in zip(arrivals, departures, counts, hp)]
+    assert batch == pytest.approx(single)
+
+
+def test_price_batch_without_dates_is_zero():
+    tariff = Tariff(BANDS)
+    prices = tariff.price_batch([None, date(2026, 10, 16)], [date(2026, 10, 18), None], [[0, 0, 0, 1]] * 2,
+                                [True, True])
+    assert prices.tolist() == [0.0, 0.0]